@@ -1,15 +1,88 @@
-from datetime import datetime, timedelta
-from flask import Flask, request, jsonify
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from flask import Flask, request, jsonify, stream_with_context
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
 import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2.extras import RealDictCursor, execute_values
 import logging
 import pytz
 from urllib.parse import unquote
 import traceback
+import bisect
+from collections import OrderedDict, deque
+import functools
+import gzip
+import hashlib
+import math
+import secrets
+import threading
+import time
 import os
 from dotenv import load_dotenv
+
+try:
+    import brotli  # 可選：安裝後回應壓縮優先使用 brotli
+except ImportError:
+    brotli = None
+
+try:
+    import orjson  # 可選：安裝後 JSON 序列化改用 orjson
+except ImportError:
+    orjson = None
+
+try:
+    from flask_sock import Sock  # 可選：安裝後提供管理員即時推送 WebSocket
+except ImportError:
+    Sock = None
+
+try:
+    import redis  # 可選：設定 RATE_LIMIT_REDIS_URL 後多個程序共用頻率限制計數
+except ImportError:
+    redis = None
+
+# =========== JSON 序列化 ===========
+
+def json_default(obj):
+    """標準 json 無法直接處理的型別：datetime / date 輸出 ISO 8601，Decimal 與 Flask 預設相同輸出字串"""
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    if isinstance(obj, Decimal):
+        return str(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+class FastJSONProvider(DefaultJSONProvider):
+    """
+    優先使用 orjson 序列化回應，未安裝時退回標準 json
+    兩者的 datetime 都輸出 ISO 8601（與 .isoformat() 相同），列表端點可直接放入資料庫的 datetime
+    """
+    default = staticmethod(json_default)
+    
+    def dumps(self, obj, **kwargs):
+        if orjson is None or kwargs:
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=json_default, option=self._orjson_options()).decode('utf-8')
+    
+    def response(self, *args, **kwargs):
+        # 一律輸出精簡格式（除錯模式也不縮排），與標準 json 路徑的內容相同
+        if orjson is None:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(
+            orjson.dumps(obj, default=json_default, option=self._orjson_options()),
+            mimetype=self.mimetype
+        )
+    
+    def _orjson_options(self):
+        # 與標準 json 一致：允許非字串鍵，並依設定排序鍵
+        options = orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            options |= orjson.OPT_SORT_KEYS
+        return options
+
 app = Flask(__name__)
+app.json = FastJSONProvider(app)
+sock = Sock(app) if Sock is not None else None
 # 配置CORS，允許所有源和方法
 CORS(app, supports_credentials=True, origins="*", methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"])
 
@@ -103,11 +176,51 @@ def get_db_conn():
 
 # =========== 使用者API ===========
 
+# 登入快取：NextAuth 每次刷新 session 都會呼叫 POST /users，短時間內直接返回快取的角色
+USER_LOGIN_CACHE_TTL_SECONDS = 60
+USER_LOGIN_CACHE_MAX_ENTRIES = 10000
+_user_login_cache = {}
+_user_login_cache_lock = threading.Lock()
+
+# 批量匯入用戶一次允許的最大筆數
+MAX_USER_IMPORT_ROWS = 20000
+
+def get_cached_user_role(email):
+    """從登入快取取得用戶角色，過期或不存在時返回 None"""
+    with _user_login_cache_lock:
+        entry = _user_login_cache.get(email)
+        if entry is None:
+            return None
+        role, expires_at = entry
+        if expires_at <= time.monotonic():
+            del _user_login_cache[email]
+            return None
+        return role
+
+def set_cached_user_role(email, role):
+    """寫入登入快取"""
+    with _user_login_cache_lock:
+        if len(_user_login_cache) >= USER_LOGIN_CACHE_MAX_ENTRIES:
+            now = time.monotonic()
+            for cached_email in [e for e, (_, expires_at) in _user_login_cache.items() if expires_at <= now]:
+                del _user_login_cache[cached_email]
+            if len(_user_login_cache) >= USER_LOGIN_CACHE_MAX_ENTRIES:
+                _user_login_cache.clear()
+        _user_login_cache[email] = (role, time.monotonic() + USER_LOGIN_CACHE_TTL_SECONDS)
+
+def invalidate_user_login_cache(email=None):
+    """角色變更後清除登入快取；email 為 None 時清除全部"""
+    with _user_login_cache_lock:
+        if email is None:
+            _user_login_cache.clear()
+        else:
+            _user_login_cache.pop(email, None)
+
 @app.route('/users', methods=['POST'])
 def create_or_get_user():
-    print("收到 POST /users 請求")
     """
     前端傳name, email。沒有就建立，有就回傳role
+    以單一 upsert 完成，同時更新 last_login；短時間內重複登入直接使用快取
     """
     data = request.get_json()
     name = data.get('name')
@@ -115,31 +228,42 @@ def create_or_get_user():
     if not name or not email:
         return jsonify({'error': 'Missing name or email'}), 400
 
+    cached_role = get_cached_user_role(email)
+    if cached_role is not None:
+        return jsonify({'role': cached_role}), 200
+
     try:
         conn = get_db_conn()
         cur = conn.cursor(cursor_factory=RealDictCursor)
-        # 查詢是否已存在
-        cur.execute("SELECT id, role FROM users WHERE email = %s", (email,))
+        # 不存在就新增，存在就更新最後登入時間；xmax = 0 表示這一列是新插入的
+        cur.execute("""
+            INSERT INTO users (name, email, last_login)
+            VALUES (%s, %s, %s)
+            ON CONFLICT (email) DO UPDATE SET last_login = EXCLUDED.last_login
+            RETURNING role, (xmax = 0) AS inserted
+        """, (name, email, get_taipei_now().replace(tzinfo=None)))
         user = cur.fetchone()
-        print("查詢 user:", user)
-        if user:
-            # 已存在
-            return jsonify({'role': user['role']}), 200
-        # 新增
-        cur.execute(
-            "INSERT INTO users (name, email) VALUES (%s, %s) RETURNING role",
-            (name, email)
-        )
-        role = cur.fetchone()['role']
         conn.commit()
-        print("Insert Success!")
-        return jsonify({'role': role}), 201
-    except Exception as e:
-        print(e)
+        
+        set_cached_user_role(email, user['role'])
+        
+        if user['inserted']:
+            logger.info(f"Created user {email}")
+            return jsonify({'role': user['role']}), 201
+        return jsonify({'role': user['role']}), 200
+    except psycopg2.Error as e:
+        logger.error(f"Database error: {e}")
+        if 'conn' in locals():
+            conn.rollback()
         return jsonify({'error': 'Database error', 'detail': str(e)}), 500
+    except Exception as e:
+        logger.error(f"Unexpected error: {e}")
+        return jsonify({'error': 'Internal server error', 'detail': str(e)}), 500
     finally:
-        cur.close()
-        conn.close()
+        if 'cur' in locals():
+            cur.close()
+        if 'conn' in locals():
+            conn.close()
 
 @app.route('/users/role', methods=['PUT'])
 def update_user_role():
@@ -205,6 +329,7 @@ def update_user_role():
         
         updated_role = cur.fetchone()['role']
         conn.commit()
+        invalidate_user_login_cache(decoded_target_email)
         
         logger.info(f"Admin {admin_email} updated user {decoded_target_email} role from {current_target_role} to {updated_role}")
         
@@ -225,9 +350,543 @@ def update_user_role():
         if 'conn' in locals():
             conn.close()
 
+@app.route('/admin/users/import', methods=['POST'])
+def import_users():
+    """
+    批量匯入用戶（預先建立整個年級的帳號）
+    傳送 JSON {users: [{name, email, role}]}，或 text/csv 內容（欄位：name,email,role）
+    使用 COPY 寫入暫存表後一次 INSERT，已存在的用戶不會被修改
+    需要manager或admin權限，manager不能匯入admin角色
+    """
+    try:
+        # 從header獲取管理員email
+        admin_email = request.headers.get('X-Admin-Email', '')
+        is_authorized, admin_role = verify_admin_permission(admin_email)
+        
+        if not is_authorized:
+            return jsonify({'error': 'Access denied. Manager or admin role required.'}), 403
+        
+        import csv
+        import io
+        
+        if request.mimetype == 'text/csv':
+            reader = csv.reader(io.StringIO(request.get_data(as_text=True)))
+            rows = [row for row in reader if row]
+            # 略過標題列
+            if rows and [col.strip().lower() for col in rows[0][:2]] == ['name', 'email']:
+                rows = rows[1:]
+            users = [
+                {'name': row[0], 'email': row[1] if len(row) > 1 else '', 'role': row[2] if len(row) > 2 else ''}
+                for row in rows
+            ]
+        else:
+            data = request.get_json() or {}
+            users = data.get('users')
+            if not isinstance(users, list):
+                return jsonify({'error': 'Missing users'}), 400
+        
+        if len(users) > MAX_USER_IMPORT_ROWS:
+            return jsonify({'error': f'Too many users, at most {MAX_USER_IMPORT_ROWS} per import'}), 400
+        
+        valid_rows = []
+        invalid = []
+        for index, user in enumerate(users):
+            name = (user.get('name') or '').strip() if isinstance(user, dict) else ''
+            email = (user.get('email') or '').strip() if isinstance(user, dict) else ''
+            role = ((user.get('role') or '').strip() or 'user') if isinstance(user, dict) else 'user'
+            
+            if not name or not email or '@' not in email:
+                invalid.append({'index': index, 'email': email, 'reason': 'Missing name or invalid email'})
+            elif role not in ['user', 'manager', 'admin']:
+                invalid.append({'index': index, 'email': email, 'reason': 'Invalid role'})
+            elif admin_role == 'manager' and role == 'admin':
+                invalid.append({'index': index, 'email': email, 'reason': 'Managers cannot assign admin role'})
+            else:
+                valid_rows.append((index, name, email, role))
+        
+        conn = get_db_conn()
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        
+        imported_emails = []
+        if valid_rows:
+            buffer = io.StringIO()
+            csv.writer(buffer).writerows(valid_rows)
+            buffer.seek(0)
+            
+            cur.execute("""
+                CREATE TEMP TABLE user_import (
+                    line_no INTEGER NOT NULL,
+                    name TEXT NOT NULL,
+                    email TEXT NOT NULL,
+                    role TEXT NOT NULL
+                ) ON COMMIT DROP
+            """)
+            cur.copy_expert("COPY user_import (line_no, name, email, role) FROM STDIN WITH (FORMAT csv)", buffer)
+            
+            # 同一份名單內重複的email只取最前面的一筆（依原始順序 line_no），已存在的用戶保持不變
+            cur.execute("""
+                INSERT INTO users (name, email, role)
+                SELECT DISTINCT ON (email) name, email, role
+                FROM user_import
+                ORDER BY email, line_no
+                ON CONFLICT (email) DO NOTHING
+                RETURNING email
+            """)
+            imported_emails = [row['email'] for row in cur.fetchall()]
+        
+        conn.commit()
+        
+        logger.info(f"Admin {admin_email} imported {len(imported_emails)} users ({len(valid_rows) - len(imported_emails)} skipped, {len(invalid)} invalid)")
+        
+        return jsonify({
+            'success': True,
+            'total': len(users),
+            'imported': len(imported_emails),
+            'skipped_existing': len(valid_rows) - len(imported_emails),
+            'invalid': invalid,
+            'imported_emails': imported_emails
+        }), 200
+
+    except psycopg2.Error as e:
+        logger.error(f"Database error: {e}")
+        if 'conn' in locals():
+            conn.rollback()
+        return jsonify({'error': 'Database error', 'detail': str(e)}), 500
+    except Exception as e:
+        logger.error(f"Unexpected error: {e}")
+        return jsonify({'error': 'Internal server error', 'detail': str(e)}), 500
+    finally:
+        if 'cur' in locals():
+            cur.close()
+        if 'conn' in locals():
+            conn.close()
+
 # =========== Booking API ===========
 
+# 冪等鍵：同一個 Idempotency-Key 在有效期內重送時，直接回放第一次的回應
+IDEMPOTENCY_KEY_TTL_HOURS = 24
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+IDEMPOTENCY_CLEANUP_BATCH_SIZE = 100
+# 佔用後超過此秒數仍未完成（例如程序中途終止），視為失效可重新佔用
+IDEMPOTENCY_PENDING_TIMEOUT_SECONDS = 300
+# 計算請求指紋時忽略的欄位（前端每次送出都會重新產生）
+IDEMPOTENCY_IGNORED_FIELDS = ['created_at']
+
+def compute_idempotency_request_hash():
+    """計算請求內容的指紋，用來確認重送的是同一個請求"""
+    import json
+    data = request.get_json(silent=True)
+    if isinstance(data, dict):
+        data = {key: value for key, value in data.items() if key not in IDEMPOTENCY_IGNORED_FIELDS}
+        payload = json.dumps(data, sort_keys=True, ensure_ascii=False)
+    else:
+        payload = request.get_data(as_text=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def idempotent(view_func):
+    """
+    為寫入端點加上 Idempotency-Key 支援
+    - 第一次請求先佔用鍵值再執行，完成後保存回應（5xx 不保存，允許重試）
+    - 之後帶相同鍵值的請求直接回放保存的回應，不再重新執行檢查
+    - 同一鍵值但內容不同返回 422；第一次請求仍在處理中返回 409
+    """
+    @functools.wraps(view_func)
+    def wrapper(*args, **kwargs):
+        idempotency_key = request.headers.get('Idempotency-Key', '').strip()
+        if not idempotency_key:
+            return view_func(*args, **kwargs)
+        
+        if len(idempotency_key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+            return jsonify({
+                'success': False,
+                'error': '冪等鍵格式錯誤',
+                'error_type': 'invalid_idempotency_key',
+                'message': f'Idempotency-Key 長度不可超過{IDEMPOTENCY_KEY_MAX_LENGTH}字元'
+            }), 400
+        
+        endpoint = request.endpoint
+        request_hash = compute_idempotency_request_hash()
+        
+        # 佔用鍵值後立即歸還連線：被包裝的端點可能在准入佇列中等待，不應佔著資料庫連線
+        storage_available = True
+        try:
+            conn = get_db_conn()
+            cur = conn.cursor(cursor_factory=RealDictCursor)
+            now = get_taipei_now().replace(tzinfo=None)
+            
+            # 佔用鍵值：不存在就新增，已過期或處理中斷的就重新佔用
+            cur.execute("""
+                INSERT INTO idempotency_keys (idempotency_key, endpoint, request_hash, created_at, expires_at)
+                VALUES (%s, %s, %s, %s, %s)
+                ON CONFLICT (idempotency_key, endpoint) DO UPDATE
+                SET request_hash = EXCLUDED.request_hash,
+                    status_code = NULL,
+                    response_body = NULL,
+                    created_at = EXCLUDED.created_at,
+                    expires_at = EXCLUDED.expires_at
+                WHERE idempotency_keys.expires_at < EXCLUDED.created_at
+                OR (idempotency_keys.status_code IS NULL AND idempotency_keys.created_at < %s)
+                RETURNING idempotency_key
+            """, (
+                idempotency_key, endpoint, request_hash, now, now + timedelta(hours=IDEMPOTENCY_KEY_TTL_HOURS),
+                now - timedelta(seconds=IDEMPOTENCY_PENDING_TIMEOUT_SECONDS)
+            ))
+            claimed = cur.fetchone() is not None
+            
+            if claimed:
+                # 順便清理少量過期鍵值，避免表無限成長
+                cur.execute("""
+                    DELETE FROM idempotency_keys
+                    WHERE ctid IN (
+                        SELECT ctid FROM idempotency_keys
+                        WHERE expires_at < %s
+                        LIMIT %s
+                    )
+                """, (now, IDEMPOTENCY_CLEANUP_BATCH_SIZE))
+                conn.commit()
+            else:
+                cur.execute("""
+                    SELECT request_hash, status_code, response_body
+                    FROM idempotency_keys
+                    WHERE idempotency_key = %s AND endpoint = %s
+                """, (idempotency_key, endpoint))
+                stored = cur.fetchone()
+                
+                if stored and stored['request_hash'] != request_hash:
+                    return jsonify({
+                        'success': False,
+                        'error': '冪等鍵已被使用',
+                        'error_type': 'idempotency_key_reused',
+                        'message': '此 Idempotency-Key 已用於內容不同的請求，請使用新的鍵值'
+                    }), 422
+                
+                if stored and stored['status_code'] is not None:
+                    logger.info(f"Replaying stored response for idempotency key {idempotency_key} on {endpoint}")
+                    response = app.response_class(
+                        stored['response_body'], status=stored['status_code'], mimetype='application/json'
+                    )
+                    response.headers['Idempotent-Replayed'] = 'true'
+                    return response
+                
+                response = jsonify({
+                    'success': False,
+                    'error': '請求處理中',
+                    'error_type': 'idempotency_in_progress',
+                    'message': '相同的請求正在處理中，請稍後再試'
+                })
+                response.headers['Retry-After'] = '1'
+                return response, 409
+
+        except psycopg2.Error as e:
+            # 冪等鍵儲存失敗時不影響原本的請求處理
+            logger.error(f"Idempotency key storage error: {e}")
+            if 'conn' in locals():
+                conn.rollback()
+            storage_available = False
+        finally:
+            if 'cur' in locals():
+                cur.close()
+            if 'conn' in locals():
+                conn.close()
+        
+        if not storage_available:
+            return view_func(*args, **kwargs)
+        
+        response = app.make_response(view_func(*args, **kwargs))
+        
+        # 以新的連線保存結果（先移除已關閉的連線，避免下方 finally 誤用）
+        del conn, cur
+        try:
+            conn = get_db_conn()
+            cur = conn.cursor(cursor_factory=RealDictCursor)
+            
+            if response.status_code >= 500:
+                # 伺服器錯誤不保存，釋放鍵值讓重試重新執行
+                cur.execute("""
+                    DELETE FROM idempotency_keys WHERE idempotency_key = %s AND endpoint = %s
+                """, (idempotency_key, endpoint))
+            else:
+                cur.execute("""
+                    UPDATE idempotency_keys
+                    SET status_code = %s, response_body = %s
+                    WHERE idempotency_key = %s AND endpoint = %s
+                """, (response.status_code, response.get_data(as_text=True), idempotency_key, endpoint))
+            conn.commit()
+        except psycopg2.Error as e:
+            # 保存失敗時鍵值會在逾時後失效，回應照常返回
+            logger.error(f"Idempotency key storage error: {e}")
+            if 'conn' in locals():
+                conn.rollback()
+        finally:
+            if 'cur' in locals():
+                cur.close()
+            if 'conn' in locals():
+                conn.close()
+        
+        return response
+    
+    return wrapper
+
+# 預約准入控制：搶約高峰時每台機器只放行少量寫入同時執行，其餘請求在程序內排隊
+# 佇列依用戶輪流放行（同一用戶的請求先到先處理），單一用戶連點無法佔滿佇列；
+# 已知被預約的時段直接拒絕，不必取得資料庫連線
+BOOKING_ADMISSION_CONCURRENCY = 2
+BOOKING_ADMISSION_QUEUE_LIMIT = 100
+BOOKING_ADMISSION_USER_QUEUE_LIMIT = 2
+BOOKING_ADMISSION_WAIT_SECONDS = 10
+BOOKING_ADMISSION_RETRY_AFTER_SECONDS = 2
+# 已佔用時段的記憶期限；其他程序的取消由 LISTEN/NOTIFY 清除，監聽停用時靠此期限收斂
+BOOKING_OCCUPANCY_TTL_SECONDS = 30
+
+_admission_lock = threading.Lock()
+# machine_id -> 名額、等待佇列（OrderedDict: user_email -> deque[Event]）與計數
+_admission_states = {}
+# machine_id -> {naive time_slot: 到期的 monotonic 時間}
+_booking_occupancy = {}
+
+def get_admission_state(machine_id):
+    """取得機器的准入狀態，呼叫端須持有 _admission_lock"""
+    state = _admission_states.get(machine_id)
+    if state is None:
+        state = _admission_states[machine_id] = {
+            'active': 0,
+            'waiting': OrderedDict(),
+            'queued': 0,
+            'max_queued': 0,
+            'admitted': 0,
+            'rejected_queue_full': 0,
+            'rejected_user_limit': 0,
+            'rejected_occupied': 0,
+            'timed_out': 0,
+            'wait_seconds_total': 0.0
+        }
+    return state
+
+def find_occupied_slots(machine_id, naive_time_slots):
+    """返回記憶中已被預約的時段，有命中時計入提早拒絕次數"""
+    now = time.monotonic()
+    with _admission_lock:
+        marks = _booking_occupancy.get(machine_id)
+        if not marks:
+            return []
+        occupied = sorted(slot for slot in set(naive_time_slots) if marks.get(slot, 0) > now)
+        if occupied:
+            get_admission_state(machine_id)['rejected_occupied'] += 1
+        return occupied
+
+def mark_slots_occupied(machine_id, naive_time_slots):
+    """記住已確定被預約的時段，並順便移除過期記錄"""
+    now = time.monotonic()
+    with _admission_lock:
+        marks = _booking_occupancy.setdefault(machine_id, {})
+        for slot in [slot for slot, expires in marks.items() if expires <= now]:
+            del marks[slot]
+        for slot in naive_time_slots:
+            marks[slot] = now + BOOKING_OCCUPANCY_TTL_SECONDS
+
+def clear_booking_occupancy(machine_id=None):
+    """預約被取消或刪除時清除記憶，未指定機器時全部清除"""
+    with _admission_lock:
+        if machine_id is None:
+            _booking_occupancy.clear()
+        else:
+            _booking_occupancy.pop(str(machine_id), None)
+
+def acquire_booking_admission(machine_id, user_email):
+    """
+    取得機器的寫入名額，名額用完時排隊等待
+    返回：(admitted, reject_reason)，reject_reason 為 'queue_full'、'user_limit' 或 'timeout'
+    """
+    started = time.monotonic()
+    with _admission_lock:
+        state = get_admission_state(machine_id)
+        if state['active'] < BOOKING_ADMISSION_CONCURRENCY and not state['waiting']:
+            state['active'] += 1
+            state['admitted'] += 1
+            return True, None
+        
+        if state['queued'] >= BOOKING_ADMISSION_QUEUE_LIMIT:
+            state['rejected_queue_full'] += 1
+            return False, 'queue_full'
+        
+        user_queue = state['waiting'].get(user_email)
+        if user_queue is not None and len(user_queue) >= BOOKING_ADMISSION_USER_QUEUE_LIMIT:
+            state['rejected_user_limit'] += 1
+            return False, 'user_limit'
+        
+        ticket = threading.Event()
+        if user_queue is None:
+            user_queue = state['waiting'][user_email] = deque()
+        user_queue.append(ticket)
+        state['queued'] += 1
+        state['max_queued'] = max(state['max_queued'], state['queued'])
+    
+    ticket.wait(BOOKING_ADMISSION_WAIT_SECONDS)
+    
+    with _admission_lock:
+        # 逾時與放行可能同時發生，以 ticket 狀態為準
+        if not ticket.is_set():
+            user_queue = state['waiting'].get(user_email)
+            if user_queue is not None:
+                user_queue.remove(ticket)
+                if not user_queue:
+                    del state['waiting'][user_email]
+            state['queued'] -= 1
+            state['timed_out'] += 1
+            return False, 'timeout'
+        
+        state['wait_seconds_total'] += time.monotonic() - started
+        return True, None
+
+def release_booking_admission(machine_id):
+    """歸還寫入名額：有人等待時直接轉交給下一位用戶的最早請求"""
+    with _admission_lock:
+        state = get_admission_state(machine_id)
+        if not state['waiting']:
+            state['active'] -= 1
+            return
+        
+        user_email, user_queue = next(iter(state['waiting'].items()))
+        ticket = user_queue.popleft()
+        if user_queue:
+            # 同一用戶還有請求時排到其他用戶之後
+            state['waiting'].move_to_end(user_email)
+        else:
+            del state['waiting'][user_email]
+        state['queued'] -= 1
+        state['admitted'] += 1
+        ticket.set()
+
+def get_booking_admission_metrics():
+    """各機器的佇列深度與准入計數"""
+    with _admission_lock:
+        machines = []
+        for machine_id, state in _admission_states.items():
+            machines.append({
+                'machine_id': machine_id,
+                'active': state['active'],
+                'queued': state['queued'],
+                'queued_users': len(state['waiting']),
+                'max_queued': state['max_queued'],
+                'admitted': state['admitted'],
+                'rejected_queue_full': state['rejected_queue_full'],
+                'rejected_user_limit': state['rejected_user_limit'],
+                'rejected_occupied': state['rejected_occupied'],
+                'timed_out': state['timed_out'],
+                'avg_wait_ms': round(state['wait_seconds_total'] * 1000 / state['admitted'], 1) if state['admitted'] else 0.0,
+                'occupied_slots_known': len(_booking_occupancy.get(machine_id, {}))
+            })
+    machines.sort(key=lambda item: int(item['machine_id']))
+    return {
+        'machines': machines,
+        'total_active': sum(item['active'] for item in machines),
+        'total_queued': sum(item['queued'] for item in machines),
+        'limits': {
+            'concurrency': BOOKING_ADMISSION_CONCURRENCY,
+            'queue_limit': BOOKING_ADMISSION_QUEUE_LIMIT,
+            'user_queue_limit': BOOKING_ADMISSION_USER_QUEUE_LIMIT,
+            'wait_seconds': BOOKING_ADMISSION_WAIT_SECONDS,
+            'occupancy_ttl_seconds': BOOKING_OCCUPANCY_TTL_SECONDS
+        }
+    }
+
+def build_occupied_slots_response(occupied_slots):
+    """提早拒絕已被預約的時段，格式與寫入端點的 time_slot_occupied 一致"""
+    formatted = [TAIPEI_TZ.localize(slot).strftime("%Y/%m/%d %H:%M") for slot in occupied_slots]
+    return jsonify({
+        'success': False,
+        'error': '時段已被預約',
+        'error_type': 'time_slot_occupied',
+        'message': f'以下時段已被預約：{"、".join(formatted)}',
+        'conflicting_slots': formatted
+    }), 409
+
+def booking_admission(view_func):
+    """
+    預約寫入端點的准入控制
+    - 記憶中已被預約的時段直接返回 409，排隊放行後再檢查一次
+    - 依機器排隊取得寫入名額；佇列已滿或等待逾時返回 503，同一用戶排隊過多返回 429
+    - 寫入成功或確認時段已被預約後，記住該時段供後續請求提早拒絕
+    請求內容無法辨識機器時直接交給原本的端點驗證
+    """
+    @functools.wraps(view_func)
+    def wrapper(*args, **kwargs):
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict) or not str(data.get('machine_id') or '').isdigit():
+            return view_func(*args, **kwargs)
+        
+        machine_id = str(data['machine_id'])
+        user_email = str(data.get('user_email') or '').strip().lower()
+        time_slot_strs = data.get('time_slots') if isinstance(data.get('time_slots'), list) else [data.get('time_slot')]
+        naive_time_slots = []
+        for time_slot_str in time_slot_strs:
+            time_slot = parse_time_slot(time_slot_str) if isinstance(time_slot_str, str) else None
+            if time_slot:
+                naive_time_slots.append(time_slot.replace(tzinfo=None))
+        
+        occupied_slots = find_occupied_slots(machine_id, naive_time_slots)
+        if occupied_slots:
+            return build_occupied_slots_response(occupied_slots)
+        
+        admitted, reject_reason = acquire_booking_admission(machine_id, user_email)
+        if not admitted:
+            logger.warning(f"Booking admission rejected ({reject_reason}): Machine {machine_id}, User {user_email}")
+            if reject_reason == 'user_limit':
+                response = jsonify({
+                    'success': False,
+                    'error': '請求過於頻繁',
+                    'error_type': 'too_many_pending_requests',
+                    'message': '您已有預約請求正在處理中，請稍候再試'
+                })
+                response.headers['Retry-After'] = str(BOOKING_ADMISSION_RETRY_AFTER_SECONDS)
+                return response, 429
+            response = jsonify({
+                'success': False,
+                'error': '預約人數過多',
+                'error_type': 'booking_queue_full' if reject_reason == 'queue_full' else 'booking_queue_timeout',
+                'message': '目前預約此機器的人數過多，請稍後再試'
+            })
+            response.headers['Retry-After'] = str(BOOKING_ADMISSION_RETRY_AFTER_SECONDS)
+            return response, 503
+        
+        try:
+            # 排隊期間時段可能已被搶先預約
+            occupied_slots = find_occupied_slots(machine_id, naive_time_slots)
+            if occupied_slots:
+                return build_occupied_slots_response(occupied_slots)
+            response = app.make_response(view_func(*args, **kwargs))
+        finally:
+            release_booking_admission(machine_id)
+        
+        if response.status_code == 201:
+            mark_slots_occupied(machine_id, naive_time_slots)
+        elif response.status_code == 409 and len(naive_time_slots) == 1:
+            # 批量預約的衝突只涉及部分時段，只有單一時段時才能確定
+            result = response.get_json(silent=True) or {}
+            if result.get('error_type') in ['time_slot_occupied', 'database_conflict']:
+                mark_slots_occupied(machine_id, naive_time_slots)
+        
+        return response
+    
+    return wrapper
+
+@app.route('/admin/booking-admission/metrics', methods=['GET'])
+def get_booking_admission_metrics_api():
+    """
+    管理員查看預約准入佇列的即時狀態（本程序）
+    只有manager和admin角色可以訪問
+    """
+    admin_email = request.headers.get('X-Admin-Email', '')
+    is_authorized, admin_role = verify_admin_permission(admin_email)
+    
+    if not is_authorized:
+        return jsonify({'error': 'Access denied. Manager or admin role required.'}), 403
+    
+    return jsonify({**get_booking_admission_metrics(), 'pid': os.getpid()}), 200
+
 @app.route('/bookings', methods=['POST'])
+@idempotent
+@booking_admission
 def create_booking():
     """
     創建預約：傳送 user_email, machine_id, time_slot, created_at, status
@@ -310,7 +969,10 @@ def create_booking():
         cur = conn.cursor(cursor_factory=RealDictCursor)
         
         # 先檢查機器是否存在且可用
-        cur.execute("SELECT id, name, status, restriction_status FROM machines WHERE id = %s", (machine_id,))
+        cur.execute("""
+            SELECT id, name, status, restriction_status, maintenance_start, maintenance_end, maintenance_window_note
+            FROM machines WHERE id = %s
+        """, (machine_id,))
         machine = cur.fetchone()
         
         if not machine:
@@ -350,6 +1012,25 @@ def create_booking():
                 'machine_name': machine['name']
             }), 403
         
+        naive_time_slot = time_slot.replace(tzinfo=None)
+        maintenance_slots = find_maintenance_slots(machine, [naive_time_slot])
+        if maintenance_slots:
+            return build_maintenance_conflict_response(machine, maintenance_slots)
+        
+        # 先在本交易內佔住時段暫留：其他用戶確認中的時段直接拒絕，
+        # 同時讓同一時段的並行預約在此排隊，後到者會看到先到者已提交的預約
+        held_slots = claim_slot_holds(cur, user_email, machine_id, [naive_time_slot], secrets.token_urlsafe(16))
+        if held_slots:
+            logger.info(f"Time slot held by another user: Machine {machine_id}, Time {time_slot}")
+            return jsonify({
+                'success': False,
+                'error': '時段確認中',
+                'error_type': 'slot_held',
+                'message': '此時段正由其他用戶確認預約中，請稍後再試或選擇其他時段',
+                'time_slot': time_slot.strftime("%Y/%m/%d %H:%M"),
+                'machine_name': machine['name']
+            }), 409
+        
         # 檢查該時段是否有 'active' 狀態的預約
         cur.execute("""
             SELECT id, user_email FROM bookings
@@ -457,7 +1138,10 @@ def create_booking():
                 conn.rollback()
                 raise Exception(f"Failed to record machine usage: {str(usage_error)}")
             
+            # 預約成立，消耗本人的時段暫留
+            release_slot_holds(cur, user_email=user_email, machine_id=machine_id, naive_time_slots=[naive_time_slot])
             conn.commit()
+            publish_booking_changes([{'user_email': user_email, 'machine_id': machine_id}])
             
             logger.info(f"New booking created successfully: ID {booking_id}, User: {user_email}, Machine: {machine_id}, Time: {time_slot}")
             
@@ -501,7 +1185,9 @@ def create_booking():
                 """, (user_email, created_at.replace(tzinfo=None), created_at.replace(tzinfo=None), cancelled_booking['id']))
                 
                 booking_id = cur.fetchone()['id']
+                release_slot_holds(cur, user_email=user_email, machine_id=machine_id, naive_time_slots=[naive_time_slot])
                 conn.commit()
+                publish_booking_changes([{'user_email': user_email, 'machine_id': machine_id}])
                 
                 logger.info(f"Reactivated cancelled booking: ID {booking_id}, User: {user_email}, Machine: {machine_id}, Time: {time_slot}")
                 
@@ -554,298 +1240,1794 @@ def create_booking():
         if 'conn' in locals():
             conn.close()
 
-@app.route('/bookings/<int:booking_id>', methods=['DELETE'])
-def cancel_booking(booking_id):
+# 單次批量預約允許的最大時段數（7天 x 每天6個時段）
+MAX_BATCH_BOOKING_SLOTS = 42
+
+@app.route('/bookings/batch', methods=['POST'])
+@idempotent
+@booking_admission
+def create_batch_booking():
     """
-    取消預約 - 將狀態設為 'cancelled' 而不是刪除記錄
-    需要用戶郵箱驗證確保只能取消自己的預約
+    批量預約：同一台機器一次預約多個 4 小時時段
+    傳送 user_email, machine_id, time_slots (列表), created_at
+    所有時段合併後只做一次滾動窗口檢查，以多列 INSERT 一次寫入預約與使用記錄
+    全部成功才提交，任何一個時段失敗則整批回滾
     """
     try:
         data = request.get_json()
         user_email = data.get('user_email')
-        
-        if not user_email:
+        machine_id = data.get('machine_id')
+        time_slot_strs = data.get('time_slots') or []
+        created_at_str = data.get('created_at')
+
+        # 驗證必要欄位
+        if not user_email or not machine_id or not time_slot_strs or not created_at_str:
             return jsonify({
                 'success': False,
-                'error': '缺少用戶信箱',
-                'error_type': 'missing_user_email',
-                'message': '請提供用戶信箱以驗證取消權限'
+                'error': '缺少必要資料',
+                'error_type': 'missing_fields',
+                'message': '請提供完整的預約資訊（用戶信箱、機器編號、時段列表、創建時間）',
+                'details': {
+                    'user_email': bool(user_email),
+                    'machine_id': bool(machine_id),
+                    'time_slots': bool(time_slot_strs),
+                    'created_at': bool(created_at_str)
+                }
+            }), 400
+
+        if not isinstance(time_slot_strs, list) or len(time_slot_strs) > MAX_BATCH_BOOKING_SLOTS:
+            return jsonify({
+                'success': False,
+                'error': '時段數量無效',
+                'error_type': 'invalid_slot_count',
+                'message': f'時段列表必須為陣列，且一次最多預約{MAX_BATCH_BOOKING_SLOTS}個時段',
+                'max_slots': MAX_BATCH_BOOKING_SLOTS
+            }), 400
+
+        try:
+            created_at = datetime.strptime(created_at_str, "%Y-%m-%d %H:%M:%S")
+            created_at = TAIPEI_TZ.localize(created_at)  # 設定為台北時區
+        except Exception:
+            return jsonify({
+                'success': False,
+                'error': '創建時間格式錯誤',
+                'error_type': 'invalid_created_at_format',
+                'message': '創建時間格式必須為 YYYY-MM-DD HH:MM:SS',
+                'provided_format': created_at_str
             }), 400
+
+        # 解析並驗證每個時段
+        current_taipei_time = get_taipei_now()
+        time_slots = []
+        for time_slot_str in time_slot_strs:
+            time_slot = parse_time_slot(time_slot_str)
+            if not time_slot:
+                return jsonify({
+                    'success': False,
+                    'error': '時段格式錯誤',
+                    'error_type': 'invalid_time_format',
+                    'message': '時段格式必須為 YYYY/MM/DD/HH 或 YYYY-MM-DD HH:MM:SS',
+                    'provided_format': time_slot_str
+                }), 400
+            
+            if time_slot + timedelta(hours=4) <= current_taipei_time:
+                return jsonify({
+                    'success': False,
+                    'error': '無法預約過去的時段',
+                    'error_type': 'past_time_slot',
+                    'message': f'您選擇的時段 {time_slot.strftime("%Y/%m/%d %H:%M")} 已經過去，請選擇未來的時段',
+                    'current_time': current_taipei_time.strftime("%Y/%m/%d %H:%M"),
+                    'selected_time': time_slot.strftime("%Y/%m/%d %H:%M")
+                }), 400
+            
+            if time_slot.hour not in [0, 4, 8, 12, 16, 20]:
+                valid_hours = ['00:00', '04:00', '08:00', '12:00', '16:00', '20:00']
+                return jsonify({
+                    'success': False,
+                    'error': '無效的預約時段',
+                    'error_type': 'invalid_time_slot',
+                    'message': f'預約時段必須為4小時區塊的開始時間：{", ".join(valid_hours)}',
+                    'selected_hour': f'{time_slot.hour:02d}:00',
+                    'valid_hours': valid_hours
+                }), 400
+            
+            if time_slot not in time_slots:
+                time_slots.append(time_slot)
         
+        time_slots.sort()
+        naive_time_slots = [time_slot.replace(tzinfo=None) for time_slot in time_slots]
+
         conn = get_db_conn()
         cur = conn.cursor(cursor_factory=RealDictCursor)
         
-        # 檢查預約是否存在且屬於該用戶
-        cur.execute("""
-            SELECT 
-                b.id, 
-                b.user_email, 
-                b.status, 
-                b.time_slot,
-                m.name as machine_name
-            FROM bookings b
-            JOIN machines m ON b.machine_id = m.id
-            WHERE b.id = %s
-        """, (booking_id,))
-        
-        booking = cur.fetchone()
+        # 機器資訊與生效中的限制規則一次取回
+        machines = fetch_machines_with_restrictions(cur, machine_id=machine_id)
         
-        if not booking:
+        if not machines:
             return jsonify({
                 'success': False,
-                'error': '預約不存在',
-                'error_type': 'booking_not_found',
-                'message': f'找不到預約編號 {booking_id}，請檢查預約編號是否正確',
-                'booking_id': booking_id
+                'error': '機器不存在',
+                'error_type': 'machine_not_found',
+                'message': f'機器編號 {machine_id} 不存在，請檢查機器編號是否正確',
+                'machine_id': machine_id
             }), 404
         
-        # 檢查是否為用戶本人的預約
-        if booking['user_email'] != user_email:
-            return jsonify({
-                'success': False,
-                'error': '無權限取消此預約',
-                'error_type': 'permission_denied',
-                'message': '您只能取消自己的預約',
-                'booking_id': booking_id
-            }), 403
+        machine = machines[0]
         
-        # 檢查預約狀態
-        if booking['status'] != 'active':
+        # 檢查機器狀態 - 維護中的機器也應該可以正常使用
+        if machine['status'] not in ['active', 'maintenance']:
             status_messages = {
-                'cancelled': '已取消',
-                'completed': '已完成',
-                'no_show': '已過期'
+                'limited': '限制使用',
+                'inactive': '已停用'
             }
-            status_msg = status_messages.get(booking['status'], booking['status'])
+            status_msg = status_messages.get(machine['status'], machine['status'])
             return jsonify({
                 'success': False,
-                'error': '預約無法取消',
-                'error_type': 'invalid_status',
-                'message': f'此預約狀態為「{status_msg}」，無法取消',
-                'current_status': booking['status'],
-                'booking_id': booking_id,
-                'machine_name': booking['machine_name']
+                'error': '機器無法使用',
+                'error_type': 'machine_unavailable',
+                'message': f'機器「{machine["name"]}」目前{status_msg}，暫時無法預約',
+                'machine_name': machine['name'],
+                'machine_status': machine['status']
             }), 400
         
-        # 檢查是否能在預約開始時間前取消
-        time_slot = booking['time_slot']
-        # 確保time_slot是台北時間
-        if time_slot.tzinfo is None:
-            time_slot = TAIPEI_TZ.localize(time_slot)
-        else:
-            time_slot = time_slot.astimezone(TAIPEI_TZ)
+        is_allowed, restriction_reason = evaluate_machine_restrictions(
+            user_email, machine['restriction_status'], machine['restrictions']
+        )
+        if not is_allowed:
+            return jsonify({
+                'success': False,
+                'error': '機器使用受限',
+                'error_type': 'machine_restricted',
+                'message': f'您無法使用此機器：{restriction_reason}',
+                'restriction_reason': restriction_reason,
+                'machine_name': machine['name']
+            }), 403
+        
+        maintenance_slots = find_maintenance_slots(machine, naive_time_slots)
+        if maintenance_slots:
+            return build_maintenance_conflict_response(machine, maintenance_slots)
+        
+        # 先佔住所有時段的暫留，其他用戶確認中的時段整批拒絕
+        held_slots = claim_slot_holds(cur, user_email, machine_id, naive_time_slots, secrets.token_urlsafe(16))
+        if held_slots:
+            held_formatted = [slot.strftime("%Y/%m/%d %H:%M") for slot in held_slots]
+            logger.info(f"Batch booking slots held by another user: Machine {machine_id}, Slots {held_formatted}")
+            return jsonify({
+                'success': False,
+                'error': '時段確認中',
+                'error_type': 'slot_held',
+                'message': f'以下時段正由其他用戶確認預約中：{"、".join(held_formatted)}',
+                'held_slots': held_formatted,
+                'machine_name': machine['name']
+            }), 409
+        
+        # 一次檢查所有時段是否已有 active 預約
+        cur.execute("""
+            SELECT id, time_slot FROM bookings
+            WHERE machine_id = %s
+            AND time_slot = ANY(%s)
+            AND status = 'active'
+            ORDER BY time_slot
+        """, (machine_id, naive_time_slots))
+        
+        conflicts = cur.fetchall()
+        if conflicts:
+            conflict_slots = [to_taipei_time(c['time_slot']).strftime("%Y/%m/%d %H:%M") for c in conflicts]
+            logger.info(f"Batch booking conflict: Machine {machine_id}, Slots {conflict_slots}")
+            return jsonify({
+                'success': False,
+                'error': '時段已被預約',
+                'error_type': 'time_slot_occupied',
+                'message': f'以下時段已被預約：{"、".join(conflict_slots)}',
+                'conflicting_slots': conflict_slots,
+                'existing_booking_ids': [c['id'] for c in conflicts],
+                'machine_name': machine['name']
+            }), 409
+        
+        # 合併所有新時段，只做一次滾動窗口檢查
+        rolling_window_check = check_rolling_window_limit(user_email, machine_id, time_slots, cur)
+        
+        if not rolling_window_check['allowed']:
+            limit_info = rolling_window_check.get('limit_info') or {}
+            window_size = limit_info.get('window_size', 0)
+            max_bookings = limit_info.get('max_bookings', 0)
+            bookings_in_window = limit_info.get('bookings_in_violated_window', 0)
             
-        now = get_taipei_now()  # 使用台北時間
-        time_until_booking = time_slot - now
-        hours_until_booking = time_until_booking.total_seconds() / 3600
+            logger.error(f"BLOCKING batch booking due to rolling window limit: {rolling_window_check['reason']}")
+            return jsonify({
+                'success': False,
+                'error': '超過使用限制',
+                'error_type': 'usage_limit_exceeded',
+                'message': f'預約失敗：{rolling_window_check["reason"]}',
+                'details': {
+                    'window_size': window_size,
+                    'max_bookings': max_bookings,
+                    'current_bookings_in_window': bookings_in_window,
+                    'requested_slots': len(time_slots),
+                    'restriction_description': f'任意連續{window_size}個時段內，最多只能預約{max_bookings}次'
+                },
+                'machine_name': machine['name'],
+                'limit_info': limit_info
+            }), 403
+        
+        # 多列 INSERT 一次寫入所有預約
+        created_at_naive = created_at.replace(tzinfo=None)
+        inserted = execute_values(cur, """
+            INSERT INTO bookings (user_email, machine_id, time_slot, created_at, status)
+            VALUES %s
+            RETURNING id, time_slot
+        """, [(user_email, machine_id, time_slot, created_at_naive, 'active') for time_slot in naive_time_slots],
+            fetch=True)
+        
+        if len(inserted) != len(naive_time_slots):
+            raise Exception("Failed to create all bookings in batch")
+        
+        # 批量寫入使用記錄
+        execute_values(cur, """
+            INSERT INTO user_machine_usage 
+            (user_email, machine_id, booking_id, usage_time, usage_count, is_cooldown_usage)
+            VALUES %s
+            ON CONFLICT (user_email, booking_id) 
+            DO UPDATE SET 
+                usage_time = EXCLUDED.usage_time,
+                usage_count = EXCLUDED.usage_count,
+                is_cooldown_usage = EXCLUDED.is_cooldown_usage,
+                updated_at = CURRENT_TIMESTAMP
+        """, [(user_email, machine_id, row['id'], row['time_slot'], 1, False) for row in inserted])
+        
+        release_slot_holds(cur, user_email=user_email, machine_id=machine_id, naive_time_slots=naive_time_slots)
+        conn.commit()
+        publish_booking_changes([{'user_email': user_email, 'machine_id': machine_id}])
+        
+        booking_ids = [row['id'] for row in inserted]
+        formatted_slots = [time_slot.strftime("%Y/%m/%d %H:%M") for time_slot in time_slots]
+        
+        logger.info(f"Batch booking created: IDs {booking_ids}, User: {user_email}, Machine: {machine_id}, Slots: {formatted_slots}")
+        
+        return jsonify({
+            'success': True,
+            'booking_ids': booking_ids,
+            'status': 'success',
+            'message': f'預約成功！機器「{machine["name"]}」共{len(booking_ids)}個時段',
+            'details': {
+                'machine_name': machine['name'],
+                'time_slots': formatted_slots,
+                'slot_count': len(booking_ids),
+                'duration': f'{len(booking_ids) * 4}小時',
+                'end_time': (time_slots[-1] + timedelta(hours=4)).strftime("%Y/%m/%d %H:%M")
+            }
+        }), 201
+
+    except (psycopg2.IntegrityError, psycopg2.errors.RaiseException) as e:
+        # 寫入期間被其他請求搶先預約（唯一索引或衝突檢查觸發器）
+        logger.warning(f"Batch booking conflict during insert: {e}")
+        if 'conn' in locals():
+            conn.rollback()
+        return jsonify({
+            'success': False,
+            'error': '時段衝突',
+            'error_type': 'database_conflict',
+            'message': '部分時段已被其他用戶預約，整批預約已取消，請重新選擇',
+            'details': 'Database conflict during batch insert'
+        }), 409
+    except psycopg2.Error as e:
+        logger.error(f"Database error: {e}")
+        if 'conn' in locals():
+            conn.rollback()
+        return jsonify({
+            'success': False,
+            'error': '資料庫錯誤',
+            'error_type': 'database_error',
+            'message': '系統暫時無法處理您的預約請求，請稍後再試',
+            'details': str(e) if app.debug else '請聯繫系統管理員'
+        }), 500
+    except Exception as e:
+        logger.error(f"Unexpected error: {e}")
+        if 'conn' in locals():
+            conn.rollback()
+        return jsonify({
+            'success': False,
+            'error': '系統錯誤',
+            'error_type': 'internal_error',
+            'message': '系統發生未預期的錯誤，請稍後再試或聯繫系統管理員',
+            'details': str(e) if app.debug else '內部系統錯誤'
+        }), 500
+    finally:
+        if 'cur' in locals():
+            cur.close()
+        if 'conn' in locals():
+            conn.close()
+
+# =========== 預約時段暫留 ===========
+
+# 開啟預約確認時先暫留時段，其他用戶看到「保留中」；正式預約時消耗暫留，
+# 爭搶的時段在暫留時就決定，不必靠重複失敗的寫入
+SLOT_HOLD_TTL_SECONDS = 90
+SLOT_HOLD_CLEANUP_BATCH_SIZE = 100
+
+def claim_slot_holds(cur, user_email, machine_id, naive_time_slots, hold_token):
+    """
+    佔住 (machine_id, time_slot) 的暫留：不存在、已過期或本人持有的暫留都可佔用
+    郵箱一律以小寫儲存與比對，同一用戶大小寫不同的郵箱視為本人
+    返回被其他用戶持有、未能佔用的時段；由呼叫端決定提交或回滾
+    """
+    now = get_taipei_now().replace(tzinfo=None)
+    cur.execute("""
+        INSERT INTO slot_holds (machine_id, time_slot, user_email, hold_token, created_at, expires_at)
+        SELECT %s::integer, slot, %s, %s, %s, %s
+        FROM unnest(%s::timestamp[]) AS slot
+        ON CONFLICT (machine_id, time_slot) DO UPDATE
+        SET user_email = EXCLUDED.user_email,
+            hold_token = EXCLUDED.hold_token,
+            created_at = EXCLUDED.created_at,
+            expires_at = EXCLUDED.expires_at
+        WHERE slot_holds.expires_at <= EXCLUDED.created_at
+        OR lower(slot_holds.user_email) = EXCLUDED.user_email
+        RETURNING time_slot
+    """, (
+        machine_id, str(user_email).strip().lower(), hold_token, now, now + timedelta(seconds=SLOT_HOLD_TTL_SECONDS),
+        list(naive_time_slots)
+    ))
+    claimed = {row['time_slot'] for row in cur.fetchall()}
+    return sorted(slot for slot in set(naive_time_slots) if slot not in claimed)
+
+def release_slot_holds(cur, hold_token=None, user_email=None, machine_id=None, naive_time_slots=None):
+    """依令牌或 (用戶, 機器, 時段) 刪除暫留，返回刪除筆數"""
+    if hold_token:
+        cur.execute("DELETE FROM slot_holds WHERE hold_token = %s", (hold_token,))
+    else:
+        cur.execute("""
+            DELETE FROM slot_holds
+            WHERE lower(user_email) = %s AND machine_id = %s AND time_slot = ANY(%s)
+        """, (str(user_email).strip().lower(), machine_id, list(naive_time_slots)))
+    return cur.rowcount
+
+def fetch_pending_slots(cur, machine_id, current_user_email, start_date=None, end_date=None):
+    """返回其他用戶仍在確認中的時段（YYYY-MM-DD-HH:MM），自己的暫留不算"""
+    query = """
+        SELECT time_slot FROM slot_holds
+        WHERE machine_id = %s AND expires_at > %s AND lower(user_email) <> %s
+    """
+    params = [machine_id, get_taipei_now().replace(tzinfo=None), (current_user_email or '').strip().lower()]
+    
+    if start_date and end_date:
+        query += " AND time_slot BETWEEN %s AND %s"
+        params.extend([start_date, end_date])
+    
+    query += " ORDER BY time_slot"
+    cur.execute(query, params)
+    return [TAIPEI_TZ.localize(row['time_slot']).strftime('%Y-%m-%d-%H:%M') for row in cur.fetchall()]
+
+@app.route('/bookings/holds', methods=['POST'])
+def create_slot_hold():
+    """
+    暫留預約時段：開啟預約確認時呼叫，傳送 user_email, machine_id, time_slots（列表）
+    全部時段都暫留成功才生效；每位用戶同時只保留一組暫留，新的暫留會取代舊的
+    暫留在 SLOT_HOLD_TTL_SECONDS 秒後自動失效，正式預約成功時一併消耗
+    """
+    try:
+        data = request.get_json() or {}
+        user_email = data.get('user_email')
+        machine_id = data.get('machine_id')
+        time_slot_strs = data.get('time_slots') or []
+        
+        if not user_email or not machine_id or not time_slot_strs:
+            return jsonify({
+                'success': False,
+                'error': '缺少必要資料',
+                'error_type': 'missing_fields',
+                'message': '請提供用戶信箱、機器編號與時段列表'
+            }), 400
+        
+        if not isinstance(time_slot_strs, list) or len(time_slot_strs) > MAX_BATCH_BOOKING_SLOTS:
+            return jsonify({
+                'success': False,
+                'error': '時段數量無效',
+                'error_type': 'invalid_slot_count',
+                'message': f'時段列表必須為陣列，且一次最多暫留{MAX_BATCH_BOOKING_SLOTS}個時段',
+                'max_slots': MAX_BATCH_BOOKING_SLOTS
+            }), 400
+        
+        current_taipei_time = get_taipei_now()
+        time_slots = []
+        for time_slot_str in time_slot_strs:
+            time_slot = parse_time_slot(time_slot_str)
+            if not time_slot or time_slot.hour not in [0, 4, 8, 12, 16, 20]:
+                return jsonify({
+                    'success': False,
+                    'error': '無效的預約時段',
+                    'error_type': 'invalid_time_slot',
+                    'message': '時段必須為 4 小時區塊的開始時間',
+                    'provided_format': time_slot_str
+                }), 400
+            if time_slot + timedelta(hours=4) <= current_taipei_time:
+                return jsonify({
+                    'success': False,
+                    'error': '無法預約過去的時段',
+                    'error_type': 'past_time_slot',
+                    'message': f'您選擇的時段 {time_slot.strftime("%Y/%m/%d %H:%M")} 已經過去，請選擇未來的時段'
+                }), 400
+            if time_slot not in time_slots:
+                time_slots.append(time_slot)
+        
+        time_slots.sort()
+        naive_time_slots = [time_slot.replace(tzinfo=None) for time_slot in time_slots]
+        
+        conn = get_db_conn()
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        
+        cur.execute("""
+            SELECT id, name, status, maintenance_start, maintenance_end, maintenance_window_note
+            FROM machines WHERE id = %s
+        """, (machine_id,))
+        machine = cur.fetchone()
+        if not machine:
+            return jsonify({
+                'success': False,
+                'error': '機器不存在',
+                'error_type': 'machine_not_found',
+                'message': f'機器編號 {machine_id} 不存在，請檢查機器編號是否正確',
+                'machine_id': machine_id
+            }), 404
+        
+        if machine['status'] not in ['active', 'maintenance']:
+            return jsonify({
+                'success': False,
+                'error': '機器無法使用',
+                'error_type': 'machine_unavailable',
+                'message': f'機器「{machine["name"]}」目前無法預約',
+                'machine_name': machine['name'],
+                'machine_status': machine['status']
+            }), 400
+        
+        maintenance_slots = find_maintenance_slots(machine, naive_time_slots)
+        if maintenance_slots:
+            return build_maintenance_conflict_response(machine, maintenance_slots)
+        
+        now = current_taipei_time.replace(tzinfo=None)
+        
+        # 取代本人先前的暫留，並順便清理少量過期暫留
+        cur.execute("DELETE FROM slot_holds WHERE lower(user_email) = %s", (str(user_email).strip().lower(),))
+        cur.execute("""
+            DELETE FROM slot_holds
+            WHERE ctid IN (
+                SELECT ctid FROM slot_holds
+                WHERE expires_at <= %s
+                LIMIT %s
+            )
+        """, (now, SLOT_HOLD_CLEANUP_BATCH_SIZE))
+        
+        hold_token = secrets.token_urlsafe(16)
+        held_slots = claim_slot_holds(cur, user_email, machine_id, naive_time_slots, hold_token)
+        if held_slots:
+            conn.rollback()
+            held_formatted = [slot.strftime("%Y/%m/%d %H:%M") for slot in held_slots]
+            return jsonify({
+                'success': False,
+                'error': '時段確認中',
+                'error_type': 'slot_held',
+                'message': f'以下時段正由其他用戶確認預約中：{"、".join(held_formatted)}',
+                'held_slots': held_formatted,
+                'machine_name': machine['name']
+            }), 409
+        
+        # 暫留佔住後再檢查是否已被預約，與正式預約的檢查順序一致
+        cur.execute("""
+            SELECT time_slot FROM bookings
+            WHERE machine_id = %s
+            AND time_slot = ANY(%s)
+            AND status = 'active'
+            ORDER BY time_slot
+        """, (machine_id, naive_time_slots))
+        conflicts = cur.fetchall()
+        if conflicts:
+            conn.rollback()
+            conflict_slots = [to_taipei_time(c['time_slot']).strftime("%Y/%m/%d %H:%M") for c in conflicts]
+            return jsonify({
+                'success': False,
+                'error': '時段已被預約',
+                'error_type': 'time_slot_occupied',
+                'message': f'以下時段已被預約：{"、".join(conflict_slots)}',
+                'conflicting_slots': conflict_slots,
+                'machine_name': machine['name']
+            }), 409
+        
+        conn.commit()
+        
+        expires_at = TAIPEI_TZ.localize(now + timedelta(seconds=SLOT_HOLD_TTL_SECONDS))
+        logger.info(f"Slot hold created: User {user_email}, Machine {machine_id}, Slots {len(naive_time_slots)}")
+        
+        return jsonify({
+            'success': True,
+            'hold_token': hold_token,
+            'machine_id': str(machine_id),
+            'time_slots': [time_slot.strftime('%Y-%m-%d-%H:%M') for time_slot in time_slots],
+            'expires_at': expires_at,
+            'ttl_seconds': SLOT_HOLD_TTL_SECONDS
+        }), 201
+
+    except psycopg2.Error as e:
+        logger.error(f"Database error: {e}")
+        if 'conn' in locals():
+            conn.rollback()
+        return jsonify({'error': 'Database error', 'detail': str(e)}), 500
+    except Exception as e:
+        logger.error(f"Unexpected error: {e}")
+        return jsonify({'error': 'Internal server error', 'detail': str(e)}), 500
+    finally:
+        if 'cur' in locals():
+            cur.close()
+        if 'conn' in locals():
+            conn.close()
+
+@app.route('/bookings/holds/<hold_token>', methods=['DELETE'])
+def release_slot_hold(hold_token):
+    """釋放時段暫留（關閉預約確認視窗時呼叫），令牌不存在或已過期也視為成功"""
+    try:
+        conn = get_db_conn()
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        
+        released = release_slot_holds(cur, hold_token=hold_token)
+        conn.commit()
+        
+        return jsonify({'success': True, 'released': released}), 200
+
+    except psycopg2.Error as e:
+        logger.error(f"Database error: {e}")
+        if 'conn' in locals():
+            conn.rollback()
+        return jsonify({'error': 'Database error', 'detail': str(e)}), 500
+    except Exception as e:
+        logger.error(f"Unexpected error: {e}")
+        return jsonify({'error': 'Internal server error', 'detail': str(e)}), 500
+    finally:
+        if 'cur' in locals():
+            cur.close()
+        if 'conn' in locals():
+            conn.close()
+
+@app.route('/bookings/<int:booking_id>', methods=['DELETE'])
+def cancel_booking(booking_id):
+    """
+    取消預約 - 將狀態設為 'cancelled' 而不是刪除記錄
+    需要用戶郵箱驗證確保只能取消自己的預約
+    """
+    try:
+        data = request.get_json()
+        user_email = data.get('user_email')
+        
+        if not user_email:
+            return jsonify({
+                'success': False,
+                'error': '缺少用戶信箱',
+                'error_type': 'missing_user_email',
+                'message': '請提供用戶信箱以驗證取消權限'
+            }), 400
+        
+        conn = get_db_conn()
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        
+        # 檢查預約是否存在且屬於該用戶
+        cur.execute("""
+            SELECT 
+                b.id, 
+                b.user_email, 
+                b.machine_id,
+                b.status, 
+                b.time_slot,
+                m.name as machine_name
+            FROM bookings b
+            JOIN machines m ON b.machine_id = m.id
+            WHERE b.id = %s
+        """, (booking_id,))
+        
+        booking = cur.fetchone()
+        
+        if not booking:
+            return jsonify({
+                'success': False,
+                'error': '預約不存在',
+                'error_type': 'booking_not_found',
+                'message': f'找不到預約編號 {booking_id}，請檢查預約編號是否正確',
+                'booking_id': booking_id
+            }), 404
+        
+        # 檢查是否為用戶本人的預約
+        if booking['user_email'] != user_email:
+            return jsonify({
+                'success': False,
+                'error': '無權限取消此預約',
+                'error_type': 'permission_denied',
+                'message': '您只能取消自己的預約',
+                'booking_id': booking_id
+            }), 403
+        
+        # 檢查預約狀態
+        if booking['status'] != 'active':
+            status_messages = {
+                'cancelled': '已取消',
+                'completed': '已完成',
+                'no_show': '已過期'
+            }
+            status_msg = status_messages.get(booking['status'], booking['status'])
+            return jsonify({
+                'success': False,
+                'error': '預約無法取消',
+                'error_type': 'invalid_status',
+                'message': f'此預約狀態為「{status_msg}」，無法取消',
+                'current_status': booking['status'],
+                'booking_id': booking_id,
+                'machine_name': booking['machine_name']
+            }), 400
+        
+        # 檢查是否能在預約開始時間前取消
+        time_slot = booking['time_slot']
+        # 確保time_slot是台北時間
+        if time_slot.tzinfo is None:
+            time_slot = TAIPEI_TZ.localize(time_slot)
+        else:
+            time_slot = time_slot.astimezone(TAIPEI_TZ)
+            
+        now = get_taipei_now()  # 使用台北時間
+        time_until_booking = time_slot - now
+        hours_until_booking = time_until_booking.total_seconds() / 3600
+        
+        if time_slot <= now:
+            return jsonify({
+                'success': False,
+                'error': '預約已開始或已過期',
+                'error_type': 'booking_started',
+                'message': f'預約時間 {time_slot.strftime("%Y/%m/%d %H:%M")} 已開始或已過期，無法取消',
+                'booking_time': time_slot.strftime("%Y/%m/%d %H:%M"),
+                'current_time': now.strftime("%Y/%m/%d %H:%M"),
+                'machine_name': booking['machine_name']
+            }), 400
+        
+        # 可選：如果需要提前取消時間限制（例如1小時前）
+        # minimum_cancel_hours = 1  # 可以根據需求調整
+        # if hours_until_booking < minimum_cancel_hours:
+        #     return jsonify({
+        #         'success': False,
+        #         'error': '取消時間過晚',
+        #         'error_type': 'too_late_to_cancel',
+        #         'message': f'需要在預約開始前至少{minimum_cancel_hours}小時取消，目前距離預約開始僅剩{hours_until_booking:.1f}小時',
+        #         'hours_until_booking': round(hours_until_booking, 1),
+        #         'minimum_cancel_hours': minimum_cancel_hours,
+        #         'booking_time': time_slot.strftime("%Y/%m/%d %H:%M")
+        #     }), 400
+
+        # 更新預約狀態為 'cancelled'
+        cur.execute("""
+            UPDATE bookings 
+            SET status = 'cancelled', updated_at = %s
+            WHERE id = %s
+        """, (now.replace(tzinfo=None), booking_id))  # 移除時區信息存入資料庫
+        
+        conn.commit()
+        publish_booking_changes([{'user_email': booking['user_email'], 'machine_id': booking['machine_id']}])
+        
+        logger.info(f"Booking cancelled: ID {booking_id}, User: {user_email}")
+        
+        return jsonify({
+            'success': True,
+            'status': 'success',
+            'message': f'預約已成功取消！機器「{booking["machine_name"]}」{time_slot.strftime("%Y/%m/%d %H:%M")}',
+            'details': {
+                'booking_id': booking_id,
+                'machine_name': booking['machine_name'],
+                'cancelled_time_slot': time_slot.strftime("%Y/%m/%d %H:%M"),
+                'cancelled_at': now.strftime("%Y/%m/%d %H:%M:%S"),
+                'hours_before_booking': round(hours_until_booking, 1)
+            }
+        }), 200
+
+    except psycopg2.Error as e:
+        logger.error(f"Database error: {e}")
+        return jsonify({
+            'success': False,
+            'error': '資料庫錯誤',
+            'error_type': 'database_error',
+            'message': '系統暫時無法處理您的取消請求，請稍後再試',
+            'details': str(e) if app.debug else '請聯繫系統管理員'
+        }), 500
+    except Exception as e:
+        logger.error(f"Unexpected error: {e}")
+        return jsonify({
+            'success': False,
+            'error': '系統錯誤',
+            'error_type': 'internal_error',
+            'message': '系統發生未預期的錯誤，請稍後再試或聯繫系統管理員',
+            'details': str(e) if app.debug else '內部系統錯誤'
+        }), 500
+    finally:
+        if 'cur' in locals():
+            cur.close()
+        if 'conn' in locals():
+            conn.close()
+
+# 單次批量取消允許處理的最大預約數
+MAX_BULK_CANCEL_BOOKINGS = 5000
+
+BULK_CANCEL_OUTCOME_MESSAGES = {
+    'cancelled': '預約已取消',
+    'not_found': '預約不存在',
+    'permission_denied': '您只能取消自己的預約',
+    'invalid_status': '預約狀態不是進行中，無法取消',
+    'booking_started': '預約已開始或已過期，無法取消'
+}
+
+def parse_bulk_cancel_request(data):
+    """
+    解析批量取消的請求內容
+    支援 booking_ids 列表，或 filter（machine_id, start_time, end_time, user_email）
+    返回：(booking_ids, filters, error_message)
+    """
+    booking_ids = data.get('booking_ids')
+    filters = data.get('filter')
+    
+    if booking_ids:
+        if not isinstance(booking_ids, list) or len(booking_ids) > MAX_BULK_CANCEL_BOOKINGS:
+            return None, None, f'booking_ids 必須為陣列，且一次最多{MAX_BULK_CANCEL_BOOKINGS}筆'
+        try:
+            return [int(booking_id) for booking_id in booking_ids], None, None
+        except (TypeError, ValueError):
+            return None, None, 'booking_ids 必須為整數'
+    
+    if isinstance(filters, dict) and filters:
+        parsed = {}
+        if filters.get('machine_id'):
+            parsed['machine_id'] = filters['machine_id']
+        if filters.get('user_email'):
+            parsed['user_email'] = filters['user_email']
+        for key in ['start_time', 'end_time']:
+            if filters.get(key):
+                parsed_time = parse_frontend_datetime(filters[key])
+                if parsed_time is None:
+                    return None, None, f'Invalid {key} format'
+                parsed[key] = parsed_time.replace(tzinfo=None)
+        if not parsed:
+            return None, None, 'filter 至少需要 machine_id、start_time、end_time 或 user_email 其中之一'
+        return None, parsed, None
+    
+    return None, None, '請提供 booking_ids 或 filter'
+
+def bulk_cancel_bookings(cur, booking_ids=None, filters=None, owner_email=None, future_only=True):
+    """
+    以單一 SQL 語句批量取消預約
+    - 擁有者檢查（owner_email）與時間檢查（future_only）都在 SQL 中完成
+    - 同一語句內集合式刪除被取消預約的使用記錄
+    返回：(results, deleted_usage_records, changed_pairs)
+    results 為每筆預約的處理結果，changed_pairs 為有預約被取消的 (user_email, machine_id)，供快取失效與推送
+    """
+    now = get_taipei_now().replace(tzinfo=None)
+    params = {'now': now, 'owner': owner_email, 'future_only': future_only}
+    
+    if booking_ids is not None:
+        requested_sql = "SELECT DISTINCT UNNEST(%(booking_ids)s::int[]) AS id"
+        params['booking_ids'] = booking_ids
+    else:
+        conditions = ["status = 'active'"]
+        if filters.get('machine_id'):
+            conditions.append("machine_id = %(machine_id)s")
+            params['machine_id'] = filters['machine_id']
+        if filters.get('user_email'):
+            conditions.append("user_email = %(user_email)s")
+            params['user_email'] = filters['user_email']
+        if filters.get('start_time'):
+            conditions.append("time_slot >= %(start_time)s")
+            params['start_time'] = filters['start_time']
+        if filters.get('end_time'):
+            conditions.append("time_slot <= %(end_time)s")
+            params['end_time'] = filters['end_time']
+        if owner_email:
+            conditions.append("user_email = %(owner)s")
+        requested_sql = f"""
+            SELECT id FROM bookings
+            WHERE {' AND '.join(conditions)}
+            ORDER BY time_slot
+            LIMIT {MAX_BULK_CANCEL_BOOKINGS}
+        """
+    
+    cur.execute(f"""
+        WITH requested AS (
+            {requested_sql}
+        ),
+        target AS (
+            SELECT b.id, b.user_email, b.machine_id, b.status, b.time_slot
+            FROM bookings b
+            JOIN requested r ON r.id = b.id
+            FOR UPDATE OF b
+        ),
+        cancelled AS (
+            UPDATE bookings b
+            SET status = 'cancelled', updated_at = %(now)s
+            FROM target t
+            WHERE b.id = t.id
+            AND t.status = 'active'
+            AND (%(owner)s::text IS NULL OR t.user_email = %(owner)s::text)
+            AND (NOT %(future_only)s OR t.time_slot > %(now)s)
+            RETURNING b.id
+        ),
+        deleted_usage AS (
+            DELETE FROM user_machine_usage u
+            USING cancelled c
+            WHERE u.booking_id = c.id
+            RETURNING u.id
+        )
+        SELECT 
+            r.id,
+            t.user_email,
+            t.machine_id,
+            t.status,
+            t.time_slot,
+            (c.id IS NOT NULL) as cancelled,
+            (SELECT COUNT(*) FROM deleted_usage) as deleted_usage_records
+        FROM requested r
+        LEFT JOIN target t ON t.id = r.id
+        LEFT JOIN cancelled c ON c.id = r.id
+        ORDER BY r.id
+    """, params)
+    
+    rows = cur.fetchall()
+    
+    results = []
+    for row in rows:
+        if row['cancelled']:
+            outcome = 'cancelled'
+        elif row['status'] is None:
+            outcome = 'not_found'
+        elif owner_email and row['user_email'] != owner_email:
+            outcome = 'permission_denied'
+        elif row['status'] != 'active':
+            outcome = 'invalid_status'
+        else:
+            outcome = 'booking_started'
+        
+        result = {
+            'booking_id': row['id'],
+            'outcome': outcome,
+            'message': BULK_CANCEL_OUTCOME_MESSAGES[outcome]
+        }
+        # 不洩露不屬於自己的預約細節
+        if outcome != 'not_found' and outcome != 'permission_denied':
+            result['machine_id'] = str(row['machine_id'])
+            result['time_slot'] = to_taipei_time(row['time_slot']).strftime("%Y/%m/%d %H:%M")
+            result['user_email'] = row['user_email']
+        results.append(result)
+    
+    deleted_usage_records = rows[0]['deleted_usage_records'] if rows else 0
+    
+    changed_pairs = {(row['user_email'], row['machine_id']) for row in rows if row['cancelled']}
+    
+    return results, deleted_usage_records, changed_pairs
+
+def build_bulk_cancel_summary(results, deleted_usage_records):
+    """統計批量取消的結果"""
+    summary = {
+        'requested': len(results),
+        'cancelled': 0,
+        'failed': 0,
+        'deleted_usage_records': deleted_usage_records
+    }
+    for result in results:
+        if result['outcome'] == 'cancelled':
+            summary['cancelled'] += 1
+        else:
+            summary['failed'] += 1
+    return summary
+
+@app.route('/bookings/bulk-cancel', methods=['POST'])
+def bulk_cancel_user_bookings():
+    """
+    用戶批量取消自己的預約
+    傳送 user_email 與 booking_ids，或 filter（machine_id, start_time, end_time）
+    只能取消自己尚未開始的 active 預約，逐筆回報處理結果
+    """
+    try:
+        data = request.get_json() or {}
+        user_email = data.get('user_email')
+        
+        if not user_email:
+            return jsonify({
+                'success': False,
+                'error': '缺少用戶信箱',
+                'error_type': 'missing_user_email',
+                'message': '請提供用戶信箱以驗證取消權限'
+            }), 400
+        
+        booking_ids, filters, error_message = parse_bulk_cancel_request(data)
+        if error_message:
+            return jsonify({
+                'success': False,
+                'error': '請求格式錯誤',
+                'error_type': 'invalid_request',
+                'message': error_message
+            }), 400
+        
+        conn = get_db_conn()
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        
+        results, deleted_usage_records, changed_pairs = bulk_cancel_bookings(
+            cur, booking_ids=booking_ids, filters=filters, owner_email=user_email, future_only=True
+        )
+        
+        conn.commit()
+        publish_booking_changes([
+            {'user_email': email, 'machine_id': machine_id} for email, machine_id in changed_pairs
+        ])
+        
+        summary = build_bulk_cancel_summary(results, deleted_usage_records)
+        logger.info(f"User {user_email} bulk cancelled bookings: {summary}")
+        
+        return jsonify({
+            'success': True,
+            'status': 'success',
+            'message': f'已取消{summary["cancelled"]}筆預約，{summary["failed"]}筆無法取消',
+            'results': results,
+            'summary': summary
+        }), 200
+
+    except psycopg2.Error as e:
+        logger.error(f"Database error: {e}")
+        if 'conn' in locals():
+            conn.rollback()
+        return jsonify({
+            'success': False,
+            'error': '資料庫錯誤',
+            'error_type': 'database_error',
+            'message': '系統暫時無法處理您的取消請求，請稍後再試',
+            'details': str(e) if app.debug else '請聯繫系統管理員'
+        }), 500
+    except Exception as e:
+        logger.error(f"Unexpected error: {e}")
+        return jsonify({
+            'success': False,
+            'error': '系統錯誤',
+            'error_type': 'internal_error',
+            'message': '系統發生未預期的錯誤，請稍後再試或聯繫系統管理員',
+            'details': str(e) if app.debug else '內部系統錯誤'
+        }), 500
+    finally:
+        if 'cur' in locals():
+            cur.close()
+        if 'conn' in locals():
+            conn.close()
+
+def build_booking_usage_info(user_email, machine_id, cur, machine=None, rolling_window_status=None):
+    """
+    依機器的限制狀態產生預約頁面使用的滾動窗口資訊
+    machine 與 rolling_window_status 可由呼叫端預先查好傳入，避免重複查詢
+    """
+    if machine is None:
+        # 先檢查機器的restriction_status
+        cur.execute("SELECT restriction_status FROM machines WHERE id = %s", (machine_id,))
+        machine = cur.fetchone()
+    
+    if machine and machine['restriction_status'] == 'limited':
+        # 只有在限制狀態為"limited"時才查詢限制信息
+        if rolling_window_status is None:
+            rolling_window_status = get_user_rolling_window_status(user_email, machine_id, cur)
+        logger.info(f"Rolling window status for user {user_email}: {rolling_window_status}")
+        return rolling_window_status
+    elif machine and machine['restriction_status'] == 'blocked':
+        # 機器被阻止
+        return {
+            'has_limit': False,
+            'blocked': True,
+            'blocked_reason': '此機器目前被管理員完全封鎖'
+        }
+    else:
+        # restriction_status為"none"或機器不存在，不應用限制
+        logger.info(f"Machine {machine_id} has no restrictions or restriction_status is 'none'")
+        return {
+            'has_limit': False
+        }
+
+# 列表端點的欄位篩選（fields=a,b）與欄式輸出（format=columnar）
+LIST_RESPONSE_FORMATS = ['objects', 'columnar']
+
+def parse_list_shape_params(args, allowed_fields):
+    """
+    解析列表端點的 fields 與 format 參數
+    返回 (fields, columnar, error_message)，未指定 fields 時 fields 為 None（返回全部欄位）
+    """
+    fields = None
+    fields_param = args.get('fields')
+    if fields_param:
+        # 去除重複但保留順序
+        fields = list(dict.fromkeys(f.strip() for f in fields_param.split(',') if f.strip()))
+        unknown = [f for f in fields if f not in allowed_fields]
+        if unknown:
+            return None, False, f"Unknown fields: {', '.join(unknown)}. Allowed: {', '.join(allowed_fields)}"
+    
+    response_format = args.get('format', 'objects')
+    if response_format not in LIST_RESPONSE_FORMATS:
+        return None, False, f"Invalid format. Must be one of: {', '.join(LIST_RESPONSE_FORMATS)}"
+    
+    return fields, response_format == 'columnar', None
+
+def shape_records(records, columns, fields=None, columnar=False):
+    """
+    依 fields 篩選每筆記錄的欄位
+    columnar 時改為 {欄位: [值, ...]} 的平行陣列，省去每筆重複的鍵名
+    """
+    selected = fields or columns
+    if columnar:
+        return {column: [record[column] for record in records] for column in selected}
+    if fields:
+        return [{column: record[column] for column in selected} for record in records]
+    return records
+
+MACHINE_BOOKING_DETAIL_FIELDS = [
+    'id', 'user_email', 'user_display_name', 'time_slot', 'status', 'machine_id', 'created_at'
+]
+
+def build_machine_bookings_payload(machine_id, current_user_email, cur, start_date=None, end_date=None,
+                                   machine=None, rolling_window_status=None):
+    """
+    產生機器預約時段的回應內容
+    供 GET /bookings/machine/<id> 與機器頁面啟動資料共用
+    """
+    # 獲取所有 active 狀態的預約，同時查詢用戶姓名
+    query = """
+        SELECT b.id, b.user_email, b.time_slot, b.status, b.machine_id, b.created_at, u.name as user_name
+        FROM bookings b
+        LEFT JOIN users u ON b.user_email = u.email
+        WHERE b.machine_id = %s AND b.status = 'active'
+    """
+    params = [machine_id]
+    
+    if start_date and end_date:
+        query += " AND time_slot BETWEEN %s AND %s"
+        params.extend([start_date, end_date])
+    
+    query += " ORDER BY time_slot"
+    
+    cur.execute(query, params)
+    bookings = cur.fetchall()
+    
+    # 轉換為前端需要的格式
+    booked_slots = []
+    booking_details = []
+    
+    for booking in bookings:
+        # 確保time_slot被視為台北時間
+        time_slot_dt = booking['time_slot']
+        if time_slot_dt.tzinfo is None:
+            # 數據庫時間沒有時區信息，設為台北時區
+            time_slot_dt = TAIPEI_TZ.localize(time_slot_dt)
+        else:
+            # 轉換為台北時區
+            time_slot_dt = time_slot_dt.astimezone(TAIPEI_TZ)
+        
+        # 格式化時間段為 "YYYY-MM-DD-HH:MM" - 確保與前端格式一致
+        time_slot_formatted = time_slot_dt.strftime('%Y-%m-%d-%H:%M')
+        booked_slots.append(time_slot_formatted)
+        
+        # 預約介面不需要顯示用戶姓名，只返回空字符串
+        user_display_name = ''
+        
+        booking_details.append({
+            'id': str(booking['id']),
+            'user_email': booking['user_email'],
+            'user_display_name': user_display_name,  # 新增格式化的顯示名稱
+            'time_slot': time_slot_formatted,
+            'status': booking['status'],
+            'machine_id': str(booking['machine_id']),
+            'created_at': booking['created_at']
+        })
+    
+    # 清理和標準化用戶郵箱
+    current_user_email = current_user_email.strip().lower() if current_user_email else ''
+    
+    logger.info(f"Retrieved {len(bookings)} active bookings for machine {machine_id}")
+    logger.info(f"Current user email from header: '{current_user_email}'")
+    
+    # 其他用戶確認中的時段，前端顯示為「保留中」
+    pending_slots = fetch_pending_slots(cur, machine_id, current_user_email, start_date=start_date, end_date=end_date)
+    
+    # 額外的安全檢查：確保用戶郵箱不為空
+    if not current_user_email:
+        logger.warning("No user email provided in request headers")
+        return {
+            'bookedSlots': booked_slots,
+            'pendingSlots': pending_slots,
+            'bookingDetails': [],  # 不返回詳細信息
+            'currentUserEmail': '',
+            'error': 'User authentication required'
+        }
+    
+    # 處理預約詳情顯示，其他用戶顯示格式化姓名
+    safe_booking_details = []
+    for detail in booking_details:
+        detail_copy = detail.copy()
+        # 標準化預約用戶郵箱用於比較
+        booking_user_email = (detail['user_email'] or '').strip().lower()
+        
+        # 如果不是自己的預約，隱藏用戶郵箱但顯示格式化姓名
+        if booking_user_email != current_user_email:
+            detail_copy['user_email'] = 'hidden'  # 隱藏其他用戶的郵箱
+            # user_display_name 保持不變，顯示格式化的姓名
+        
+        safe_booking_details.append(detail_copy)
+    
+    # 分析當前用戶的滾動窗口使用情況（替代舊的連續預約分析）
+    rolling_window_info = build_booking_usage_info(
+        current_user_email, machine_id, cur, machine=machine, rolling_window_status=rolling_window_status
+    )
+    
+    return {
+        'bookedSlots': booked_slots,
+        'bookingDetails': safe_booking_details,
+        'pendingSlots': pending_slots,
+        'currentUserEmail': current_user_email,
+        'cooldownSlots': [],  # 新滾動窗口機制不使用固定冷卻期
+        'usageInfo': rolling_window_info  # 使用滾動窗口狀態信息
+    }
+
+@app.route('/bookings/machine/<machine_id>', methods=['GET'])
+def get_machine_bookings(machine_id):
+    """
+    獲取機器的預約時段
+    只返回 'active' 狀態的預約用於時段顯示
+    同時返回詳細的預約信息用於取消功能
+    新增：分析當前用戶的連續預約情況和冷卻期狀態
+    
+    可選 fields= 篩選 bookingDetails 欄位；format=columnar 時 bookingDetails 改為平行陣列，
+    且不再另外返回 bookedSlots（與 bookingDetails.time_slot 相同）
+    """
+    try:
+        start_date = request.args.get('start_date')
+        end_date = request.args.get('end_date')
+        
+        fields, columnar, error_message = parse_list_shape_params(request.args, MACHINE_BOOKING_DETAIL_FIELDS)
+        if error_message:
+            return jsonify({'error': error_message}), 400
+        
+        # 從 session 或 request headers 獲取當前用戶郵箱
+        current_user_email = request.headers.get('X-User-Email', '')
+        
+        conn = get_db_conn()
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        
+        payload = build_machine_bookings_payload(
+            machine_id, current_user_email, cur, start_date=start_date, end_date=end_date
+        )
+        
+        # 未帶用戶郵箱時不返回詳細信息，時段只存在於 bookedSlots
+        if (fields or columnar) and 'error' not in payload:
+            payload['bookingDetails'] = shape_records(
+                payload['bookingDetails'], MACHINE_BOOKING_DETAIL_FIELDS, fields=fields, columnar=columnar
+            )
+            if columnar:
+                if 'time_slot' in payload['bookingDetails']:
+                    payload.pop('bookedSlots', None)
+                payload['format'] = 'columnar'
+        
+        return jsonify(payload), 200
+
+    except psycopg2.Error as e:
+        logger.error(f"Database error: {e}")
+        return jsonify({'error': 'Database error', 'detail': str(e)}), 500
+    except Exception as e:
+        logger.error(f"Unexpected error: {e}")
+        return jsonify({'error': 'Internal server error', 'detail': str(e)}), 500
+    finally:
+        if 'cur' in locals():
+            cur.close()
+        if 'conn' in locals():
+            conn.close()
+
+# 預約變更差異同步設定
+BOOKING_CHANGES_DEFAULT_LIMIT = 500
+BOOKING_CHANGES_MAX_LIMIT = 2000
+# 變更記錄保留天數；游標早於保留範圍時返回 cursor_expired，前端需重新完整載入
+BOOKING_CHANGES_RETENTION_DAYS = 7
+BOOKING_CHANGES_PRUNE_INTERVAL_SECONDS = 600
+BOOKING_CHANGES_PRUNE_BATCH_SIZE = 5000
+
+_booking_changes_pruned_at = 0.0
+_booking_changes_prune_lock = threading.Lock()
+
+def format_booking_change(change, current_user_email):
+    """將 booking_changes 記錄轉換為前端格式，其他用戶的郵箱一律隱藏"""
+    time_slot_dt = change['time_slot']
+    if time_slot_dt.tzinfo is None:
+        time_slot_dt = TAIPEI_TZ.localize(time_slot_dt)
+    else:
+        time_slot_dt = time_slot_dt.astimezone(TAIPEI_TZ)
+    
+    is_mine = bool(current_user_email) and (change['user_email'] or '').strip().lower() == current_user_email
+    
+    return {
+        'seq': change['seq'],
+        'booking_id': str(change['booking_id']),
+        'machine_id': str(change['machine_id']),
+        'user_email': change['user_email'] if is_mine else 'hidden',
+        'is_mine': is_mine,
+        'time_slot': time_slot_dt.strftime('%Y-%m-%d-%H:%M'),
+        'change_type': change['change_type'],
+        'status': change['status'],
+        'changed_at': change['changed_at']
+    }
+
+def get_booking_changes_head(cur):
+    """目前快照的 xmin；在此之前的交易都已結束，其變更不會再出現新的記錄"""
+    cur.execute("SELECT pg_snapshot_xmin(pg_current_snapshot())::text::bigint AS xmin")
+    return cur.fetchone()['xmin']
+
+def fetch_booking_changes(cur, cursor_values, limit, machine_ids=None, start_time=None, end_time=None):
+    """
+    讀取游標 (txid, seq) 之後、已確定提交的預約變更
+    返回 (rows, next_cursor_values, has_more)
+    """
+    snapshot_xmin = get_booking_changes_head(cur)
+    
+    conditions = [
+        "(c.txid, c.seq) > (%s::text::xid8, %s)",
+        "c.txid < %s::text::xid8"
+    ]
+    params = [str(cursor_values[0]), cursor_values[1], str(snapshot_xmin)]
+    
+    if machine_ids:
+        conditions.append("c.machine_id = ANY(%s)")
+        params.append(list(machine_ids))
+    if start_time:
+        conditions.append("c.time_slot >= %s")
+        params.append(start_time.replace(tzinfo=None))
+    if end_time:
+        conditions.append("c.time_slot <= %s")
+        params.append(end_time.replace(tzinfo=None))
+    
+    # 多取一筆判斷是否還有下一頁
+    cur.execute(f"""
+        SELECT c.seq, c.txid::text::bigint AS txid, c.booking_id, c.machine_id, c.user_email,
+               c.time_slot, c.change_type, c.status, c.changed_at
+        FROM booking_changes c
+        WHERE {' AND '.join(conditions)}
+        ORDER BY c.txid, c.seq
+        LIMIT %s
+    """, params + [limit + 1])
+    rows = cur.fetchall()
+    
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    
+    if has_more:
+        next_cursor_values = [rows[-1]['txid'], rows[-1]['seq']]
+    else:
+        # 已讀完 xmin 之前的所有變更，游標直接前進到 xmin，篩選條件外的變更不必重複掃描
+        next_cursor_values = [max(snapshot_xmin, cursor_values[0]), 0]
+    
+    return rows, next_cursor_values, has_more
+
+def prune_booking_changes():
+    """
+    刪除超過保留天數的變更記錄，並把保留水位推進到已刪除的最大 (txid, seq)
+    每個程序每 BOOKING_CHANGES_PRUNE_INTERVAL_SECONDS 秒最多執行一次，使用獨立連線
+    """
+    global _booking_changes_pruned_at
+    if time.monotonic() - _booking_changes_pruned_at < BOOKING_CHANGES_PRUNE_INTERVAL_SECONDS:
+        return
+    if not _booking_changes_prune_lock.acquire(blocking=False):
+        return
+    try:
+        _booking_changes_pruned_at = time.monotonic()
+        conn = get_db_conn()
+        try:
+            cur = conn.cursor(cursor_factory=RealDictCursor)
+            cutoff = get_taipei_now().replace(tzinfo=None) - timedelta(days=BOOKING_CHANGES_RETENTION_DAYS)
+            # 水位只前進不後退；刪除與更新水位在同一交易內，讀取端不會看到刪了但水位未更新的狀態
+            cur.execute("""
+                WITH deleted AS (
+                    DELETE FROM booking_changes
+                    WHERE seq IN (
+                        SELECT seq FROM booking_changes
+                        WHERE changed_at < %s
+                        ORDER BY changed_at
+                        LIMIT %s
+                    )
+                    RETURNING txid, seq
+                ),
+                newest AS (
+                    SELECT txid, seq FROM deleted ORDER BY txid DESC, seq DESC LIMIT 1
+                )
+                UPDATE booking_changes_retention r
+                SET pruned_txid = newest.txid, pruned_seq = newest.seq, pruned_at = %s
+                FROM newest
+                WHERE r.id AND (newest.txid, newest.seq) > (r.pruned_txid, r.pruned_seq)
+            """, (cutoff, BOOKING_CHANGES_PRUNE_BATCH_SIZE, get_taipei_now().replace(tzinfo=None)))
+            conn.commit()
+        finally:
+            conn.close()
+    except psycopg2.Error as e:
+        logger.error(f"Failed to prune booking changes: {e}")
+    finally:
+        _booking_changes_prune_lock.release()
+
+def is_booking_changes_cursor_expired(cur, cursor_values):
+    """游標早於保留水位時，中間可能有已被刪除的變更，無法再做差異同步"""
+    cur.execute("""
+        SELECT (%s::text::xid8, %s) < (pruned_txid, pruned_seq) AS expired
+        FROM booking_changes_retention
+        WHERE id
+    """, (str(cursor_values[0]), cursor_values[1]))
+    row = cur.fetchone()
+    return bool(row and row['expired'])
+
+def build_cursor_expired_response(cur):
+    """游標過期：返回新的起始游標，前端應先重新完整載入資料再以此游標繼續同步"""
+    return jsonify({
+        'error': 'Cursor expired',
+        'error_type': 'cursor_expired',
+        'message': '同步游標已超過保留期限，請重新載入資料',
+        'cursor': encode_keyset_cursor(get_booking_changes_head(cur), 0)
+    }), 410
+
+def decode_booking_changes_cursor(cursor):
+    """解析變更游標，格式錯誤時返回 None"""
+    cursor_values = decode_keyset_cursor(cursor)
+    if (not isinstance(cursor_values, list) or len(cursor_values) != 2
+            or not all(isinstance(v, int) and v >= 0 for v in cursor_values)):
+        return None
+    return cursor_values
+
+@app.route('/bookings/changes', methods=['GET'])
+def get_booking_changes():
+    """
+    預約變更差異同步
+    返回游標之後新增、取消或刪除的預約，可依機器與時段範圍篩選
+    
+    游標由 (txid, seq) 組成，只返回已確定提交的交易（txid 小於目前快照的 xmin），
+    因此晚提交但序號較小的變更不會被跳過。
+    未帶 cursor 時只返回目前的游標，前端應先完整載入一次資料再開始輪詢。
+    游標早於保留範圍（BOOKING_CHANGES_RETENTION_DAYS）時返回 410 cursor_expired 與新的游標。
+    """
+    try:
+        current_user_email = request.headers.get('X-User-Email', '').strip().lower()
+        cursor_param = request.args.get('cursor')
+        machine_id = request.args.get('machine_id')
+        start_date = request.args.get('start_date')
+        end_date = request.args.get('end_date')
+        
+        try:
+            limit = int(request.args.get('limit', BOOKING_CHANGES_DEFAULT_LIMIT))
+        except ValueError:
+            return jsonify({'error': 'limit must be an integer'}), 400
+        limit = max(1, min(limit, BOOKING_CHANGES_MAX_LIMIT))
+        
+        if machine_id is not None:
+            try:
+                machine_id = int(machine_id)
+            except ValueError:
+                return jsonify({'error': 'machine_id must be an integer'}), 400
+        
+        start_time = None
+        end_time = None
+        if start_date:
+            start_time = parse_frontend_datetime(start_date)
+            if start_time is None:
+                return jsonify({'error': 'Invalid start_date format'}), 400
+        if end_date:
+            end_time = parse_frontend_datetime(end_date)
+            if end_time is None:
+                return jsonify({'error': 'Invalid end_date format'}), 400
         
-        if time_slot <= now:
-            return jsonify({
-                'success': False,
-                'error': '預約已開始或已過期',
-                'error_type': 'booking_started',
-                'message': f'預約時間 {time_slot.strftime("%Y/%m/%d %H:%M")} 已開始或已過期，無法取消',
-                'booking_time': time_slot.strftime("%Y/%m/%d %H:%M"),
-                'current_time': now.strftime("%Y/%m/%d %H:%M"),
-                'machine_name': booking['machine_name']
-            }), 400
+        cursor_values = None
+        if cursor_param:
+            cursor_values = decode_booking_changes_cursor(cursor_param)
+            if cursor_values is None:
+                return jsonify({'error': 'Invalid cursor'}), 400
         
-        # 可選：如果需要提前取消時間限制（例如1小時前）
-        # minimum_cancel_hours = 1  # 可以根據需求調整
-        # if hours_until_booking < minimum_cancel_hours:
-        #     return jsonify({
-        #         'success': False,
-        #         'error': '取消時間過晚',
-        #         'error_type': 'too_late_to_cancel',
-        #         'message': f'需要在預約開始前至少{minimum_cancel_hours}小時取消，目前距離預約開始僅剩{hours_until_booking:.1f}小時',
-        #         'hours_until_booking': round(hours_until_booking, 1),
-        #         'minimum_cancel_hours': minimum_cancel_hours,
-        #         'booking_time': time_slot.strftime("%Y/%m/%d %H:%M")
-        #     }), 400
-
-        # 更新預約狀態為 'cancelled'
-        cur.execute("""
-            UPDATE bookings 
-            SET status = 'cancelled', updated_at = %s
-            WHERE id = %s
-        """, (now.replace(tzinfo=None), booking_id))  # 移除時區信息存入資料庫
+        prune_booking_changes()
         
-        conn.commit()
+        conn = get_db_conn()
+        cur = conn.cursor(cursor_factory=RealDictCursor)
         
-        logger.info(f"Booking cancelled: ID {booking_id}, User: {user_email}")
+        if cursor_values is None:
+            # 首次同步：以目前快照的 xmin 作為起點，之後提交的變更都會被返回
+            return jsonify({
+                'changes': [],
+                'cursor': encode_keyset_cursor(get_booking_changes_head(cur), 0),
+                'has_more': False
+            }), 200
+        
+        if is_booking_changes_cursor_expired(cur, cursor_values):
+            return build_cursor_expired_response(cur)
+        
+        rows, next_cursor_values, has_more = fetch_booking_changes(
+            cur, cursor_values, limit,
+            machine_ids=[machine_id] if machine_id is not None else None,
+            start_time=start_time, end_time=end_time
+        )
+        next_cursor = encode_keyset_cursor(*next_cursor_values)
         
         return jsonify({
-            'success': True,
-            'status': 'success',
-            'message': f'預約已成功取消！機器「{booking["machine_name"]}」{time_slot.strftime("%Y/%m/%d %H:%M")}',
-            'details': {
-                'booking_id': booking_id,
-                'machine_name': booking['machine_name'],
-                'cancelled_time_slot': time_slot.strftime("%Y/%m/%d %H:%M"),
-                'cancelled_at': now.strftime("%Y/%m/%d %H:%M:%S"),
-                'hours_before_booking': round(hours_until_booking, 1)
-            }
+            'changes': [format_booking_change(row, current_user_email) for row in rows],
+            'cursor': next_cursor,
+            'has_more': has_more
         }), 200
 
     except psycopg2.Error as e:
         logger.error(f"Database error: {e}")
-        return jsonify({
-            'success': False,
-            'error': '資料庫錯誤',
-            'error_type': 'database_error',
-            'message': '系統暫時無法處理您的取消請求，請稍後再試',
-            'details': str(e) if app.debug else '請聯繫系統管理員'
-        }), 500
+        return jsonify({'error': 'Database error', 'detail': str(e)}), 500
     except Exception as e:
         logger.error(f"Unexpected error: {e}")
-        return jsonify({
-            'success': False,
-            'error': '系統錯誤',
-            'error_type': 'internal_error',
-            'message': '系統發生未預期的錯誤，請稍後再試或聯繫系統管理員',
-            'details': str(e) if app.debug else '內部系統錯誤'
-        }), 500
+        return jsonify({'error': 'Internal server error', 'detail': str(e)}), 500
     finally:
         if 'cur' in locals():
             cur.close()
         if 'conn' in locals():
             conn.close()
 
-@app.route('/bookings/machine/<machine_id>', methods=['GET'])
-def get_machine_bookings(machine_id):
+# 預約變更 SSE 推送設定
+BOOKING_STREAM_HEARTBEAT_SECONDS = 15
+# 其他程序的寫入由 LISTEN/NOTIFY 監聽執行緒喚醒；此輪詢只作為監聽中斷時的保險
+BOOKING_STREAM_POLL_SECONDS = 120
+# 讀取被尚未結束的交易（xmin）擋住時，已提交的較新變更要等該交易結束才能讀到；
+# 該交易若回滾就不會發出通知，因此改以短間隔重新讀取，間隔逐次加倍至心跳間隔為止
+BOOKING_STREAM_PENDING_RETRY_SECONDS = 1
+# 單一連線的最長時間，到期後瀏覽器會帶 Last-Event-ID 自動重連，避免長期佔用工作執行緒
+BOOKING_STREAM_MAX_SECONDS = 600
+BOOKING_STREAM_RETRY_MS = 3000
+BOOKING_STREAM_MAX_MACHINES = 50
+
+def format_sse_event(event, data=None, event_id=None):
+    """組成一則 SSE 訊息；只有 id 沒有 data 時瀏覽器不觸發事件，但會更新 Last-Event-ID"""
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    if data is not None:
+        lines.append(f"event: {event}")
+        lines.append(f"data: {app.json.dumps(data)}")
+    return '\n'.join(lines) + '\n\n'
+
+@app.route('/bookings/stream', methods=['GET'])
+def stream_booking_changes():
     """
-    獲取機器的預約時段
-    只返回 'active' 狀態的預約用於時段顯示
-    同時返回詳細的預約信息用於取消功能
-    新增：分析當前用戶的連續預約情況和冷卻期狀態
+    預約變更 SSE 串流
+    依機器推送預約新增、取消、刪除事件，取代前端定時輪詢
+    
+    參數：machine_ids（逗號分隔，預設全部機器）、user_email（EventSource 無法帶自訂 header）
+    事件：
+      ready    首次連線時返回起始游標
+      bookings {changes, cursor}，cursor 同時作為可用性版本與事件 id
+      resync   重連游標已超過保留期限，前端需重新完整載入，之後從新游標繼續推送
+    斷線重連時瀏覽器會帶 Last-Event-ID，從該游標繼續推送，不會漏掉變更
     """
-    try:
-        start_date = request.args.get('start_date')
-        end_date = request.args.get('end_date')
-        
-        conn = get_db_conn()
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-        
-        # 獲取所有 active 狀態的預約，同時查詢用戶姓名
-        query = """
-            SELECT b.id, b.user_email, b.time_slot, b.status, b.machine_id, b.created_at, u.name as user_name
-            FROM bookings b
-            LEFT JOIN users u ON b.user_email = u.email
-            WHERE b.machine_id = %s AND b.status = 'active'
+    user_email = (request.args.get('user_email') or request.headers.get('X-User-Email', '')).strip().lower()
+    
+    machine_ids = None
+    machine_ids_param = request.args.get('machine_ids')
+    if machine_ids_param:
+        try:
+            machine_ids = list(dict.fromkeys(int(v) for v in machine_ids_param.split(',') if v.strip()))
+        except ValueError:
+            return jsonify({'error': 'machine_ids must be a comma-separated list of integers'}), 400
+        if len(machine_ids) > BOOKING_STREAM_MAX_MACHINES:
+            return jsonify({'error': f'Too many machine_ids (max {BOOKING_STREAM_MAX_MACHINES})'}), 400
+    
+    cursor_param = request.headers.get('Last-Event-ID') or request.args.get('cursor')
+    cursor_values = None
+    if cursor_param:
+        cursor_values = decode_booking_changes_cursor(cursor_param)
+        if cursor_values is None:
+            return jsonify({'error': 'Invalid cursor'}), 400
+    
+    def read_changes(cursor_values):
         """
-        params = [machine_id]
-        
-        if start_date and end_date:
-            query += " AND time_slot BETWEEN %s AND %s"
-            params.extend([start_date, end_date])
-        
-        query += " ORDER BY time_slot"
-        
-        cur.execute(query, params)
-        bookings = cur.fetchall()
-        
-        # 轉換為前端需要的格式
-        booked_slots = []
-        booking_details = []
+        讀取游標之後的所有變更（分頁讀完），返回 (rows, next_cursor_values, expired, pending)
+        游標已過期時不讀取變更，返回新的起始游標
+        pending 表示還有變更因 xmin 之前的交易未結束而暫時讀不到，需要稍後重新讀取
+        """
+        conn = get_db_conn()
+        try:
+            cur = conn.cursor(cursor_factory=RealDictCursor)
+            if cursor_values is None:
+                return [], [get_booking_changes_head(cur), 0], False, False
+            if is_booking_changes_cursor_expired(cur, cursor_values):
+                return [], [get_booking_changes_head(cur), 0], True, False
+            rows = []
+            has_more = True
+            while has_more:
+                page, cursor_values, has_more = fetch_booking_changes(
+                    cur, cursor_values, BOOKING_CHANGES_MAX_LIMIT, machine_ids=machine_ids
+                )
+                rows.extend(page)
+            cur.execute("""
+                SELECT EXISTS (
+                    SELECT 1 FROM booking_changes c
+                    WHERE (c.txid, c.seq) > (%s::text::xid8, %s)
+                    AND (%s::integer[] IS NULL OR c.machine_id = ANY(%s::integer[]))
+                ) AS pending
+            """, (str(cursor_values[0]), cursor_values[1], machine_ids or None, machine_ids or None))
+            return rows, cursor_values, False, cur.fetchone()['pending']
+        finally:
+            conn.close()
+    
+    def generate(cursor_values):
+        started = time.monotonic()
+        prune_booking_changes()
+        yield f"retry: {BOOKING_STREAM_RETRY_MS}\n\n"
         
-        for booking in bookings:
-            # 確保time_slot被視為台北時間
-            time_slot_dt = booking['time_slot']
-            if time_slot_dt.tzinfo is None:
-                # 數據庫時間沒有時區信息，設為台北時區
-                time_slot_dt = TAIPEI_TZ.localize(time_slot_dt)
-            else:
-                # 轉換為台北時區
-                time_slot_dt = time_slot_dt.astimezone(TAIPEI_TZ)
-            
-            # 格式化時間段為 "YYYY-MM-DD-HH:MM" - 確保與前端格式一致
-            time_slot_formatted = time_slot_dt.strftime('%Y-%m-%d-%H:%M')
-            booked_slots.append(time_slot_formatted)
+        try:
+            if cursor_values is None:
+                _, cursor_values, _, _ = read_changes(None)
+                cursor = encode_keyset_cursor(*cursor_values)
+                yield format_sse_event('ready', {'cursor': cursor}, event_id=cursor)
             
-            # 預約介面不需要顯示用戶姓名，只返回空字符串
-            user_display_name = ''
+            counter = get_booking_change_counter()
+            # 重連時先補送斷線期間的變更
+            need_poll = cursor_param is not None
+            last_poll = time.monotonic()
+            pending_retry_at = None
+            pending_retry_seconds = BOOKING_STREAM_PENDING_RETRY_SECONDS
             
-            booking_details.append({
-                'id': str(booking['id']),
-                'user_email': booking['user_email'],
-                'user_display_name': user_display_name,  # 新增格式化的顯示名稱
-                'time_slot': time_slot_formatted,
-                'status': booking['status'],
-                'machine_id': str(booking['machine_id']),
-                'created_at': booking['created_at'].isoformat() if booking['created_at'] else None
-            })
+            while time.monotonic() - started < BOOKING_STREAM_MAX_SECONDS:
+                if need_poll:
+                    rows, next_cursor_values, expired, pending = read_changes(cursor_values)
+                    last_poll = time.monotonic()
+                    need_poll = False
+                    if pending:
+                        pending_retry_at = last_poll + pending_retry_seconds
+                        pending_retry_seconds = min(pending_retry_seconds * 2, BOOKING_STREAM_HEARTBEAT_SECONDS)
+                    else:
+                        pending_retry_at = None
+                        pending_retry_seconds = BOOKING_STREAM_PENDING_RETRY_SECONDS
+                    if expired:
+                        # 斷線太久，中間的變更已被清除，通知前端重新完整載入
+                        cursor_values = next_cursor_values
+                        cursor = encode_keyset_cursor(*cursor_values)
+                        yield format_sse_event('resync', {'cursor': cursor}, event_id=cursor)
+                    elif next_cursor_values != cursor_values:
+                        cursor_values = next_cursor_values
+                        cursor = encode_keyset_cursor(*cursor_values)
+                        if rows:
+                            yield format_sse_event('bookings', {
+                                'changes': [format_booking_change(row, user_email) for row in rows],
+                                'cursor': cursor
+                            }, event_id=cursor)
+                        else:
+                            yield format_sse_event(None, event_id=cursor)
+                
+                poll_remaining = BOOKING_STREAM_POLL_SECONDS - (time.monotonic() - last_poll)
+                if pending_retry_at is not None:
+                    poll_remaining = min(poll_remaining, pending_retry_at - time.monotonic())
+                timeout = max(0, min(BOOKING_STREAM_HEARTBEAT_SECONDS, poll_remaining))
+                new_counter = wait_for_booking_change(counter, timeout)
+                if new_counter != counter:
+                    counter = new_counter
+                    need_poll = True
+                elif time.monotonic() - last_poll >= BOOKING_STREAM_POLL_SECONDS:
+                    need_poll = True
+                elif pending_retry_at is not None and time.monotonic() >= pending_retry_at:
+                    need_poll = True
+                else:
+                    yield ": heartbeat\n\n"
+        except psycopg2.Error as e:
+            # 結束串流，瀏覽器會帶 Last-Event-ID 重連
+            logger.error(f"Database error in booking stream: {e}")
+    
+    response = app.response_class(stream_with_context(generate(cursor_values)), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # 避免反向代理緩衝事件
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+# 跨機器空檔搜尋的參數上限
+AVAILABLE_SEARCH_DEFAULT_HORIZON_DAYS = 14
+AVAILABLE_SEARCH_MAX_HORIZON_DAYS = 60
+AVAILABLE_SEARCH_DEFAULT_LIMIT = 10
+AVAILABLE_SEARCH_MAX_LIMIT = 50
+
+def parse_rolling_window_quota(restrictions):
+    """
+    從生效中的限制規則取出滾動窗口設定
+    返回：(quota, error)，quota 為 {'window_size', 'max_bookings'} 或 None（沒有使用次數限制）
+    """
+    import json
+    usage_limit = next((r for r in restrictions if r['restriction_type'] == 'usage_limit'), None)
+    if not usage_limit:
+        return None, None
+    try:
+        rule = json.loads(usage_limit['restriction_rule'])
+    except (json.JSONDecodeError, TypeError):
+        return None, '系統限制規則格式錯誤，請聯繫管理員'
+    if rule.get('restriction_type') != 'rolling_window_limit':
+        return None, '系統限制格式錯誤，請聯繫管理員'
+    return {
+        'window_size': rule.get('window_size', 30),
+        'max_bookings': rule.get('max_bookings', 18)
+    }, None
+
+def run_fits_rolling_window(user_slot_indices, run_start, duration, window_size, max_bookings):
+    """
+    判斷在既有預約（已排序的時段索引）之外再加入 [run_start, run_start + duration) 後，
+    任意連續 window_size 個時段內的預約數是否仍不超過 max_bookings
+    只需檢查與新區段重疊的窗口
+    """
+    run_end = run_start + duration - 1
+    for window_start in range(run_start - window_size + 1, run_end + 1):
+        window_end = window_start + window_size - 1
+        existing = (bisect.bisect_right(user_slot_indices, window_end)
+                    - bisect.bisect_left(user_slot_indices, window_start))
+        added = min(run_end, window_end) - max(run_start, window_start) + 1
+        if existing + added > max_bookings:
+            return False
+    return True
+
+@app.route('/bookings/available-search', methods=['GET'])
+def search_available_slots():
+    """
+    跨機器搜尋最早可預約的連續時段
+    參數：start_time（期望開始時間，預設現在）、duration（連續時段數，預設1）、
+          machine_ids（逗號分隔，可選）、horizon_days（搜尋天數）、limit（返回筆數）
+    只返回用戶可使用的機器，並確保加入後不超過用戶的滾動窗口限制
+    其他用戶尚未過期的時段暫留與機器維護窗口內的時段視為已佔用
+    所有機器的預約與暫留以單一查詢取回，搜尋在記憶體中完成
+    """
+    try:
+        user_email = request.headers.get('X-User-Email', '')
         
-        # 從 session 或 request headers 獲取當前用戶郵箱
-        current_user_email = request.headers.get('X-User-Email', '')
+        if not user_email:
+            return jsonify({'error': 'User email required'}), 400
         
-        # 清理和標準化用戶郵箱
-        current_user_email = current_user_email.strip().lower() if current_user_email else ''
+        try:
+            duration = int(request.args.get('duration', 1))
+            horizon_days = int(request.args.get('horizon_days', AVAILABLE_SEARCH_DEFAULT_HORIZON_DAYS))
+            limit = int(request.args.get('limit', AVAILABLE_SEARCH_DEFAULT_LIMIT))
+            machine_ids_param = request.args.get('machine_ids', '')
+            machine_id_filter = {int(m) for m in machine_ids_param.split(',') if m.strip()} if machine_ids_param else None
+        except ValueError:
+            return jsonify({'error': 'Invalid duration, horizon_days, limit or machine_ids'}), 400
+        
+        if duration < 1 or duration > MAX_BATCH_BOOKING_SLOTS:
+            return jsonify({'error': f'duration must be between 1 and {MAX_BATCH_BOOKING_SLOTS}'}), 400
+        horizon_days = max(1, min(horizon_days, AVAILABLE_SEARCH_MAX_HORIZON_DAYS))
+        limit = max(1, min(limit, AVAILABLE_SEARCH_MAX_LIMIT))
+        
+        now = get_taipei_now().replace(tzinfo=None)
+        # 進行中的時段仍可預約，因此最早從目前時段開始
+        earliest_index = datetime_to_slot_index(now)
+        
+        start_time_str = request.args.get('start_time')
+        if start_time_str:
+            start_time = parse_frontend_datetime(start_time_str)
+            if start_time is None:
+                return jsonify({'error': 'Invalid start_time format'}), 400
+            start_time = start_time.replace(tzinfo=None)
+            # 期望開始時間不在時段邊界時，取下一個時段
+            start_index = datetime_to_slot_index(start_time)
+            if slot_index_to_datetime(start_index) < start_time:
+                start_index += 1
+            start_index = max(start_index, earliest_index)
+        else:
+            start_index = earliest_index
         
-        logger.info(f"Retrieved {len(bookings)} active bookings for machine {machine_id}")
-        logger.info(f"Current user email from header: '{current_user_email}'")
+        end_index = datetime_to_slot_index(now + timedelta(days=horizon_days))
         
-        # 額外的安全檢查：確保用戶郵箱不為空
-        if not current_user_email:
-            logger.warning("No user email provided in request headers")
-            return jsonify({
-                'bookedSlots': booked_slots,
-                'bookingDetails': [],  # 不返回詳細信息
-                'currentUserEmail': '',
-                'error': 'User authentication required'
-            }), 200
+        conn = get_db_conn()
+        cur = conn.cursor(cursor_factory=RealDictCursor)
         
-        # 分析當前用戶的連續預約情況
-        cooldown_slots = []
-        usage_info = {}
+        # 可預約的機器與生效中的限制規則一次取回，限制判斷在記憶體中完成
+        machines = fetch_machines_with_restrictions(cur, bookable_only=True)
+        if machine_id_filter is not None:
+            machines = [m for m in machines if m['id'] in machine_id_filter]
         
-        # 處理預約詳情顯示，其他用戶顯示格式化姓名
-        safe_booking_details = []
-        for detail in booking_details:
-            detail_copy = detail.copy()
-            # 標準化預約用戶郵箱用於比較
-            booking_user_email = (detail['user_email'] or '').strip().lower()
+        candidates = []
+        excluded_machines = []
+        for machine in machines:
+            is_allowed, restriction_reason = evaluate_machine_restrictions(
+                user_email, machine['restriction_status'], machine['restrictions']
+            )
+            if not is_allowed:
+                excluded_machines.append({'machine_id': str(machine['id']), 'reason': restriction_reason})
+                continue
             
-            # 如果不是自己的預約，隱藏用戶郵箱但顯示格式化姓名
-            if booking_user_email != current_user_email:
-                detail_copy['user_email'] = 'hidden'  # 隱藏其他用戶的郵箱
-                # user_display_name 保持不變，顯示格式化的姓名
+            quota = None
+            if machine['restriction_status'] == 'limited':
+                quota, quota_error = parse_rolling_window_quota(machine['restrictions'])
+                if quota_error:
+                    excluded_machines.append({'machine_id': str(machine['id']), 'reason': quota_error})
+                    continue
+                if quota and duration > quota['max_bookings']:
+                    excluded_machines.append({
+                        'machine_id': str(machine['id']),
+                        'reason': f"連續{duration}個時段超過滾動窗口限制（最多{quota['max_bookings']}次）"
+                    })
+                    continue
+            candidates.append((machine, quota))
+        
+        results = []
+        if candidates and start_index + duration <= end_index:
+            # 單一查詢：搜尋範圍內所有已佔用時段，加上用戶在這些機器上的未來預約（計算滾動窗口用），
+            # 以及其他用戶尚未過期的暫留（只算佔用，不計入滾動窗口）
+            # 預約的兩個條件分別落在 (machine_id, time_slot) 與 (machine_id, user_email, time_slot) 的 active 部分索引上，
+            # 暫留落在 (machine_id, time_slot) 唯一索引上
+            cur.execute("""
+                SELECT machine_id, user_email, time_slot, false AS held
+                FROM bookings
+                WHERE status = 'active'
+                AND machine_id = ANY(%(machine_ids)s)
+                AND (
+                    (time_slot >= %(range_start)s AND time_slot < %(range_end)s)
+                    OR (user_email = %(user_email)s AND time_slot >= %(now)s)
+                )
+                UNION ALL
+                SELECT machine_id, user_email, time_slot, true AS held
+                FROM slot_holds
+                WHERE machine_id = ANY(%(machine_ids)s)
+                AND time_slot >= %(range_start)s AND time_slot < %(range_end)s
+                AND expires_at > %(now)s
+                AND lower(user_email) <> %(hold_user_email)s
+            """, {
+                'machine_ids': [machine['id'] for machine, _ in candidates],
+                'range_start': slot_index_to_datetime(start_index),
+                'range_end': slot_index_to_datetime(end_index),
+                'user_email': user_email,
+                'hold_user_email': user_email.strip().lower(),
+                'now': now
+            })
             
-            safe_booking_details.append(detail_copy)
+            occupied = {}
+            user_slots = {}
+            for row in cur.fetchall():
+                slot_index = datetime_to_slot_index(row['time_slot'])
+                if start_index <= slot_index < end_index:
+                    occupied.setdefault(row['machine_id'], set()).add(slot_index)
+                if not row['held'] and row['user_email'] == user_email and row['time_slot'] >= now:
+                    user_slots.setdefault(row['machine_id'], []).append(slot_index)
+            
+            for machine, quota in candidates:
+                machine_occupied = occupied.get(machine['id'], set())
+                # 維護窗口內的時段視為已佔用
+                maintenance_range = get_maintenance_slot_range(machine)
+                if maintenance_range is not None:
+                    machine_occupied = machine_occupied | set(range(
+                        max(maintenance_range[0], start_index), min(maintenance_range[1], end_index)
+                    ))
+                machine_user_slots = sorted(set(user_slots.get(machine['id'], [])))
+                
+                # 線性掃描：free_run 為到目前為止連續空閒的時段數
+                free_run = 0
+                for slot_index in range(start_index, end_index):
+                    if slot_index in machine_occupied:
+                        free_run = 0
+                        continue
+                    free_run += 1
+                    if free_run < duration:
+                        continue
+                    run_start = slot_index - duration + 1
+                    if quota and not run_fits_rolling_window(
+                        machine_user_slots, run_start, duration, quota['window_size'], quota['max_bookings']
+                    ):
+                        continue
+                    results.append({
+                        'machine_id': str(machine['id']),
+                        'machine_name': machine['name'],
+                        'machine_status': machine['status'],
+                        'start_time': TAIPEI_TZ.localize(slot_index_to_datetime(run_start)).isoformat(),
+                        'end_time': TAIPEI_TZ.localize(slot_index_to_datetime(run_start + duration)).isoformat(),
+                        'time_slots': [slot_index_to_str(i) for i in range(run_start, run_start + duration)],
+                        'rolling_window': quota
+                    })
+                    break
         
-        # 分析當前用戶的滾動窗口使用情況（替代舊的連續預約分析）
-        rolling_window_info = {}
+        results.sort(key=lambda r: (r['start_time'], int(r['machine_id'])))
+        results = results[:limit]
         
-        if current_user_email:
-            # 先檢查機器的restriction_status
-            cur.execute("SELECT restriction_status FROM machines WHERE id = %s", (machine_id,))
-            machine = cur.fetchone()
-            
-            if machine and machine['restriction_status'] == 'limited':
-                # 只有在限制狀態為"limited"時才查詢限制信息
-                rolling_window_info = get_user_rolling_window_status(
-                    current_user_email, machine_id, cur
-                )
-                logger.info(f"Rolling window status for user {current_user_email}: {rolling_window_info}")
-            elif machine and machine['restriction_status'] == 'blocked':
-                # 機器被阻止
-                rolling_window_info = {
-                    'has_limit': False,
-                    'blocked': True,
-                    'blocked_reason': '此機器目前被管理員完全封鎖'
-                }
-            else:
-                # restriction_status為"none"或機器不存在，不應用限制
-                rolling_window_info = {
-                    'has_limit': False
-                }
-                logger.info(f"Machine {machine_id} has no restrictions or restriction_status is 'none'")
+        logger.info(f"Available slot search for user {user_email}: duration={duration}, {len(results)} results from {len(candidates)} machines")
         
         return jsonify({
-            'bookedSlots': booked_slots,
-            'bookingDetails': safe_booking_details,
-            'currentUserEmail': current_user_email,
-            'cooldownSlots': [],  # 新滾動窗口機制不使用固定冷卻期
-            'usageInfo': rolling_window_info  # 使用滾動窗口狀態信息
+            'results': results,
+            'total': len(results),
+            'excluded_machines': excluded_machines,
+            'search': {
+                'start_time': TAIPEI_TZ.localize(slot_index_to_datetime(start_index)).isoformat(),
+                'end_time': TAIPEI_TZ.localize(slot_index_to_datetime(end_index)).isoformat(),
+                'duration': duration,
+                'limit': limit
+            }
         }), 200
 
     except psycopg2.Error as e:
@@ -860,12 +3042,59 @@ def get_machine_bookings(machine_id):
         if 'conn' in locals():
             conn.close()
 
+# 用戶預約記錄分頁設定
+USER_BOOKINGS_DEFAULT_PAGE_SIZE = 50
+USER_BOOKINGS_MAX_PAGE_SIZE = 200
+
 @app.route('/users/<user_email>/bookings', methods=['GET'])
 def get_user_bookings(user_email):
     """
     獲取指定用戶的所有預約記錄
+    可選參數：
+    - start_time / end_time：只返回 time_slot 在範圍內的預約
+    - status：狀態篩選（可逗號分隔）
+    - limit / cursor：游標分頁（依 time_slot, id 由新到舊），返回 next_cursor
+    - summary=true：只返回各狀態筆數與總時數，不返回明細
     """
     try:
+        conditions = ["b.user_email = %s"]
+        params = [user_email]
+        
+        status = request.args.get('status')
+        if status:
+            statuses = [s.strip() for s in status.split(',') if s.strip()]
+            if any(s not in ['active', 'cancelled', 'completed', 'no_show'] for s in statuses):
+                return jsonify({'error': 'Invalid status'}), 400
+            conditions.append("b.status = ANY(%s)")
+            params.append(statuses)
+        
+        for key, operator in [('start_time', '>='), ('end_time', '<')]:
+            if request.args.get(key):
+                parsed_time = parse_frontend_datetime(request.args.get(key))
+                if parsed_time is None:
+                    return jsonify({'error': f'Invalid {key} format'}), 400
+                conditions.append(f"b.time_slot {operator} %s")
+                params.append(parsed_time.replace(tzinfo=None))
+        
+        summary_mode = request.args.get('summary', '').lower() in ['1', 'true', 'yes']
+        paginated = 'limit' in request.args or 'cursor' in request.args
+        limit = None
+        keyset_params = []
+        if paginated and not summary_mode:
+            try:
+                limit = int(request.args.get('limit', USER_BOOKINGS_DEFAULT_PAGE_SIZE))
+            except ValueError:
+                return jsonify({'error': 'Invalid limit'}), 400
+            limit = max(1, min(limit, USER_BOOKINGS_MAX_PAGE_SIZE))
+            
+            cursor = request.args.get('cursor')
+            if cursor:
+                cursor_values = decode_keyset_cursor(cursor)
+                try:
+                    keyset_params = [datetime.fromisoformat(cursor_values[0]), int(cursor_values[1])]
+                except (TypeError, ValueError, IndexError, KeyError):
+                    return jsonify({'error': 'Invalid cursor'}), 400
+        
         conn = get_db_conn()
         cur = conn.cursor(cursor_factory=RealDictCursor)
         
@@ -876,8 +3105,35 @@ def get_user_bookings(user_email):
         if not user:
             return jsonify({'error': 'User not found'}), 404
         
-        # 獲取預約記錄，按開始時間倒序排列
-        cur.execute("""
+        if summary_mode:
+            # 只讀 (user_email, time_slot) INCLUDE (status) 索引即可完成統計
+            cur.execute(f"""
+                SELECT b.status, COUNT(*) as booking_count
+                FROM bookings b
+                WHERE {' AND '.join(conditions)}
+                GROUP BY b.status
+            """, params)
+            
+            status_counts = {row['status']: row['booking_count'] for row in cur.fetchall()}
+            total_bookings = sum(status_counts.values())
+            # 已取消的預約不計入使用時數
+            used_slots = total_bookings - status_counts.get('cancelled', 0)
+            
+            return jsonify({
+                'summary': {
+                    'status_counts': status_counts,
+                    'total_bookings': total_bookings,
+                    'total_hours': used_slots * SLOT_HOURS,
+                    'hours_by_status': {status: count * SLOT_HOURS for status, count in status_counts.items()}
+                }
+            }), 200
+        
+        if keyset_params:
+            conditions.append("(b.time_slot, b.id) < (%s, %s)")
+            params.extend(keyset_params)
+        
+        # 獲取預約記錄，按開始時間倒序排列（id 作為次要排序，確保游標分頁穩定）
+        query = f"""
             SELECT 
                 b.id,
                 b.machine_id,
@@ -890,12 +3146,24 @@ def get_user_bookings(user_email):
                 b.updated_at
             FROM bookings b
             JOIN machines m ON b.machine_id = m.id
-            WHERE b.user_email = %s
-            ORDER BY b.time_slot DESC
-        """, (user_email,))
+            WHERE {' AND '.join(conditions)}
+            ORDER BY b.time_slot DESC, b.id DESC
+        """
+        if paginated:
+            # 多取一筆用來判斷是否還有下一頁
+            query += " LIMIT %s"
+            params.append(limit + 1)
+        
+        cur.execute(query, params)
         
         bookings = cur.fetchall()
         
+        next_cursor = None
+        if paginated and len(bookings) > limit:
+            bookings = bookings[:limit]
+            last = bookings[-1]
+            next_cursor = encode_keyset_cursor(last['start_time'], last['id'])
+        
         # 轉換為前端需要的格式，確保時間是ISO字符串
         booking_list = []
         for booking in bookings:
@@ -930,13 +3198,19 @@ def get_user_bookings(user_email):
                 'start_time': start_time_iso,
                 'end_time': end_time_iso,
                 'status': booking['status'],
-                'created_at': booking['created_at'].isoformat() if booking['created_at'] else None,
-                'updated_at': booking['updated_at'].isoformat() if booking['updated_at'] else None
+                'created_at': booking['created_at'],
+                'updated_at': booking['updated_at']
             })
         
-        return jsonify({
+        result = {
             'bookings': booking_list
-        }), 200
+        }
+        if paginated:
+            result['limit'] = limit
+            result['next_cursor'] = next_cursor
+            result['has_more'] = next_cursor is not None
+        
+        return jsonify(result), 200
         
     except psycopg2.Error as e:
         logger.error(f"Database error: {e}")
@@ -951,14 +3225,24 @@ def get_user_bookings(user_email):
             conn.close()
 
 
+CALENDAR_VIEW_BOOKING_FIELDS = [
+    'id', 'machine_id', 'machine_name', 'user_email', 'user_display_name', 'time_slot', 'status', 'created_at'
+]
+
 @app.route('/bookings/calendar-view', methods=['GET'])
 def get_calendar_view_bookings():
     """
     專門為日曆頁面提供的API
     返回格式化用戶姓名和完整預約資訊
     與預約介面的API分離，避免洩露敏感資訊
+    
+    可選 fields= 只返回指定欄位；format=columnar 時 bookings 改為平行陣列
     """
     try:
+        fields, columnar, error_message = parse_list_shape_params(request.args, CALENDAR_VIEW_BOOKING_FIELDS)
+        if error_message:
+            return jsonify({'error': error_message}), 400
+        
         conn = get_db_conn()
         cur = conn.cursor(cursor_factory=RealDictCursor)
         
@@ -1053,10 +3337,13 @@ def get_calendar_view_bookings():
             })
         
         logger.info(f"Retrieved {len(calendar_bookings)} calendar view bookings")
-        return jsonify({
-            'bookings': calendar_bookings,
+        result = {
+            'bookings': shape_records(calendar_bookings, CALENDAR_VIEW_BOOKING_FIELDS, fields=fields, columnar=columnar),
             'total': len(calendar_bookings)
-        }), 200
+        }
+        if columnar:
+            result['format'] = 'columnar'
+        return jsonify(result), 200
         
     except psycopg2.Error as e:
         logger.error(f"Database error in calendar view bookings: {e}")
@@ -1151,8 +3438,8 @@ def get_user_monthly_bookings(user_email):
                 'start_time': start_time_iso,
                 'end_time': end_time_iso,
                 'status': booking['status'],
-                'created_at': booking['created_at'].isoformat() if booking['created_at'] else None,
-                'updated_at': booking['updated_at'].isoformat() if booking['updated_at'] else None
+                'created_at': booking['created_at'],
+                'updated_at': booking['updated_at']
             })
         
         logger.info(f"User {user_email} retrieved monthly bookings for {year}-{month}: {len(booking_list)} bookings")
@@ -1257,6 +3544,7 @@ def admin_delete_booking(booking_id):
             }), 400
         
         conn.commit()
+        publish_booking_changes([{'user_email': booking['user_email'], 'machine_id': booking['machine_id']}])
         
         # 格式化時間用於日誌和響應
         time_slot_formatted = ''
@@ -1268,28 +3556,86 @@ def admin_delete_booking(booking_id):
                 time_slot_dt = time_slot_dt.astimezone(TAIPEI_TZ)
             time_slot_formatted = time_slot_dt.strftime("%Y/%m/%d %H:%M")
         
-        logger.info(f"Admin {admin_email} deleted booking: ID {booking_id}")
-        logger.info(f"  - User: {booking['user_name']} ({booking['user_email']})")
-        logger.info(f"  - Machine: {booking['machine_name']} (ID: {booking['machine_id']})")
-        logger.info(f"  - Time slot: {time_slot_formatted}")
-        logger.info(f"  - Status: {booking['status']}")
-        logger.info(f"  - Deleted {deleted_usage_records} usage records")
+        logger.info(f"Admin {admin_email} deleted booking: ID {booking_id}")
+        logger.info(f"  - User: {booking['user_name']} ({booking['user_email']})")
+        logger.info(f"  - Machine: {booking['machine_name']} (ID: {booking['machine_id']})")
+        logger.info(f"  - Time slot: {time_slot_formatted}")
+        logger.info(f"  - Status: {booking['status']}")
+        logger.info(f"  - Deleted {deleted_usage_records} usage records")
+        
+        return jsonify({
+            'success': True,
+            'message': f'預約已成功刪除',
+            'details': {
+                'booking_id': booking_id,
+                'user_name': booking['user_name'],
+                'user_email': booking['user_email'],
+                'machine_name': booking['machine_name'],
+                'time_slot': time_slot_formatted,
+                'status': booking['status'],
+                'deleted_usage_records': deleted_usage_records,
+                'deleted_by': admin_email,
+                'deleted_at': get_taipei_now().strftime("%Y/%m/%d %H:%M:%S")
+            },
+            'booking_info': booking_info
+        }), 200
+
+    except psycopg2.Error as e:
+        logger.error(f"Database error: {e}")
+        if 'conn' in locals():
+            conn.rollback()
+        return jsonify({'error': 'Database error', 'detail': str(e)}), 500
+    except Exception as e:
+        logger.error(f"Unexpected error: {e}")
+        return jsonify({'error': 'Internal server error', 'detail': str(e)}), 500
+    finally:
+        if 'cur' in locals():
+            cur.close()
+        if 'conn' in locals():
+            conn.close()
+
+@app.route('/admin/bookings/bulk-cancel', methods=['POST'])
+def admin_bulk_cancel_bookings():
+    """
+    管理員批量取消預約（狀態設為 cancelled，並刪除相關使用記錄）
+    傳送 booking_ids，或 filter（machine_id, start_time, end_time, user_email）
+    可以取消任何用戶的 active 預約，需要manager或admin權限
+    """
+    try:
+        # 從header獲取管理員email
+        admin_email = request.headers.get('X-Admin-Email', '')
+        is_authorized, admin_role = verify_admin_permission(admin_email)
+        
+        if not is_authorized:
+            return jsonify({'error': 'Access denied. Manager or admin role required.'}), 403
+        
+        data = request.get_json() or {}
+        booking_ids, filters, error_message = parse_bulk_cancel_request(data)
+        if error_message:
+            return jsonify({'error': 'Invalid request', 'message': error_message}), 400
+        
+        conn = get_db_conn()
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        
+        results, deleted_usage_records, changed_pairs = bulk_cancel_bookings(
+            cur, booking_ids=booking_ids, filters=filters, owner_email=None, future_only=False
+        )
+        
+        conn.commit()
+        publish_booking_changes([
+            {'user_email': email, 'machine_id': machine_id} for email, machine_id in changed_pairs
+        ])
+        
+        summary = build_bulk_cancel_summary(results, deleted_usage_records)
+        logger.info(f"Admin {admin_email} bulk cancelled bookings: {summary}")
         
         return jsonify({
             'success': True,
-            'message': f'預約已成功刪除',
-            'details': {
-                'booking_id': booking_id,
-                'user_name': booking['user_name'],
-                'user_email': booking['user_email'],
-                'machine_name': booking['machine_name'],
-                'time_slot': time_slot_formatted,
-                'status': booking['status'],
-                'deleted_usage_records': deleted_usage_records,
-                'deleted_by': admin_email,
-                'deleted_at': get_taipei_now().strftime("%Y/%m/%d %H:%M:%S")
-            },
-            'booking_info': booking_info
+            'message': f'已取消{summary["cancelled"]}筆預約',
+            'results': results,
+            'summary': summary,
+            'cancelled_by': admin_email,
+            'cancelled_at': get_taipei_now().strftime("%Y/%m/%d %H:%M:%S")
         }), 200
 
     except psycopg2.Error as e:
@@ -1308,6 +3654,40 @@ def admin_delete_booking(booking_id):
 
 # =========== 機器API ===========
 
+def build_user_machine_list(user_email, machines):
+    """
+    將機器資料（含生效中的限制規則）轉換為一般用戶的機器列表格式
+    有用戶email時附上限制判斷結果
+    """
+    machine_list = []
+    for machine in machines:
+        machine_id = machine['id']
+        machine_data = {
+            'id': str(machine['id']),
+            'name': machine['name'],
+            'description': machine['description'],
+            'status': machine['status'],
+            'restriction_status': machine['restriction_status']
+        }
+        
+        # 如果有用戶email，檢查限制並添加限制資訊
+        if user_email:
+            is_allowed, restriction_reason = evaluate_machine_restrictions(
+                user_email, machine['restriction_status'], machine['restrictions']
+            )
+            machine_data['is_restricted'] = not is_allowed
+            machine_data['restriction_reason'] = restriction_reason
+            
+            if not is_allowed:
+                logger.info(f"User {user_email} has restriction on machine {machine_id}: {restriction_reason}")
+        else:
+            machine_data['is_restricted'] = False
+            machine_data['restriction_reason'] = None
+        
+        machine_list.append(machine_data)
+    
+    return machine_list
+
 @app.route('/machines', methods=['GET'])
 def get_machines():
     """
@@ -1356,8 +3736,8 @@ def get_machines():
                     'status': machine['status'],
                     'restriction_status': machine['restriction_status'],
                     'restriction_count': machine['restriction_count'],
-                    'created_at': machine['created_at'].isoformat() if machine['created_at'] else None,
-                    'updated_at': machine['updated_at'].isoformat() if machine['updated_at'] else None
+                    'created_at': machine['created_at'],
+                    'updated_at': machine['updated_at']
                 })
             
             logger.info(f"Admin {admin_email} retrieved {len(machine_list)} machines")
@@ -1369,40 +3749,10 @@ def get_machines():
             }), 200
         else:
             # 一般用戶請求：返回基本數據並包含限制資訊，不過濾機器
-            cur.execute("""
-                SELECT id, name, description, status, restriction_status 
-                FROM machines 
-                WHERE status IN ('active', 'maintenance')
-                ORDER BY id
-            """)
-            
-            machines = cur.fetchall()
+            # 機器與生效中的限制規則一次查詢取回，限制判斷在記憶體中完成
+            machines = fetch_machines_with_restrictions(cur, bookable_only=True)
             
-            # 轉換為前端需要的格式並添加限制資訊
-            machine_list = []
-            for machine in machines:
-                machine_id = machine['id']
-                machine_data = {
-                    'id': str(machine['id']),
-                    'name': machine['name'],
-                    'description': machine['description'],
-                    'status': machine['status'],
-                    'restriction_status': machine['restriction_status']
-                }
-                
-                # 如果有用戶email，檢查限制並添加限制資訊
-                if user_email:
-                    is_allowed, restriction_reason = check_machine_restriction(user_email, machine_id)
-                    machine_data['is_restricted'] = not is_allowed
-                    machine_data['restriction_reason'] = restriction_reason
-                    
-                    if not is_allowed:
-                        logger.info(f"User {user_email} has restriction on machine {machine_id}: {restriction_reason}")
-                else:
-                    machine_data['is_restricted'] = False
-                    machine_data['restriction_reason'] = None
-                
-                machine_list.append(machine_data)
+            machine_list = build_user_machine_list(user_email, machines)
             
             logger.info(f"User {user_email} retrieved {len(machine_list)} machines (including restricted ones)")
             
@@ -1523,6 +3873,80 @@ def handle_machine_restrictions(machine_id):
     elif request.method == 'POST':
         return create_machine_restriction_simple(machine_id)
 
+def build_machine_restrictions_payload(machine_id, cur):
+    """
+    產生機器限制規則列表的回應內容（只包含啟用中的規則，描述統一為新格式）
+    供 GET /machines/<id>/restrictions 與機器頁面啟動資料共用
+    """
+    # 獲取機器的限制規則（只顯示活動的和用戶需要知道的信息）
+    cur.execute("""
+        SELECT 
+            id,
+            restriction_type,
+            restriction_rule,
+            is_active,
+            start_time,
+            end_time,
+            created_at,
+            updated_at
+        FROM machine_restrictions
+        WHERE machine_id = %s AND is_active = true
+        ORDER BY created_at DESC
+    """, (machine_id,))
+
+    restrictions = cur.fetchall()
+
+    # 轉換為前端需要的格式，並確保描述使用新格式
+    restriction_list = []
+    for restriction in restrictions:
+        restriction_data = {
+            'id': str(restriction['id']),
+            'restriction_type': restriction['restriction_type'],
+            'restriction_rule': restriction['restriction_rule'],
+            'is_active': restriction['is_active'],
+            'start_time': restriction['start_time'].isoformat() if restriction['start_time'] else None,
+            'end_time': restriction['end_time'].isoformat() if restriction['end_time'] else None,
+            'created_at': restriction['created_at'].isoformat() if restriction['created_at'] else None,
+            'updated_at': restriction['updated_at'].isoformat() if restriction['updated_at'] else None
+        }
+
+        # 解析並標準化描述格式
+        try:
+            import json
+            rule = json.loads(restriction['restriction_rule'])
+
+            if restriction['restriction_type'] == 'usage_limit' and rule.get('restriction_type') == 'rolling_window_limit':
+                window_size = rule.get('window_size', 30)
+                max_bookings = rule.get('max_bookings', 18)
+                total_hours = window_size * 4
+
+                # 確保使用統一的新格式描述
+                standard_description = f"任意連續{window_size}個時段內，最多只能預約{max_bookings}次（窗口大小：{total_hours}小時）"
+                rule['description'] = standard_description
+
+                # 更新restriction_rule為標準化版本
+                restriction_data['restriction_rule'] = json.dumps(rule, ensure_ascii=False)
+                restriction_data['parsed_description'] = standard_description
+                restriction_data['window_info'] = {
+                    'window_size': window_size,
+                    'max_bookings': max_bookings,
+                    'total_hours': total_hours
+                }
+
+        except (json.JSONDecodeError, KeyError):
+            # 如果解析失敗，保持原始數據
+            pass
+
+        restriction_list.append(restriction_data)
+
+    logger.info(f"User retrieved {len(restriction_list)} restrictions for machine {machine_id}")
+
+    return {
+        'restrictions': restriction_list,
+        'total': len(restriction_list),
+        'machine_id': str(machine_id)
+    }
+
 def get_machine_restrictions_simple(machine_id):
     """
     獲取機器的限制規則（統一路由）
@@ -1539,74 +3963,7 @@ def get_machine_restrictions_simple(machine_id):
         conn = get_db_conn()
         cur = conn.cursor(cursor_factory=RealDictCursor)
         
-        # 獲取機器的限制規則（只顯示活動的和用戶需要知道的信息）
-        cur.execute("""
-            SELECT 
-                id,
-                restriction_type,
-                restriction_rule,
-                is_active,
-                start_time,
-                end_time,
-                created_at,
-                updated_at
-            FROM machine_restrictions
-            WHERE machine_id = %s AND is_active = true
-            ORDER BY created_at DESC
-        """, (machine_id,))
-        
-        restrictions = cur.fetchall()
-        
-        # 轉換為前端需要的格式，並確保描述使用新格式
-        restriction_list = []
-        for restriction in restrictions:
-            restriction_data = {
-                'id': str(restriction['id']),
-                'restriction_type': restriction['restriction_type'],
-                'restriction_rule': restriction['restriction_rule'],
-                'is_active': restriction['is_active'],
-                'start_time': restriction['start_time'].isoformat() if restriction['start_time'] else None,
-                'end_time': restriction['end_time'].isoformat() if restriction['end_time'] else None,
-                'created_at': restriction['created_at'].isoformat() if restriction['created_at'] else None,
-                'updated_at': restriction['updated_at'].isoformat() if restriction['updated_at'] else None
-            }
-            
-            # 解析並標準化描述格式
-            try:
-                import json
-                rule = json.loads(restriction['restriction_rule'])
-                
-                if restriction['restriction_type'] == 'usage_limit' and rule.get('restriction_type') == 'rolling_window_limit':
-                    window_size = rule.get('window_size', 30)
-                    max_bookings = rule.get('max_bookings', 18)
-                    total_hours = window_size * 4
-                    
-                    # 確保使用統一的新格式描述
-                    standard_description = f"任意連續{window_size}個時段內，最多只能預約{max_bookings}次（窗口大小：{total_hours}小時）"
-                    rule['description'] = standard_description
-                    
-                    # 更新restriction_rule為標準化版本
-                    restriction_data['restriction_rule'] = json.dumps(rule, ensure_ascii=False)
-                    restriction_data['parsed_description'] = standard_description
-                    restriction_data['window_info'] = {
-                        'window_size': window_size,
-                        'max_bookings': max_bookings,
-                        'total_hours': total_hours
-                    }
-                
-            except (json.JSONDecodeError, KeyError):
-                # 如果解析失敗，保持原始數據
-                pass
-            
-            restriction_list.append(restriction_data)
-        
-        logger.info(f"User retrieved {len(restriction_list)} restrictions for machine {machine_id}")
-        
-        return jsonify({
-            'restrictions': restriction_list,
-            'total': len(restriction_list),
-            'machine_id': str(machine_id)
-        }), 200
+        return jsonify(build_machine_restrictions_payload(machine_id, cur)), 200
 
     except psycopg2.Error as e:
         logger.error(f"Database error: {e}")
@@ -1639,11 +3996,14 @@ def create_machine_restriction_simple(machine_id):
         start_time_str = data.get('start_time')
         end_time_str = data.get('end_time')
         
+        # 試算模式：只評估規則影響，不寫入資料庫
+        dry_run = str(request.args.get('dry_run', data.get('dry_run', ''))).lower() in ['1', 'true', 'yes']
+        
         # 驗證必要欄位
         if not restriction_type or not restriction_rule:
             return jsonify({'error': 'Missing required fields: restriction_type, restriction_rule'}), 400
         
-        if not start_time_str or not end_time_str:
+        if not dry_run and (not start_time_str or not end_time_str):
             return jsonify({'error': 'Missing required fields: start_time, end_time'}), 400
         
         if restriction_type not in ['year_limit', 'usage_limit']:
@@ -1675,6 +4035,22 @@ def create_machine_restriction_simple(machine_id):
         if not cur.fetchone():
             return jsonify({'error': 'Machine not found'}), 404
         
+        if dry_run:
+            try:
+                import json
+                rule = json.loads(restriction_rule) if isinstance(restriction_rule, str) else restriction_rule
+            except (json.JSONDecodeError, TypeError):
+                return jsonify({'error': 'Invalid restriction_rule format'}), 400
+            
+            impact = simulate_restriction_impact(machine_id, restriction_type, rule, start_time, end_time, cur)
+            if impact.get('error'):
+                return jsonify(impact), 400
+            
+            logger.info(f"Admin {admin_email} simulated restriction for machine {machine_id}: "
+                        f"{impact['total_affected_bookings']} bookings, {impact['total_affected_users']} users affected")
+            
+            return jsonify(impact), 200
+        
         # 創建限制規則
         cur.execute("""
             INSERT INTO machine_restrictions 
@@ -1941,11 +4317,27 @@ def verify_admin_permission(admin_email):
         if 'conn' in locals():
             conn.close()
 
+# 管理員用戶列表分頁設定
+ADMIN_USERS_DEFAULT_PAGE_SIZE = 100
+ADMIN_USERS_MAX_PAGE_SIZE = 500
+
+def escape_like_pattern(value):
+    """跳脫 LIKE 萬用字元，讓搜尋字串按字面比對"""
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
 @app.route('/admin/users', methods=['GET'])
 def get_all_users():
     """
     管理員獲取所有用戶列表
     只有manager和admin角色可以訪問
+    
+    依 created_at, id 由新到舊排序；傳入 limit 或 cursor 時使用游標分頁，不傳時維持返回全部資料
+    total 一律是符合條件的用戶總數：不分頁時為實際筆數，分頁時為估計值（total_estimate 相同），
+    分頁時另外返回本頁筆數 page_size 與 limit, next_cursor, has_more
+    可選參數：
+    - q：搜尋姓名或email；match=substring（預設，使用 trigram 索引）或 prefix（使用前綴索引）
+    - role：角色篩選（可逗號分隔）
+    - limit / cursor：分頁
     """
     try:
         # 從header獲取管理員email
@@ -1955,18 +4347,75 @@ def get_all_users():
         if not is_authorized:
             return jsonify({'error': 'Access denied. Manager or admin role required.'}), 403
         
+        conditions = []
+        params = []
+        
+        search_term = (request.args.get('q') or '').strip()
+        match_mode = request.args.get('match', 'substring')
+        if match_mode not in ['substring', 'prefix']:
+            return jsonify({'error': 'Invalid match. Must be one of: substring, prefix'}), 400
+        if search_term:
+            escaped = escape_like_pattern(search_term.lower())
+            if match_mode == 'prefix':
+                # lower(...) text_pattern_ops 索引支援前綴比對
+                conditions.append("(lower(email) LIKE %s OR lower(name) LIKE %s)")
+                params.extend([escaped + '%', escaped + '%'])
+            else:
+                # pg_trgm GIN 索引支援任意位置的子字串比對
+                conditions.append("(email ILIKE %s OR name ILIKE %s)")
+                params.extend(['%' + escaped + '%', '%' + escaped + '%'])
+        
+        role = request.args.get('role')
+        if role:
+            roles = [r.strip() for r in role.split(',') if r.strip()]
+            if any(r not in ['user', 'manager', 'admin'] for r in roles):
+                return jsonify({'error': 'Invalid role'}), 400
+            conditions.append("role = ANY(%s)")
+            params.append(roles)
+        
+        paginated = 'limit' in request.args or 'cursor' in request.args
+        limit = None
+        keyset_params = []
+        if paginated:
+            try:
+                limit = int(request.args.get('limit', ADMIN_USERS_DEFAULT_PAGE_SIZE))
+            except ValueError:
+                return jsonify({'error': 'Invalid limit'}), 400
+            limit = max(1, min(limit, ADMIN_USERS_MAX_PAGE_SIZE))
+            
+            cursor = request.args.get('cursor')
+            if cursor:
+                cursor_values = decode_keyset_cursor(cursor)
+                try:
+                    keyset_params = [datetime.fromisoformat(cursor_values[0]), int(cursor_values[1])]
+                except (TypeError, ValueError, IndexError, KeyError):
+                    return jsonify({'error': 'Invalid cursor'}), 400
+        
         conn = get_db_conn()
         cur = conn.cursor(cursor_factory=RealDictCursor)
         
-        # 獲取所有用戶
-        cur.execute("""
-            SELECT id, name, email, role, created_at
-            FROM users 
-            ORDER BY created_at DESC
-        """)
+        where_clause = " WHERE " + " AND ".join(conditions) if conditions else ""
+        page_conditions = conditions + (["(created_at, id) < (%s, %s)"] if keyset_params else [])
+        
+        query = "SELECT id, name, email, role, created_at FROM users"
+        if page_conditions:
+            query += " WHERE " + " AND ".join(page_conditions)
+        query += " ORDER BY created_at DESC, id DESC"
+        query_params = params + keyset_params
+        if paginated:
+            # 多取一筆用來判斷是否還有下一頁
+            query += " LIMIT %s"
+            query_params = query_params + [limit + 1]
+        
+        cur.execute(query, query_params)
         
         users = cur.fetchall()
         
+        next_cursor = None
+        if paginated and len(users) > limit:
+            users = users[:limit]
+            next_cursor = encode_keyset_cursor(users[-1]['created_at'], users[-1]['id'])
+        
         # 轉換為前端需要的格式
         user_list = []
         for user in users:
@@ -1975,16 +4424,30 @@ def get_all_users():
                 'name': user['name'],
                 'email': user['email'],
                 'role': user['role'],
-                'created_at': user['created_at'].isoformat() if user['created_at'] else None
+                'created_at': user['created_at']
             })
         
         logger.info(f"Admin {admin_email} retrieved {len(user_list)} users")
         
-        return jsonify({
+        result = {
             'users': user_list,
             'total': len(user_list),
             'admin_role': admin_role
-        }), 200
+        }
+        if paginated:
+            # 只有一頁時筆數即為總數，否則以查詢計畫估計，不需要掃描整張表
+            if not keyset_params and next_cursor is None:
+                total = len(user_list)
+            else:
+                total = estimate_row_count(cur, "SELECT id FROM users" + where_clause, params)
+            result['total'] = total
+            result['total_estimate'] = total
+            result['page_size'] = len(user_list)
+            result['limit'] = limit
+            result['next_cursor'] = next_cursor
+            result['has_more'] = next_cursor is not None
+        
+        return jsonify(result), 200
 
     except psycopg2.Error as e:
         logger.error(f"Database error: {e}")
@@ -1998,12 +4461,121 @@ def get_all_users():
         if 'conn' in locals():
             conn.close()
 
+# 管理員預約列表分頁設定
+ADMIN_BOOKINGS_DEFAULT_PAGE_SIZE = 100
+ADMIN_BOOKINGS_MAX_PAGE_SIZE = 500
+
+def encode_keyset_cursor(*values):
+    """將排序鍵值編碼為不透明的分頁游標"""
+    import base64
+    import json
+    payload = json.dumps([v.isoformat() if isinstance(v, datetime) else v for v in values])
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')
+
+def decode_keyset_cursor(cursor):
+    """解析分頁游標，格式錯誤時返回 None"""
+    import base64
+    import json
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+    except (ValueError, TypeError):
+        return None
+
+def estimate_row_count(cur, query, params):
+    """
+    以查詢計畫的估計列數取代 COUNT(*)，不需要掃描整張表
+    統計資訊由 autovacuum/ANALYZE 維護，數字為近似值
+    """
+    cur.execute("EXPLAIN (FORMAT JSON) " + query, params)
+    row = cur.fetchone()
+    plan = row['QUERY PLAN'] if isinstance(row, dict) else row[0]
+    if isinstance(plan, str):
+        import json
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+def build_admin_booking_filters(args):
+    """
+    解析管理員預約列表的篩選參數
+    支援 status, machine_id, user_email, start_time / end_time（time_slot 範圍）
+    返回：(conditions, params, error_message)
+    """
+    conditions = []
+    params = []
+    
+    status = args.get('status')
+    if status:
+        statuses = [s.strip() for s in status.split(',') if s.strip()]
+        if any(s not in ['active', 'cancelled', 'completed', 'no_show'] for s in statuses):
+            return None, None, 'Invalid status'
+        conditions.append("b.status = ANY(%s)")
+        params.append(statuses)
+    
+    machine_id = args.get('machine_id')
+    if machine_id:
+        try:
+            conditions.append("b.machine_id = %s")
+            params.append(int(machine_id))
+        except ValueError:
+            return None, None, 'Invalid machine_id'
+    
+    user_email = args.get('user_email')
+    if user_email:
+        conditions.append("b.user_email = %s")
+        params.append(unquote(user_email))
+    
+    for key, operator in [('start_time', '>='), ('end_time', '<')]:
+        if args.get(key):
+            parsed_time = parse_frontend_datetime(args.get(key))
+            if parsed_time is None:
+                return None, None, f'Invalid {key} format'
+            conditions.append(f"b.time_slot {operator} %s")
+            params.append(parsed_time.replace(tzinfo=None))
+    
+    return conditions, params, None
+
+ADMIN_BOOKING_FIELDS = [
+    'id', 'user_email', 'user_name', 'machine_id', 'machine_name', 'machine_description',
+    'start_time', 'end_time', 'status', 'created_at', 'updated_at'
+]
+
+def format_admin_booking(booking):
+    """將管理員預約查詢的一列轉換為前端格式（時段以台北時間輸出，結束時間為開始後4小時）"""
+    # 確保time_slot被視為台北時間
+    time_slot_dt = booking['time_slot']
+    if time_slot_dt.tzinfo is None:
+        time_slot_dt = TAIPEI_TZ.localize(time_slot_dt)
+    else:
+        time_slot_dt = time_slot_dt.astimezone(TAIPEI_TZ)
+    
+    # 計算結束時間（加4小時）
+    end_time_dt = time_slot_dt + timedelta(hours=4)
+    
+    return {
+        'id': str(booking['id']),
+        'user_email': booking['user_email'],
+        'user_name': booking['user_name'],
+        'machine_id': str(booking['machine_id']),
+        'machine_name': booking['machine_name'],
+        'machine_description': booking['machine_description'],
+        'start_time': time_slot_dt.isoformat(),
+        'end_time': end_time_dt.isoformat(),
+        'status': booking['status'],
+        'created_at': booking['created_at'],
+        'updated_at': booking['updated_at']
+    }
+
 @app.route('/admin/bookings', methods=['GET'])
 def get_all_bookings():
     """
     管理員獲取所有預約列表
     包含用戶姓名和機器信息
     只有manager和admin角色可以訪問
+    
+    可選篩選：status（可逗號分隔）, machine_id, user_email, start_time, end_time
+    傳入 limit 或 cursor 時使用游標分頁（依 created_at, id 由新到舊），
+    返回 next_cursor 與估計總數 total_estimate；不傳時維持返回全部資料
+    可選 fields= 只返回指定欄位；format=columnar 時 bookings 改為平行陣列
     """
     try:
         # 從header獲取管理員email
@@ -2013,11 +4585,49 @@ def get_all_bookings():
         if not is_authorized:
             return jsonify({'error': 'Access denied. Manager or admin role required.'}), 403
         
+        conditions, params, error_message = build_admin_booking_filters(request.args)
+        if error_message:
+            return jsonify({'error': error_message}), 400
+        
+        fields, columnar, error_message = parse_list_shape_params(request.args, ADMIN_BOOKING_FIELDS)
+        if error_message:
+            return jsonify({'error': error_message}), 400
+        
+        paginated = 'limit' in request.args or 'cursor' in request.args
+        limit = None
+        keyset_condition = None
+        keyset_params = []
+        if paginated:
+            try:
+                limit = int(request.args.get('limit', ADMIN_BOOKINGS_DEFAULT_PAGE_SIZE))
+            except ValueError:
+                return jsonify({'error': 'Invalid limit'}), 400
+            limit = max(1, min(limit, ADMIN_BOOKINGS_MAX_PAGE_SIZE))
+            
+            cursor = request.args.get('cursor')
+            if cursor:
+                cursor_values = decode_keyset_cursor(cursor)
+                if not cursor_values or len(cursor_values) != 2:
+                    return jsonify({'error': 'Invalid cursor'}), 400
+                try:
+                    keyset_params = [datetime.fromisoformat(cursor_values[0]), int(cursor_values[1])]
+                except (TypeError, ValueError):
+                    return jsonify({'error': 'Invalid cursor'}), 400
+                keyset_condition = "(b.created_at, b.id) < (%s, %s)"
+        
         conn = get_db_conn()
         cur = conn.cursor(cursor_factory=RealDictCursor)
         
+        from_clause = """
+            FROM bookings b
+            JOIN users u ON b.user_email = u.email
+            JOIN machines m ON b.machine_id = m.id
+        """
+        where_clause = " WHERE " + " AND ".join(conditions) if conditions else ""
+        
         # 獲取所有預約，包含用戶和機器信息
-        cur.execute("""
+        page_conditions = conditions + ([keyset_condition] if keyset_condition else [])
+        query = """
             SELECT 
                 b.id,
                 b.user_email,
@@ -2029,60 +4639,206 @@ def get_all_bookings():
                 b.status,
                 b.created_at,
                 b.updated_at
-            FROM bookings b
-            JOIN users u ON b.user_email = u.email
-            JOIN machines m ON b.machine_id = m.id
-            ORDER BY b.created_at DESC
-        """)
-        
+        """ + from_clause
+        if page_conditions:
+            query += " WHERE " + " AND ".join(page_conditions)
+        # id 作為同一 created_at 的次要排序，確保游標分頁穩定
+        query += " ORDER BY b.created_at DESC, b.id DESC"
+        query_params = params + keyset_params
+        if paginated:
+            # 多取一筆用來判斷是否還有下一頁
+            query += " LIMIT %s"
+            query_params = query_params + [limit + 1]
+        
+        cur.execute(query, query_params)
         bookings = cur.fetchall()
         
+        next_cursor = None
+        if paginated and len(bookings) > limit:
+            bookings = bookings[:limit]
+            last = bookings[-1]
+            next_cursor = encode_keyset_cursor(last['created_at'], last['id'])
+        
         # 轉換為前端需要的格式
-        booking_list = []
-        for booking in bookings:
-            # 確保time_slot被視為台北時間
-            time_slot_dt = booking['time_slot']
-            if time_slot_dt.tzinfo is None:
-                time_slot_dt = TAIPEI_TZ.localize(time_slot_dt)
-            else:
-                time_slot_dt = time_slot_dt.astimezone(TAIPEI_TZ)
-            
-            # 計算結束時間（加4小時）
-            end_time_dt = time_slot_dt + timedelta(hours=4)
-            
-            booking_list.append({
-                'id': str(booking['id']),
-                'user_email': booking['user_email'],
-                'user_name': booking['user_name'],
-                'machine_id': str(booking['machine_id']),
-                'machine_name': booking['machine_name'],
-                'machine_description': booking['machine_description'],
-                'start_time': time_slot_dt.isoformat(),
-                'end_time': end_time_dt.isoformat(),
-                'status': booking['status'],
-                'created_at': booking['created_at'].isoformat() if booking['created_at'] else None,
-                'updated_at': booking['updated_at'].isoformat() if booking['updated_at'] else None
-            })
+        booking_list = [format_admin_booking(booking) for booking in bookings]
+        
+        logger.info(f"Admin {admin_email} retrieved {len(booking_list)} bookings")
+        
+        result = {
+            'bookings': shape_records(booking_list, ADMIN_BOOKING_FIELDS, fields=fields, columnar=columnar),
+            'total': len(booking_list),
+            'admin_role': admin_role
+        }
+        if columnar:
+            result['format'] = 'columnar'
+        
+        if paginated:
+            # 第一頁才計算估計總數，翻頁時沿用前端已取得的數字
+            if not keyset_condition:
+                result['total_estimate'] = estimate_row_count(
+                    cur, "SELECT b.id " + from_clause + where_clause, params
+                )
+            result['limit'] = limit
+            result['next_cursor'] = next_cursor
+            result['has_more'] = next_cursor is not None
+        
+        return jsonify(result), 200
+
+    except psycopg2.Error as e:
+        logger.error(f"Database error: {e}")
+        return jsonify({'error': 'Database error', 'detail': str(e)}), 500
+    except Exception as e:
+        logger.error(f"Unexpected error: {e}")
+        return jsonify({'error': 'Internal server error', 'detail': str(e)}), 500
+    finally:
+        if 'cur' in locals():
+            cur.close()
+        if 'conn' in locals():
+            conn.close()
+
+# 預約匯出：伺服器端游標每次取回的筆數，記憶體用量與總筆數無關
+BOOKING_EXPORT_FETCH_SIZE = 2000
+BOOKING_EXPORT_COLUMNS = [
+    'id', 'user_email', 'user_name', 'machine_id', 'machine_name',
+    'start_time', 'end_time', 'status', 'created_at', 'updated_at'
+]
+
+def format_booking_export_row(booking):
+    """將匯出查詢的一列轉換為輸出欄位"""
+    time_slot_dt = TAIPEI_TZ.localize(booking['time_slot'])
+    return {
+        'id': booking['id'],
+        'user_email': booking['user_email'],
+        'user_name': booking['user_name'],
+        'machine_id': booking['machine_id'],
+        'machine_name': booking['machine_name'],
+        'start_time': time_slot_dt.isoformat(),
+        'end_time': (time_slot_dt + timedelta(hours=4)).isoformat(),
+        'status': booking['status'],
+        'created_at': booking['created_at'].isoformat() if booking['created_at'] else None,
+        'updated_at': booking['updated_at'].isoformat() if booking['updated_at'] else None
+    }
+
+@app.route('/admin/bookings/export', methods=['GET'])
+def export_bookings():
+    """
+    管理員匯出預約資料（串流輸出）
+    format：ndjson（預設）或 csv
+    可選篩選：start_time, end_time（time_slot 範圍）, machine_id, status, user_email
+    使用具名（伺服器端）游標分批讀取，邊讀邊輸出，不會把整張表載入記憶體
+    只有manager和admin角色可以訪問
+    """
+    # 從header獲取管理員email
+    admin_email = request.headers.get('X-Admin-Email', '')
+    is_authorized, admin_role = verify_admin_permission(admin_email)
+    
+    if not is_authorized:
+        return jsonify({'error': 'Access denied. Manager or admin role required.'}), 403
+    
+    export_format = request.args.get('format', 'ndjson')
+    if export_format not in ['ndjson', 'csv']:
+        return jsonify({'error': 'Invalid format. Must be one of: ndjson, csv'}), 400
+    
+    conditions, params, error_message = build_admin_booking_filters(request.args)
+    if error_message:
+        return jsonify({'error': error_message}), 400
+    
+    query = """
+        SELECT 
+            b.id,
+            b.user_email,
+            u.name as user_name,
+            b.machine_id,
+            m.name as machine_name,
+            b.time_slot,
+            b.status,
+            b.created_at,
+            b.updated_at
+        FROM bookings b
+        LEFT JOIN users u ON b.user_email = u.email
+        JOIN machines m ON b.machine_id = m.id
+    """
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += " ORDER BY b.time_slot, b.id"
+    
+    def generate():
+        import csv
+        import io
+        import json
         
-        logger.info(f"Admin {admin_email} retrieved {len(booking_list)} bookings")
+        conn = get_db_conn()
+        # 具名游標在資料庫端保留結果集，每次只取 itersize 筆到應用程式
+        cur = conn.cursor(name='booking_export', cursor_factory=RealDictCursor)
+        cur.itersize = BOOKING_EXPORT_FETCH_SIZE
+        exported = 0
+        if export_format == 'csv':
+            buffer = io.StringIO()
+            writer = csv.DictWriter(buffer, fieldnames=BOOKING_EXPORT_COLUMNS)
+            # 加上 BOM 讓 Excel 正確辨識 UTF-8 中文
+            buffer.write('\ufeff')
+            writer.writeheader()
         
-        return jsonify({
-            'bookings': booking_list,
-            'total': len(booking_list),
-            'admin_role': admin_role
-        }), 200
-
-    except psycopg2.Error as e:
-        logger.error(f"Database error: {e}")
-        return jsonify({'error': 'Database error', 'detail': str(e)}), 500
-    except Exception as e:
-        logger.error(f"Unexpected error: {e}")
-        return jsonify({'error': 'Internal server error', 'detail': str(e)}), 500
-    finally:
-        if 'cur' in locals():
+        try:
+            cur.execute(query, params)
+            
+            while True:
+                rows = cur.fetchmany(BOOKING_EXPORT_FETCH_SIZE)
+                if not rows:
+                    break
+                
+                if export_format == 'csv':
+                    writer.writerows(format_booking_export_row(row) for row in rows)
+                    chunk = buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate()
+                else:
+                    chunk = ''.join(
+                        json.dumps(format_booking_export_row(row), ensure_ascii=False) + '\n' for row in rows
+                    )
+                
+                exported += len(rows)
+                yield chunk
+            
+            if export_format == 'csv' and exported == 0:
+                # 沒有資料時仍輸出標題列
+                yield buffer.getvalue()
+            
+            logger.info(f"Admin {admin_email} exported {exported} bookings as {export_format}")
+        except psycopg2.Error as e:
+            # 回應已開始串流，無法再改變狀態碼：先輸出錯誤標記，再拋出例外讓伺服器中斷連線，
+            # 用戶端會收到不完整的傳輸而非看似成功的檔案
+            logger.error(f"Database error during booking export after {exported} rows: {e}")
+            message = f'匯出中斷：已輸出 {exported} 筆後發生資料庫錯誤，資料不完整'
+            if export_format == 'csv':
+                csv.writer(buffer).writerow(['ERROR', message])
+                yield buffer.getvalue()
+            else:
+                yield json.dumps({
+                    'error': 'Database error',
+                    'error_type': 'export_failed',
+                    'message': message,
+                    'exported': exported
+                }, ensure_ascii=False) + '\n'
+            raise
+        finally:
             cur.close()
-        if 'conn' in locals():
             conn.close()
+    
+    timestamp = get_taipei_now().strftime('%Y%m%d-%H%M')
+    if export_format == 'csv':
+        mimetype = 'text/csv; charset=utf-8'
+        filename = f'bookings-{timestamp}.csv'
+    else:
+        mimetype = 'application/x-ndjson'
+        filename = f'bookings-{timestamp}.ndjson'
+    
+    response = app.response_class(stream_with_context(generate()), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response.headers['Cache-Control'] = 'no-store'
+    # 避免反向代理緩衝整個回應
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
 
 @app.route('/admin/bookings/active', methods=['GET'])
 def get_active_bookings():
@@ -2091,6 +4847,7 @@ def get_active_bookings():
     只返回 'active' 狀態的預約，按時間順序排列
     包含用戶姓名和機器信息
     只有manager和admin角色可以訪問
+    可選 fields= 只返回指定欄位；format=columnar 時 bookings 改為平行陣列
     """
     try:
         # 從header獲取管理員email
@@ -2100,6 +4857,10 @@ def get_active_bookings():
         if not is_authorized:
             return jsonify({'error': 'Access denied. Manager or admin role required.'}), 403
         
+        fields, columnar, error_message = parse_list_shape_params(request.args, ADMIN_BOOKING_FIELDS)
+        if error_message:
+            return jsonify({'error': error_message}), 400
+        
         conn = get_db_conn()
         cur = conn.cursor(cursor_factory=RealDictCursor)
         
@@ -2126,39 +4887,19 @@ def get_active_bookings():
         bookings = cur.fetchall()
         
         # 轉換為前端需要的格式
-        booking_list = []
-        for booking in bookings:
-            # 確保time_slot被視為台北時間
-            time_slot_dt = booking['time_slot']
-            if time_slot_dt.tzinfo is None:
-                time_slot_dt = TAIPEI_TZ.localize(time_slot_dt)
-            else:
-                time_slot_dt = time_slot_dt.astimezone(TAIPEI_TZ)
-            
-            # 計算結束時間（加4小時）
-            end_time_dt = time_slot_dt + timedelta(hours=4)
-            
-            booking_list.append({
-                'id': str(booking['id']),
-                'user_email': booking['user_email'],
-                'user_name': booking['user_name'],
-                'machine_id': str(booking['machine_id']),
-                'machine_name': booking['machine_name'],
-                'machine_description': booking['machine_description'],
-                'start_time': time_slot_dt.isoformat(),
-                'end_time': end_time_dt.isoformat(),
-                'status': booking['status'],
-                'created_at': booking['created_at'].isoformat() if booking['created_at'] else None,
-                'updated_at': booking['updated_at'].isoformat() if booking['updated_at'] else None
-            })
+        booking_list = [format_admin_booking(booking) for booking in bookings]
         
         logger.info(f"Admin {admin_email} retrieved {len(booking_list)} active bookings")
         
-        return jsonify({
-            'bookings': booking_list,
+        result = {
+            'bookings': shape_records(booking_list, ADMIN_BOOKING_FIELDS, fields=fields, columnar=columnar),
             'total': len(booking_list),
             'admin_role': admin_role
-        }), 200
+        }
+        if columnar:
+            result['format'] = 'columnar'
+        
+        return jsonify(result), 200
 
     except psycopg2.Error as e:
         logger.error(f"Database error: {e}")
@@ -2269,6 +5010,43 @@ def get_monthly_booking_stats():
         if 'conn' in locals():
             conn.close()
 
+def fetch_admin_notifications(cur, notification_ids=None):
+    """查詢通知（含創建者信息）並轉換為前端格式；指定 notification_ids 時只查詢這些通知"""
+    query = """
+        SELECT 
+            n.id,
+            n.content,
+            n.level,
+            n.start_time,
+            n.end_time,
+            n.creator_id,
+            u.name as creator_name,
+            u.email as creator_email,
+            n.created_at,
+            n.updated_at
+        FROM notifications n
+        JOIN users u ON n.creator_id = u.id
+    """
+    params = []
+    if notification_ids is not None:
+        query += " WHERE n.id = ANY(%s)"
+        params.append(list(notification_ids))
+    query += " ORDER BY n.created_at DESC"
+    cur.execute(query, params)
+    
+    # 轉換為前端需要的格式
+    notification_list = []
+    for notification in cur.fetchall():
+        notification_list.append({
+            'id': str(notification['id']),
+            'content': notification['content'],
+            'level': notification['level'],  # 直接使用中文等級值
+            'start_time': notification['start_time'].isoformat() if notification['start_time'] else None,
+            'end_time': notification['end_time'].isoformat() if notification['end_time'] else None,
+            'created_at': notification['created_at'].isoformat() if notification['created_at'] else None
+        })
+    return notification_list
+
 @app.route('/admin/notifications', methods=['GET'])
 def get_all_notifications():
     """
@@ -2287,37 +5065,7 @@ def get_all_notifications():
         conn = get_db_conn()
         cur = conn.cursor(cursor_factory=RealDictCursor)
         
-        # 獲取所有通知，包含創建者信息
-        cur.execute("""
-            SELECT 
-                n.id,
-                n.content,
-                n.level,
-                n.start_time,
-                n.end_time,
-                n.creator_id,
-                u.name as creator_name,
-                u.email as creator_email,
-                n.created_at,
-                n.updated_at
-            FROM notifications n
-            JOIN users u ON n.creator_id = u.id
-            ORDER BY n.created_at DESC
-        """)
-        
-        notifications = cur.fetchall()
-        
-        # 轉換為前端需要的格式
-        notification_list = []
-        for notification in notifications:
-            notification_list.append({
-                'id': str(notification['id']),
-                'content': notification['content'],
-                'level': notification['level'],  # 直接使用中文等級值
-                'start_time': notification['start_time'].isoformat() if notification['start_time'] else None,
-                'end_time': notification['end_time'].isoformat() if notification['end_time'] else None,
-                'created_at': notification['created_at'].isoformat() if notification['created_at'] else None
-            })
+        notification_list = fetch_admin_notifications(cur)
         
         logger.info(f"Admin {admin_email} retrieved {len(notification_list)} notifications")
         
@@ -2646,6 +5394,46 @@ def get_active_notifications():
 
 # =========== 機器管理 API ===========
 
+def fetch_admin_machines(cur, machine_ids=None):
+    """查詢機器及其有效限制數量並轉換為前端格式；指定 machine_ids 時只查詢這些機器"""
+    query = """
+        SELECT 
+            m.id,
+            m.name,
+            m.description,
+            m.status,
+            m.restriction_status,
+            m.created_at,
+            m.updated_at,
+            COUNT(mr.id) as restriction_count
+        FROM machines m
+        LEFT JOIN machine_restrictions mr ON m.id = mr.machine_id AND mr.is_active = true
+    """
+    params = []
+    if machine_ids is not None:
+        query += " WHERE m.id = ANY(%s)"
+        params.append(list(machine_ids))
+    query += """
+        GROUP BY m.id, m.name, m.description, m.status, m.restriction_status, m.created_at, m.updated_at
+        ORDER BY m.id
+    """
+    cur.execute(query, params)
+    
+    # 轉換為前端需要的格式
+    machine_list = []
+    for machine in cur.fetchall():
+        machine_list.append({
+            'id': str(machine['id']),
+            'name': machine['name'],
+            'description': machine['description'],
+            'status': machine['status'],
+            'restriction_status': machine['restriction_status'],
+            'restriction_count': machine['restriction_count'],
+            'created_at': machine['created_at'],
+            'updated_at': machine['updated_at']
+        })
+    return machine_list
+
 @app.route('/admin/machines', methods=['GET'])
 def get_all_machines_admin():
     """
@@ -2663,38 +5451,7 @@ def get_all_machines_admin():
         conn = get_db_conn()
         cur = conn.cursor(cursor_factory=RealDictCursor)
         
-        # 獲取所有機器及其限制信息
-        cur.execute("""
-            SELECT 
-                m.id,
-                m.name,
-                m.description,
-                m.status,
-                m.restriction_status,
-                m.created_at,
-                m.updated_at,
-                COUNT(mr.id) as restriction_count
-            FROM machines m
-            LEFT JOIN machine_restrictions mr ON m.id = mr.machine_id AND mr.is_active = true
-            GROUP BY m.id, m.name, m.description, m.status, m.restriction_status, m.created_at, m.updated_at
-            ORDER BY m.id
-        """)
-        
-        machines = cur.fetchall()
-        
-        # 轉換為前端需要的格式
-        machine_list = []
-        for machine in machines:
-            machine_list.append({
-                'id': str(machine['id']),
-                'name': machine['name'],
-                'description': machine['description'],
-                'status': machine['status'],
-                'restriction_status': machine['restriction_status'],
-                'restriction_count': machine['restriction_count'],
-                'created_at': machine['created_at'].isoformat() if machine['created_at'] else None,
-                'updated_at': machine['updated_at'].isoformat() if machine['updated_at'] else None
-            })
+        machine_list = fetch_admin_machines(cur)
         
         logger.info(f"Admin {admin_email} retrieved {len(machine_list)} machines")
         
@@ -2787,6 +5544,360 @@ def update_machine(machine_id):
         if 'conn' in locals():
             conn.close()
 
+# 批量維護：一次最多處理的機器數、維護時間窗口上限與語句逾時
+MAX_MAINTENANCE_MACHINES = 200
+MAX_MAINTENANCE_WINDOW_DAYS = 90
+MAINTENANCE_STATEMENT_TIMEOUT_MS = 10000
+# 維護窗口開始與結束的狀態切換由背景執行緒每隔此秒數檢查一次；
+# 預約是否落在窗口內由各預約路徑直接讀取窗口判斷，不依賴狀態切換的時機
+MAINTENANCE_WINDOW_CHECK_INTERVAL_SECONDS = 30
+MAINTENANCE_WINDOW_WORKER_ENABLED = os.getenv('MAINTENANCE_WINDOW_WORKER_ENABLED', 'true').lower() in ['1', 'true', 'yes']
+_maintenance_window_thread = None
+_maintenance_window_lock = threading.Lock()
+
+def get_maintenance_slot_range(machine):
+    """
+    返回機器維護窗口涵蓋的時段索引範圍 [first, end)，沒有排定窗口時返回 None
+    4小時時段與窗口重疊即算：time_slot > maintenance_start - 4小時 且 time_slot < maintenance_end
+    """
+    start, end = machine.get('maintenance_start'), machine.get('maintenance_end')
+    if start is None or end is None:
+        return None
+    first_index = datetime_to_slot_index(start)
+    end_index = datetime_to_slot_index(end)
+    if slot_index_to_datetime(end_index) < end:
+        end_index += 1
+    return first_index, end_index
+
+def find_maintenance_slots(machine, naive_time_slots):
+    """返回落在機器維護窗口內、不可預約的時段"""
+    slot_range = get_maintenance_slot_range(machine)
+    if slot_range is None:
+        return []
+    return sorted(
+        slot for slot in set(naive_time_slots)
+        if slot_range[0] <= datetime_to_slot_index(slot) < slot_range[1]
+    )
+
+def build_maintenance_window_payload(machine):
+    """機器排定的維護窗口（台北時間），沒有時返回 None"""
+    if machine.get('maintenance_start') is None or machine.get('maintenance_end') is None:
+        return None
+    return {
+        'start_time': TAIPEI_TZ.localize(machine['maintenance_start']).isoformat(),
+        'end_time': TAIPEI_TZ.localize(machine['maintenance_end']).isoformat(),
+        'note': machine.get('maintenance_window_note')
+    }
+
+def build_maintenance_conflict_response(machine, maintenance_slots):
+    """預約時段落在維護窗口內的錯誤回應"""
+    slots_formatted = [slot.strftime("%Y/%m/%d %H:%M") for slot in maintenance_slots]
+    window = f"{machine['maintenance_start'].strftime('%Y/%m/%d %H:%M')} - {machine['maintenance_end'].strftime('%Y/%m/%d %H:%M')}"
+    return jsonify({
+        'success': False,
+        'error': '機器維護中',
+        'error_type': 'machine_maintenance',
+        'message': f'機器「{machine["name"]}」於 {window} 維護，以下時段無法預約：{"、".join(slots_formatted)}',
+        'maintenance_slots': slots_formatted,
+        'maintenance_window': build_maintenance_window_payload(machine),
+        'machine_name': machine['name']
+    }), 409
+
+def apply_machine_maintenance_windows():
+    """
+    依排定的維護窗口切換機器狀態
+    - 窗口開始：記下原狀態並改為維護狀態
+    - 窗口結束：還原原狀態並清除窗口與窗口備註；期間被管理員手動改過狀態的機器保留手動設定
+    由背景執行緒定期呼叫，使用獨立連線
+    """
+    now = get_taipei_now().replace(tzinfo=None)
+    conn = get_db_conn()
+    try:
+        cur = conn.cursor()
+        cur.execute("""
+            UPDATE machines
+            SET status = CASE WHEN status = maintenance_status
+                              THEN COALESCE(status_before_maintenance, status) ELSE status END,
+                status_before_maintenance = NULL,
+                maintenance_status = NULL,
+                maintenance_start = NULL,
+                maintenance_end = NULL,
+                maintenance_window_note = NULL,
+                updated_at = %(now)s
+            WHERE maintenance_end IS NOT NULL AND maintenance_end <= %(now)s
+        """, {'now': now})
+        cur.execute("""
+            UPDATE machines
+            SET status_before_maintenance = status,
+                status = maintenance_status,
+                updated_at = %(now)s
+            WHERE maintenance_end IS NOT NULL
+            AND maintenance_start <= %(now)s AND maintenance_end > %(now)s
+            AND status_before_maintenance IS NULL
+        """, {'now': now})
+        conn.commit()
+    finally:
+        conn.close()
+
+def run_maintenance_window_worker():
+    """維護窗口執行緒主迴圈：定期切換狀態，錯誤只記錄不中斷"""
+    while True:
+        try:
+            apply_machine_maintenance_windows()
+        except Exception as e:
+            logger.error(f"Failed to apply machine maintenance windows: {e}")
+        time.sleep(MAINTENANCE_WINDOW_CHECK_INTERVAL_SECONDS)
+
+def start_maintenance_window_worker():
+    """啟動本程序的維護窗口執行緒（只啟動一次）"""
+    global _maintenance_window_thread
+    if not MAINTENANCE_WINDOW_WORKER_ENABLED or _maintenance_window_thread is not None:
+        return
+    with _maintenance_window_lock:
+        if _maintenance_window_thread is None:
+            _maintenance_window_thread = threading.Thread(
+                target=run_maintenance_window_worker, name='maintenance-window-worker', daemon=True
+            )
+            _maintenance_window_thread.start()
+
+@app.before_request
+def ensure_maintenance_window_worker():
+    # 與變更監聽相同，只在實際處理請求的程序中啟動；請求本身不做任何資料庫寫入
+    start_maintenance_window_worker()
+
+@app.route('/admin/machines/maintenance', methods=['POST'])
+def schedule_machines_maintenance():
+    """
+    批量設定機器維護
+    傳送 machine_ids, start_time, end_time, action（cancel 或 flag）, status（預設 maintenance）, notes
+    - 記錄每台機器的維護窗口：窗口已開始時立即切換狀態，未來的窗口在開始時才切換，結束後自動還原原狀態
+    - 每台機器只保留一個排定的窗口，新的窗口取代尚未結束的舊窗口
+    - 以單一語句取消（或標記）與維護時間重疊的 active 預約，並刪除被取消預約的使用記錄
+    - 返回受影響的用戶，供後續通知；status_applied 表示狀態是否已經切換
+    需要manager或admin權限
+    """
+    try:
+        # 從header獲取管理員email
+        admin_email = request.headers.get('X-Admin-Email', '')
+        is_authorized, admin_role = verify_admin_permission(admin_email)
+        
+        if not is_authorized:
+            return jsonify({'error': 'Access denied. Manager or admin role required.'}), 403
+        
+        data = request.get_json() or {}
+        machine_ids = data.get('machine_ids')
+        action = data.get('action', 'cancel')
+        status = data.get('status', 'maintenance')
+        notes = data.get('notes') or ''
+        
+        if not isinstance(machine_ids, list) or not machine_ids:
+            return jsonify({'error': 'Missing machine_ids'}), 400
+        if len(machine_ids) > MAX_MAINTENANCE_MACHINES:
+            return jsonify({'error': f'Too many machines, at most {MAX_MAINTENANCE_MACHINES} per request'}), 400
+        try:
+            machine_ids = sorted({int(machine_id) for machine_id in machine_ids})
+        except (TypeError, ValueError):
+            return jsonify({'error': 'machine_ids must be integers'}), 400
+        
+        if action not in ['cancel', 'flag']:
+            return jsonify({'error': 'Invalid action. Must be one of: cancel, flag'}), 400
+        
+        if status not in ['active', 'maintenance', 'limited']:
+            return jsonify({'error': 'Invalid status. Must be one of: active, maintenance, limited'}), 400
+        
+        start_time = parse_frontend_datetime(data.get('start_time')) if data.get('start_time') else None
+        end_time = parse_frontend_datetime(data.get('end_time')) if data.get('end_time') else None
+        if start_time is None or end_time is None:
+            return jsonify({'error': 'Missing or invalid start_time / end_time'}), 400
+        
+        start_time = start_time.replace(tzinfo=None)
+        end_time = end_time.replace(tzinfo=None)
+        
+        if end_time <= start_time:
+            return jsonify({'error': 'end_time must be after start_time'}), 400
+        if end_time - start_time > timedelta(days=MAX_MAINTENANCE_WINDOW_DAYS):
+            return jsonify({'error': f'Maintenance window cannot exceed {MAX_MAINTENANCE_WINDOW_DAYS} days'}), 400
+        
+        now = get_taipei_now().replace(tzinfo=None)
+        if end_time <= now:
+            return jsonify({'error': 'Maintenance window has already ended'}), 400
+        status_applied = start_time <= now
+        
+        window_text = f"{start_time.strftime('%Y/%m/%d %H:%M')} - {end_time.strftime('%Y/%m/%d %H:%M')}"
+        maintenance_note = f"維護時間：{window_text}" + (f"，{notes}" if notes else '')
+        
+        conn = get_db_conn()
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        
+        # 整個操作限制在固定時間內完成，超時則整筆回滾
+        cur.execute(f"SET LOCAL statement_timeout = {MAINTENANCE_STATEMENT_TIMEOUT_MS}")
+        
+        # 窗口已開始：記下原狀態後立即切換；未來的窗口：先還原進行中的舊窗口，等開始時再切換
+        cur.execute("""
+            UPDATE machines
+            SET status = CASE WHEN %(applied)s THEN %(status)s
+                              ELSE COALESCE(status_before_maintenance, status) END,
+                status_before_maintenance = CASE WHEN %(applied)s
+                                                 THEN COALESCE(status_before_maintenance, status) END,
+                maintenance_status = %(status)s,
+                maintenance_start = %(start_time)s,
+                maintenance_end = %(end_time)s,
+                maintenance_window_note = %(note)s,
+                updated_at = %(now)s
+            WHERE id = ANY(%(machine_ids)s)
+            RETURNING id, name, status
+        """, {
+            'applied': status_applied,
+            'status': status,
+            'start_time': start_time,
+            'end_time': end_time,
+            'note': maintenance_note,
+            'now': now,
+            'machine_ids': machine_ids
+        })
+        updated_rows = cur.fetchall()
+        updated_machines = {row['id']: row['name'] for row in updated_rows}
+        current_statuses = {row['id']: row['status'] for row in updated_rows}
+        
+        missing_machine_ids = [machine_id for machine_id in machine_ids if machine_id not in updated_machines]
+        if missing_machine_ids:
+            conn.rollback()
+            return jsonify({
+                'error': 'Machine not found',
+                'missing_machine_ids': [str(machine_id) for machine_id in missing_machine_ids]
+            }), 404
+        
+        # 4小時時段與維護窗口重疊：time_slot > start_time - 4小時 且 time_slot < end_time
+        # 條件落在 (machine_id, time_slot) WHERE status = 'active' 的部分唯一索引上，只掃描窗口內的資料
+        overlap_params = {
+            'machine_ids': machine_ids,
+            'window_start': start_time - timedelta(hours=SLOT_HOURS),
+            'window_end': end_time,
+            'now': now,
+            'reason': f"機器維護（{window_text}）" + (f"：{notes}" if notes else ''),
+            'flag': f"[維護] {window_text}"
+        }
+        
+        if action == 'cancel':
+            cur.execute("""
+                WITH affected AS (
+                    UPDATE bookings
+                    SET status = 'cancelled', cancellation_reason = %(reason)s, updated_at = %(now)s
+                    WHERE machine_id = ANY(%(machine_ids)s)
+                    AND status = 'active'
+                    AND time_slot > %(window_start)s
+                    AND time_slot < %(window_end)s
+                    RETURNING id, user_email, machine_id, time_slot
+                ),
+                deleted_usage AS (
+                    DELETE FROM user_machine_usage u
+                    USING affected a
+                    WHERE u.booking_id = a.id
+                    RETURNING u.id
+                )
+                SELECT 
+                    a.id, a.user_email, a.machine_id, a.time_slot, u.name as user_name,
+                    (SELECT COUNT(*) FROM deleted_usage) as deleted_usage_records
+                FROM affected a
+                LEFT JOIN users u ON u.email = a.user_email
+                ORDER BY a.user_email, a.time_slot
+            """, overlap_params)
+        else:
+            cur.execute("""
+                WITH affected AS (
+                    UPDATE bookings
+                    SET notes = CONCAT_WS(' | ', NULLIF(notes, ''), %(flag)s::text), updated_at = %(now)s
+                    WHERE machine_id = ANY(%(machine_ids)s)
+                    AND status = 'active'
+                    AND time_slot > %(window_start)s
+                    AND time_slot < %(window_end)s
+                    AND (notes IS NULL OR POSITION(%(flag)s::text IN notes) = 0)
+                    RETURNING id, user_email, machine_id, time_slot
+                )
+                SELECT 
+                    a.id, a.user_email, a.machine_id, a.time_slot, u.name as user_name,
+                    0 as deleted_usage_records
+                FROM affected a
+                LEFT JOIN users u ON u.email = a.user_email
+                ORDER BY a.user_email, a.time_slot
+            """, overlap_params)
+        
+        affected_bookings = cur.fetchall()
+        conn.commit()
+        
+        # 維護窗口改變了可預約的時段
+        for machine_id in machine_ids:
+            invalidate_availability_cache(machine_id)
+        
+        if action == 'cancel':
+            publish_booking_changes([
+                {'user_email': email, 'machine_id': machine_id}
+                for email, machine_id in {(row['user_email'], row['machine_id']) for row in affected_bookings}
+            ])
+        
+        # 依用戶彙整受影響的預約
+        affected_users = []
+        users_by_email = {}
+        for row in affected_bookings:
+            user = users_by_email.get(row['user_email'])
+            if user is None:
+                user = {
+                    'user_email': row['user_email'],
+                    'user_name': row['user_name'],
+                    'bookings': []
+                }
+                users_by_email[row['user_email']] = user
+                affected_users.append(user)
+            user['bookings'].append({
+                'booking_id': str(row['id']),
+                'machine_id': str(row['machine_id']),
+                'machine_name': updated_machines.get(row['machine_id']),
+                'time_slot': to_taipei_time(row['time_slot']).strftime("%Y/%m/%d %H:%M")
+            })
+        
+        logger.info(f"Admin {admin_email} scheduled {len(machine_ids)} machines as {status} for {window_text} (applied now: {status_applied}), {action} {len(affected_bookings)} bookings")
+        
+        return jsonify({
+            'success': True,
+            'action': action,
+            'status': status,
+            'status_applied': status_applied,
+            'machines': [
+                {
+                    'id': str(machine_id),
+                    'name': updated_machines[machine_id],
+                    'current_status': current_statuses[machine_id]
+                }
+                for machine_id in machine_ids
+            ],
+            'window': {
+                'start_time': TAIPEI_TZ.localize(start_time).isoformat(),
+                'end_time': TAIPEI_TZ.localize(end_time).isoformat()
+            },
+            'affected_bookings': len(affected_bookings),
+            'deleted_usage_records': affected_bookings[0]['deleted_usage_records'] if affected_bookings else 0,
+            'affected_users': affected_users
+        }), 200
+
+    except psycopg2.errors.QueryCanceled as e:
+        logger.error(f"Maintenance operation timed out: {e}")
+        if 'conn' in locals():
+            conn.rollback()
+        return jsonify({'error': 'Maintenance operation timed out', 'detail': str(e)}), 503
+    except psycopg2.Error as e:
+        logger.error(f"Database error: {e}")
+        if 'conn' in locals():
+            conn.rollback()
+        return jsonify({'error': 'Database error', 'detail': str(e)}), 500
+    except Exception as e:
+        logger.error(f"Unexpected error: {e}")
+        return jsonify({'error': 'Internal server error', 'detail': str(e)}), 500
+    finally:
+        if 'cur' in locals():
+            cur.close()
+        if 'conn' in locals():
+            conn.close()
+
 @app.route('/admin/machines', methods=['POST'])
 def create_machine():
     """
@@ -2926,6 +6037,7 @@ def delete_machine(machine_id):
         cur.execute("DELETE FROM machines WHERE id = %s", (machine_id,))
         
         conn.commit()
+        publish_booking_changes([{'user_email': None, 'machine_id': machine_id}])
         
         logger.info(f"Admin {admin_email} deleted machine: {machine_name} (ID: {machine_id})")
         logger.info(f"  - Deleted {deleted_restrictions} restrictions")
@@ -2968,108 +6080,152 @@ def parse_email_year(email):
         pass
     return None
 
-def check_machine_restriction(user_email, machine_id):
+def evaluate_year_limit_rule(user_year, rule):
     """
-    檢查用戶是否被限制使用指定機器
+    依年份限制規則判斷用戶是否受限
+    返回：(user_is_restricted, restriction_message)
+    """
+    target_year = rule.get('target_year')
+    operator = rule.get('operator')
+    
+    if not target_year or not operator or user_year is None:
+        return False, ""
+    
+    # 執行比較運算 - 修復邏輯使其與前端一致
+    if operator == 'gt' and user_year > target_year:
+        return True, f"限制民國{target_year}年以後入學的用戶使用"
+    elif operator == 'gte' and user_year >= target_year:
+        return True, f"限制民國{target_year}年以後入學的用戶使用"
+    elif operator == 'lt' and user_year < target_year:
+        return True, f"限制民國{target_year}年以前入學的用戶使用"
+    elif operator == 'lte' and user_year <= target_year:
+        return True, f"限制民國{target_year}年以前入學的用戶使用"
+    elif operator == 'eq' and user_year == target_year:
+        return True, f"限制民國{target_year}年入學的用戶使用"
+    
+    return False, ""
+
+def fetch_machines_with_restrictions(cur, machine_id=None, bookable_only=False):
+    """
+    以單一查詢取得機器及其目前生效中的限制規則
+    每台機器的規則以 JSON 陣列聚合在 restrictions 欄位中
+    """
+    current_time = get_taipei_now().replace(tzinfo=None)
+    
+    query = """
+        SELECT 
+            m.id,
+            m.name,
+            m.description,
+            m.status,
+            m.restriction_status,
+            m.maintenance_start,
+            m.maintenance_end,
+            m.maintenance_window_note,
+            COALESCE(
+                JSON_AGG(
+                    JSON_BUILD_OBJECT(
+                        'restriction_type', mr.restriction_type,
+                        'restriction_rule', mr.restriction_rule
+                    )
+                ) FILTER (WHERE mr.id IS NOT NULL),
+                '[]'
+            ) as restrictions
+        FROM machines m
+        LEFT JOIN machine_restrictions mr ON m.id = mr.machine_id 
+            AND mr.is_active = true
+            AND (mr.start_time IS NULL OR mr.start_time <= %s)
+            AND (mr.end_time IS NULL OR mr.end_time >= %s)
+    """
+    params = [current_time, current_time]
+    conditions = []
+    
+    if machine_id is not None:
+        conditions.append("m.id = %s")
+        params.append(machine_id)
+    if bookable_only:
+        conditions.append("m.status IN ('active', 'maintenance')")
+    
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += " GROUP BY m.id ORDER BY m.id"
+    
+    cur.execute(query, params)
+    return cur.fetchall()
+
+def evaluate_machine_restrictions(user_email, restriction_status, restrictions):
+    """
+    在記憶體中依機器的限制狀態與生效規則判斷用戶是否可使用
     返回：(is_allowed, restriction_reason)
     """
-    try:
-        conn = get_db_conn()
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-        
-        # 獲取機器的restriction_status
-        cur.execute("SELECT restriction_status FROM machines WHERE id = %s", (machine_id,))
-        machine = cur.fetchone()
-        
-        if not machine:
-            return False, "機器不存在"
-        
-        # 如果機器沒有限制，直接允許
-        if machine['restriction_status'] == 'none':
-            return True, None
-        
-        # 如果機器完全封鎖，直接拒絕
-        if machine['restriction_status'] == 'blocked':
-            return False, "此機器目前暫停使用"
-        
-        # 如果機器有限制，檢查限制規則
-        if machine['restriction_status'] == 'limited':
-            current_time = get_taipei_now().replace(tzinfo=None)
-            
-            # 獲取生效中的限制規則
-            cur.execute("""
-                SELECT restriction_type, restriction_rule, start_time, end_time
-                FROM machine_restrictions 
-                WHERE machine_id = %s AND is_active = true
-                AND (start_time IS NULL OR start_time <= %s)
-                AND (end_time IS NULL OR end_time >= %s)
-            """, (machine_id, current_time, current_time))
+    # 如果機器沒有限制，直接允許
+    if restriction_status == 'none':
+        return True, None
+    
+    # 如果機器完全封鎖，直接拒絕
+    if restriction_status == 'blocked':
+        return False, "此機器目前暫停使用"
+    
+    # 如果機器有限制，檢查限制規則
+    if restriction_status == 'limited':
+        for restriction in restrictions:
+            restriction_type = restriction['restriction_type']
+            restriction_rule_str = restriction['restriction_rule']
             
-            restrictions = cur.fetchall()
+            try:
+                import json
+                rule = json.loads(restriction_rule_str)
+            except:
+                continue
             
-            for restriction in restrictions:
-                restriction_type = restriction['restriction_type']
-                restriction_rule_str = restriction['restriction_rule']
-                
-                try:
-                    import json
-                    rule = json.loads(restriction_rule_str)
-                except:
+            # 檢查年份限制
+            if restriction_type == 'year_limit':
+                user_year = parse_email_year(user_email)
+                if user_year is None:
                     continue
                 
-                # 檢查年份限制
-                if restriction_type == 'year_limit':
-                    user_year = parse_email_year(user_email)
-                    if user_year is None:
-                        continue
-                    
-                    target_year = rule.get('target_year')
-                    operator = rule.get('operator')
-                    
-                    if target_year and operator:
-                        # 執行比較運算 - 修復邏輯使其與前端一致
-                        user_is_restricted = False
-                        restriction_message = ""
-                        
-                        if operator == 'gt' and user_year > target_year:
-                            user_is_restricted = True
-                            restriction_message = f"限制民國{target_year}年以後入學的用戶使用"
-                        elif operator == 'gte' and user_year >= target_year:
-                            user_is_restricted = True
-                            restriction_message = f"限制民國{target_year}年以後入學的用戶使用"
-                        elif operator == 'lt' and user_year < target_year:
-                            user_is_restricted = True
-                            restriction_message = f"限制民國{target_year}年以前入學的用戶使用"
-                        elif operator == 'lte' and user_year <= target_year:
-                            user_is_restricted = True
-                            restriction_message = f"限制民國{target_year}年以前入學的用戶使用"
-                        elif operator == 'eq' and user_year == target_year:
-                            user_is_restricted = True
-                            restriction_message = f"限制民國{target_year}年入學的用戶使用"
-                        
-                        # 如果用戶受到限制，返回拒絕
-                        if user_is_restricted:
-                            # 優先使用description，如果沒有則使用默認消息
-                            description = rule.get('description', restriction_message)
-                            return False, description
-                
-                # 檢查email格式限制
-                elif restriction_type == 'email_pattern':
-                    import re
-                    pattern = rule.get('pattern', '')
-                    if pattern:
-                        # 將通配符轉換為正則表達式
-                        regex_pattern = pattern.replace('*', '.*')
-                        if not re.match(regex_pattern, user_email):
-                            return False, f"限制Email格式: {pattern}"
+                user_is_restricted, restriction_message = evaluate_year_limit_rule(user_year, rule)
                 
-                # 檢查使用次數限制
-                elif restriction_type == 'usage_limit':
-                    # 使用次數限制不阻止查看機器列表，只在預約時檢查
-                    # 這裡返回允許，讓用戶可以進入機器頁面查看狀態
-                    continue
+                # 如果用戶受到限制，返回拒絕
+                if user_is_restricted:
+                    # 優先使用description，如果沒有則使用默認消息
+                    description = rule.get('description', restriction_message)
+                    return False, description
+            
+            # 檢查email格式限制
+            elif restriction_type == 'email_pattern':
+                import re
+                pattern = rule.get('pattern', '')
+                if pattern:
+                    # 將通配符轉換為正則表達式
+                    regex_pattern = pattern.replace('*', '.*')
+                    if not re.match(regex_pattern, user_email):
+                        return False, f"限制Email格式: {pattern}"
+            
+            # 檢查使用次數限制
+            elif restriction_type == 'usage_limit':
+                # 使用次數限制不阻止查看機器列表，只在預約時檢查
+                # 這裡返回允許，讓用戶可以進入機器頁面查看狀態
+                continue
+    
+    return True, None
+
+def check_machine_restriction(user_email, machine_id):
+    """
+    檢查用戶是否被限制使用指定機器
+    返回：(is_allowed, restriction_reason)
+    """
+    try:
+        conn = get_db_conn()
+        cur = conn.cursor(cursor_factory=RealDictCursor)
         
-        return True, None
+        machines = fetch_machines_with_restrictions(cur, machine_id=machine_id)
+        
+        if not machines:
+            return False, "機器不存在"
+        
+        machine = machines[0]
+        return evaluate_machine_restrictions(user_email, machine['restriction_status'], machine['restrictions'])
         
     except Exception as e:
         logger.error(f"Error checking machine restriction: {e}")
@@ -3091,19 +6247,11 @@ def check_usage_limit(user_email, machine_id, max_usages, cooldown_period_slots,
     - 冷卻期過後重新開始計算連續次數
     """
     try:
-        current_time = get_taipei_now().replace(tzinfo=None)
-        
-        # 獲取用戶在該機器的所有使用記錄，按時間排序
-        cur.execute("""
-            SELECT usage_time, is_cooldown_usage
-            FROM user_machine_usage
-            WHERE user_email = %s AND machine_id = %s
-            ORDER BY usage_time ASC
-        """, (user_email, machine_id))
-        
-        usage_records = cur.fetchall()
+        summary = get_consecutive_run_summary(
+            user_email, machine_id, 'usage', max_usages, cooldown_period_slots, cur
+        )
         
-        if not usage_records:
+        if not summary['runs']:
             # 沒有使用記錄，可以使用
             return {
                 'allowed': True,
@@ -3115,215 +6263,32 @@ def check_usage_limit(user_email, machine_id, max_usages, cooldown_period_slots,
                 }
             }
         
-        def datetime_to_slot(dt):
-            """將 datetime 轉換為時間段字符串"""
-            return f"{dt.strftime('%Y-%m-%d')}-{dt.hour:02d}:00"
-        
-        def slot_to_datetime(slot_str):
-            """將時間段字符串轉換為 datetime"""
-            parts = slot_str.split('-')
-            if len(parts) >= 4:
-                # 格式: YYYY-MM-DD-HH:00
-                year, month, day = parts[0], parts[1], parts[2]
-                hour = int(parts[3].split(':')[0])
-            else:
-                # 舊格式處理
-                date_part, time_part = slot_str.split('-', 1)
-                year, month, day = date_part.split('-')
-                hour = int(time_part.split(':')[0])
-            return datetime(int(year), int(month), int(day), hour, 0, 0)
-        
-        def get_next_slot(slot_str):
-            """獲取下一個時間段"""
-            dt = slot_to_datetime(slot_str)
-            next_dt = dt + timedelta(hours=4)
-            return datetime_to_slot(next_dt)
-        
-        def get_previous_slot(slot_str):
-            """獲取前一個時間段"""
-            dt = slot_to_datetime(slot_str)
-            prev_dt = dt - timedelta(hours=4)
-            return datetime_to_slot(prev_dt)
-        
-        # 將使用記錄轉換為時間段列表
-        usage_slots = [datetime_to_slot(record['usage_time']) for record in usage_records]
-        usage_slots = sorted(set(usage_slots))  # 去重並排序
-        
-        if not usage_slots:
+        current_index = get_current_slot_index()
+        cooldown = find_cooldown_interval(summary['cooldown_intervals'], current_index)
+        
+        if cooldown:
+            # 在冷卻期內
+            run_start, run_end, cooldown_start, cooldown_end = cooldown
             return {
-                'allowed': True,
-                'reason': None,
+                'allowed': False,
+                'reason': f'已達到連續使用上限({max_usages}次)，目前處於冷卻期',
                 'usage_info': {
-                    'consecutive_usage_count': 0,
-                    'in_cooldown': False,
-                    'cooldown_remaining_slots': 0
+                    'consecutive_usage_count': run_end - run_start + 1,
+                    'in_cooldown': True,
+                    'cooldown_remaining_slots': cooldown_end - current_index + 1,
+                    'cooldown_slots': [slot_index_to_str(i) for i in range(cooldown_start, cooldown_end + 1)],
+                    'current_slot': slot_index_to_str(current_index)
                 }
             }
         
-        # 找到所有的連續使用群組，並識別它們的冷卻期
-        consecutive_groups = []
-        current_group = []
-        
-        for i, slot in enumerate(usage_slots):
-            if not current_group:
-                current_group = [slot]
-            else:
-                # 檢查是否與前一個時間段連續
-                prev_slot = get_previous_slot(slot)
-                if prev_slot == current_group[-1]:
-                    current_group.append(slot)
-                else:
-                    # 不連續，保存當前群組並開始新的群組
-                    if len(current_group) > 0:
-                        consecutive_groups.append(current_group)
-                    current_group = [slot]
-        
-        # 添加最後一個群組
-        if current_group:
-            consecutive_groups.append(current_group)
-        
-        logger.info(f"Found consecutive groups: {consecutive_groups}")
-        
-        # 檢查每個群組是否觸發冷卻期，並計算冷卻期範圍
-        def calculate_cooldown_slots(group_end_slot):
-            """計算群組結束後的冷卻期時間段"""
-            cooldown_start_slot = get_next_slot(group_end_slot)
-            cooldown_slots = []
-            
-            current_cooldown_slot = cooldown_start_slot
-            for i in range(cooldown_period_slots):
-                cooldown_slots.append(current_cooldown_slot)
-                current_cooldown_slot = get_next_slot(current_cooldown_slot)
-            
-            return cooldown_slots
-        
-        # 找到當前時間對應的時間段
-        current_dt = current_time
-        # 調整到下一個有效時間段
-        if current_dt.hour not in [0, 4, 8, 12, 16, 20]:
-            # 找到下一個有效小時
-            valid_hours = [0, 4, 8, 12, 16, 20]
-            next_valid_hour = None
-            for hour in valid_hours:
-                if hour > current_dt.hour:
-                    next_valid_hour = hour
-                    break
-            
-            if next_valid_hour is None:
-                # 今天沒有更晚的時段，移到明天的第一個時段
-                current_dt = current_dt.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
-            else:
-                current_dt = current_dt.replace(hour=next_valid_hour, minute=0, second=0, microsecond=0)
-        else:
-            current_dt = current_dt.replace(minute=0, second=0, microsecond=0)
-        
-        current_slot = datetime_to_slot(current_dt)
-        
-        # 檢查當前時間是否在任何冷卻期內
-        for group in consecutive_groups:
-            if len(group) >= max_usages:
-                group_end_slot = group[-1]
-                cooldown_slots = calculate_cooldown_slots(group_end_slot)
-                
-                if current_slot in cooldown_slots:
-                    # 在冷卻期內
-                    try:
-                        cooldown_index = cooldown_slots.index(current_slot)
-                        remaining_slots = len(cooldown_slots) - cooldown_index
-                    except ValueError:
-                        remaining_slots = 0
-                    
-                    return {
-                        'allowed': False,
-                        'reason': f'已達到連續使用上限({max_usages}次)，目前處於冷卻期',
-                        'usage_info': {
-                            'consecutive_usage_count': len(group),
-                            'in_cooldown': True,
-                            'cooldown_remaining_slots': remaining_slots,
-                            'cooldown_slots': cooldown_slots,
-                            'current_slot': current_slot
-                        }
-                    }
-        
-        # 不在冷卻期內，計算當前的連續使用次數
-        # 找到最新的、不會被冷卻期打斷的連續序列
-        
-        # 從最新時間段開始往前計算連續次數
-        latest_slot = usage_slots[-1]
-        consecutive_count = 0
-        check_slot = latest_slot
-        
-        # 往前查找連續序列，但要排除已經完成冷卻的舊序列
-        for slot in reversed(usage_slots):
-            if slot == check_slot:
-                consecutive_count += 1
-                check_slot = get_previous_slot(check_slot)
-            else:
-                break
-        
-        # 檢查這個連續序列是否已經觸發過冷卻期並完成
-        if consecutive_count >= max_usages:
-            # 計算這個序列的冷卻期
-            cooldown_slots = calculate_cooldown_slots(latest_slot)
-            cooldown_end_slot = cooldown_slots[-1] if cooldown_slots else latest_slot
-            
-            # 如果當前時間已經超過冷卻期，說明可以重新開始計算
-            if current_slot > cooldown_end_slot:
-                # 冷卻期已結束，重新開始計算
-                # 查找冷卻期結束後的新使用記錄
-                post_cooldown_slots = []
-                cooldown_end_dt = slot_to_datetime(cooldown_end_slot)
-                
-                for slot in usage_slots:
-                    slot_dt = slot_to_datetime(slot)
-                    if slot_dt > cooldown_end_dt:
-                        post_cooldown_slots.append(slot)
-                
-                if post_cooldown_slots:
-                    # 計算冷卻期後的連續使用次數
-                    new_consecutive_count = 0
-                    check_slot = post_cooldown_slots[-1]
-                    
-                    for slot in reversed(post_cooldown_slots):
-                        if slot == check_slot:
-                            new_consecutive_count += 1
-                            check_slot = get_previous_slot(check_slot)
-                        else:
-                            break
-                    
-                    consecutive_count = new_consecutive_count
-                    latest_slot = post_cooldown_slots[-1]  # 更新 latest_slot
-                else:
-                    consecutive_count = 0
+        # 不在冷卻期內，最新連續序列的長度即為目前的連續使用次數
+        consecutive_count = summary['current_streak']
+        if consecutive_count >= max_usages and current_index > summary['runs'][-1][1] + cooldown_period_slots:
+            # 冷卻期已結束，重新開始計算
+            consecutive_count = 0
         
         logger.info(f"User {user_email} consecutive usage count: {consecutive_count}")
         
-        # 檢查是否達到新的使用上限
-        if consecutive_count >= max_usages:
-            # 計算當前序列的冷卻期
-            current_sequence_end = latest_slot
-            cooldown_slots = calculate_cooldown_slots(current_sequence_end)
-            
-            if current_slot in cooldown_slots:
-                # 在新的冷卻期內
-                try:
-                    cooldown_index = cooldown_slots.index(current_slot)
-                    remaining_slots = len(cooldown_slots) - cooldown_index
-                except ValueError:
-                    remaining_slots = 0
-                
-                return {
-                    'allowed': False,
-                    'reason': f'已達到連續使用上限({max_usages}次)，目前處於冷卻期',
-                    'usage_info': {
-                        'consecutive_usage_count': consecutive_count,
-                        'in_cooldown': True,
-                        'cooldown_remaining_slots': remaining_slots,
-                        'cooldown_slots': cooldown_slots,
-                        'current_slot': current_slot
-                    }
-                }
-        
         # 未達到上限或已過冷卻期，可以使用
         return {
             'allowed': True,
@@ -3428,6 +6393,44 @@ def determine_if_cooldown_usage(user_email, machine_id, cur):
         logger.error(f"Error determining cooldown usage: {e}")
         return False
 
+def build_machine_access_payload(user_email, machine_id, machine):
+    """
+    依已查好的機器資料（含生效中的限制規則）判斷用戶是否可以訪問機器
+    返回：(payload, status_code)
+    """
+    if not machine:
+        return {
+            'allowed': False,
+            'reason': '機器不存在'
+        }, 404
+    
+    # 檢查機器狀態 - 維護中的機器也應該可以正常使用
+    if machine['status'] not in ['active', 'maintenance']:
+        status_messages = {
+            'limited': '限制使用',
+            'inactive': '已停用'
+        }
+        status_msg = status_messages.get(machine['status'], machine['status'])
+        return {
+            'allowed': False,
+            'reason': f'機器目前{status_msg}'
+        }, 200
+    
+    # 檢查限制規則
+    is_allowed, restriction_reason = evaluate_machine_restrictions(
+        user_email, machine['restriction_status'], machine['restrictions']
+    )
+    
+    logger.info(f"Access check for user {user_email} on machine {machine_id}: {'allowed' if is_allowed else 'denied'}")
+    
+    # 維護窗口只限制窗口內的時段，機器本身仍可訪問
+    return {
+        'allowed': is_allowed,
+        'reason': restriction_reason,
+        'machine_name': machine['name'],
+        'maintenance_window': build_maintenance_window_payload(machine)
+    }, 200
+
 @app.route('/machines/<int:machine_id>/check-access', methods=['GET'])
 def check_machine_access(machine_id):
     """
@@ -3443,38 +6446,13 @@ def check_machine_access(machine_id):
         conn = get_db_conn()
         cur = conn.cursor(cursor_factory=RealDictCursor)
         
-        # 檢查機器是否存在
-        cur.execute("SELECT id, name, status FROM machines WHERE id = %s", (machine_id,))
-        machine = cur.fetchone()
-        
-        if not machine:
-            return jsonify({
-                'allowed': False,
-                'reason': '機器不存在'
-            }), 404
-        
-        # 檢查機器狀態 - 維護中的機器也應該可以正常使用
-        if machine['status'] not in ['active', 'maintenance']:
-            status_messages = {
-                'limited': '限制使用',
-                'inactive': '已停用'
-            }
-            status_msg = status_messages.get(machine['status'], machine['status'])
-            return jsonify({
-                'allowed': False,
-                'reason': f'機器目前{status_msg}'
-            }), 200
-        
-        # 檢查限制規則
-        is_allowed, restriction_reason = check_machine_restriction(user_email, machine_id)
-        
-        logger.info(f"Access check for user {user_email} on machine {machine_id}: {'allowed' if is_allowed else 'denied'}")
+        # 機器資料與限制規則一次取回
+        machines = fetch_machines_with_restrictions(cur, machine_id=machine_id)
         
-        return jsonify({
-            'allowed': is_allowed,
-            'reason': restriction_reason,
-            'machine_name': machine['name']
-        }), 200
+        payload, status_code = build_machine_access_payload(
+            user_email, machine_id, machines[0] if machines else None
+        )
+        return jsonify(payload), status_code
 
     except psycopg2.Error as e:
         logger.error(f"Database error: {e}")
@@ -3488,6 +6466,65 @@ def check_machine_access(machine_id):
         if 'conn' in locals():
             conn.close()
 
+def build_usage_status_payload(user_email, machine_id, machine, cur, rolling_window_status=None):
+    """
+    產生用戶對指定機器的使用狀態（滾動窗口限制）
+    rolling_window_status 可由呼叫端預先計算傳入，避免重複查詢
+    返回：(payload, status_code)
+    """
+    if not machine:
+        return {'error': 'Machine not found'}, 404
+    
+    # 如果機器沒有限制，直接返回無限制狀態
+    if machine['restriction_status'] == 'none':
+        return {
+            'has_usage_limit': False,
+            'machine_name': machine['name'],
+            'rolling_window': {
+                'has_limit': False
+            }
+        }, 200
+    
+    # 如果機器被完全阻止，返回阻止狀態
+    if machine['restriction_status'] == 'blocked':
+        return {
+            'has_usage_limit': False,
+            'machine_name': machine['name'],
+            'blocked': True,
+            'blocked_reason': '此機器目前被管理員完全封鎖',
+            'rolling_window': {
+                'has_limit': False
+            }
+        }, 200
+    
+    # 獲取滾動窗口使用狀態
+    if rolling_window_status is None:
+        rolling_window_status = get_user_rolling_window_status(user_email, machine_id, cur)
+    
+    if not rolling_window_status['has_limit']:
+        # 沒有使用限制，返回正常狀態
+        return {
+            'has_usage_limit': False,
+            'machine_name': machine['name'],
+            'rolling_window': {
+                'has_limit': False
+            }
+        }, 200
+    
+    result = {
+        'has_usage_limit': True,
+        'machine_name': machine['name'],
+        'rolling_window': rolling_window_status,
+        # 為向後兼容保留的字段
+        'max_usages': rolling_window_status['max_bookings'],
+        'can_book': rolling_window_status['remaining_bookings'] > 0,
+        'restriction_reason': f"滾動窗口限制：{rolling_window_status['window_size']}個時段內最多{rolling_window_status['max_bookings']}次" if rolling_window_status['remaining_bookings'] <= 0 else None
+    }
+    
+    logger.info(f"Rolling window status check for user {user_email} on machine {machine_id}: {result}")
+    
+    return result, 200
+
 @app.route('/machines/<int:machine_id>/usage-status', methods=['GET'])
 def get_machine_usage_status(machine_id):
     """
@@ -3507,57 +6544,80 @@ def get_machine_usage_status(machine_id):
         cur.execute("SELECT id, name, status, restriction_status FROM machines WHERE id = %s", (machine_id,))
         machine = cur.fetchone()
         
-        if not machine:
-            return jsonify({'error': 'Machine not found'}), 404
+        payload, status_code = build_usage_status_payload(user_email, machine_id, machine, cur)
+        return jsonify(payload), status_code
+
+    except psycopg2.Error as e:
+        logger.error(f"Database error: {e}")
+        return jsonify({'error': 'Database error', 'detail': str(e)}), 500
+    except Exception as e:
+        logger.error(f"Unexpected error: {e}")
+        return jsonify({'error': 'Internal server error', 'detail': str(e)}), 500
+    finally:
+        if 'cur' in locals():
+            cur.close()
+        if 'conn' in locals():
+            conn.close()
+
+@app.route('/machines/<int:machine_id>/bootstrap', methods=['GET'])
+def get_machine_bootstrap(machine_id):
+    """
+    機器頁面啟動資料
+    一次返回預約時段、限制規則、使用狀態、訪問權限與機器列表
+    所有資料使用同一個連線，機器資料與滾動窗口狀態只查詢一次
+    """
+    try:
+        user_email = request.headers.get('X-User-Email', '')
         
-        # 如果機器沒有限制，直接返回無限制狀態
-        if machine['restriction_status'] == 'none':
-            return jsonify({
-                'has_usage_limit': False,
-                'machine_name': machine['name'],
-                'rolling_window': {
-                    'has_limit': False
-                }
-            }), 200
+        if not user_email:
+            return jsonify({'error': 'User email required'}), 400
         
-        # 如果機器被完全阻止，返回阻止狀態
-        if machine['restriction_status'] == 'blocked':
-            return jsonify({
-                'has_usage_limit': False,
-                'machine_name': machine['name'],
-                'blocked': True,
-                'blocked_reason': '此機器目前被管理員完全封鎖',
-                'rolling_window': {
-                    'has_limit': False
-                }
-            }), 200
+        start_date = request.args.get('start_date')
+        end_date = request.args.get('end_date')
         
-        # 獲取滾動窗口使用狀態
-        rolling_window_status = get_user_rolling_window_status(user_email, machine_id, cur)
+        conn = get_db_conn()
+        cur = conn.cursor(cursor_factory=RealDictCursor)
         
-        if not rolling_window_status['has_limit']:
-            # 沒有使用限制，返回正常狀態
-            return jsonify({
-                'has_usage_limit': False,
-                'machine_name': machine['name'],
-                'rolling_window': {
-                    'has_limit': False
-                }
-            }), 200
+        # 所有機器與生效中的限制規則一次取回，供權限判斷與機器列表共用
+        machines = fetch_machines_with_restrictions(cur)
+        machine = next((m for m in machines if m['id'] == machine_id), None)
         
-        result = {
-            'has_usage_limit': True,
-            'machine_name': machine['name'],
-            'rolling_window': rolling_window_status,
-            # 為向後兼容保留的字段
-            'max_usages': rolling_window_status['max_bookings'],
-            'can_book': rolling_window_status['remaining_bookings'] > 0,
-            'restriction_reason': f"滾動窗口限制：{rolling_window_status['window_size']}個時段內最多{rolling_window_status['max_bookings']}次" if rolling_window_status['remaining_bookings'] <= 0 else None
-        }
+        access, access_status = build_machine_access_payload(user_email, machine_id, machine)
+        if access_status != 200:
+            return jsonify({'access': access}), access_status
         
-        logger.info(f"Rolling window status check for user {user_email} on machine {machine_id}: {result}")
+        # 滾動窗口狀態只計算一次，預約資料與使用狀態共用
+        rolling_window_status = None
+        if machine['restriction_status'] == 'limited':
+            rolling_window_status = get_user_rolling_window_status(
+                user_email, machine_id, cur, restrictions=machine['restrictions']
+            )
         
-        return jsonify(result), 200
+        bookings = build_machine_bookings_payload(
+            machine_id, user_email, cur, start_date=start_date, end_date=end_date,
+            machine=machine, rolling_window_status=rolling_window_status
+        )
+        usage_status, _ = build_usage_status_payload(
+            user_email, machine_id, machine, cur, rolling_window_status=rolling_window_status
+        )
+        restrictions = build_machine_restrictions_payload(machine_id, cur)
+        
+        bookable_machines = [m for m in machines if m['status'] in ('active', 'maintenance')]
+        
+        return jsonify({
+            'machine': {
+                'id': str(machine['id']),
+                'name': machine['name'],
+                'description': machine['description'],
+                'status': machine['status'],
+                'restriction_status': machine['restriction_status']
+            },
+            'access': access,
+            'bookings': bookings,
+            'restrictions': restrictions,
+            'usageStatus': usage_status,
+            'machines': build_user_machine_list(user_email, bookable_machines)
+        }), 200
 
     except psycopg2.Error as e:
         logger.error(f"Database error: {e}")
@@ -3630,17 +6690,11 @@ def analyze_user_consecutive_bookings(user_email, machine_id, cur):
         # 計算冷卻期時間段數
         cooldown_period_slots = max(1, cooldown_period_hours // 4)
         
-        # 獲取用戶在該機器的所有 active 預約記錄
-        cur.execute("""
-            SELECT time_slot
-            FROM bookings
-            WHERE user_email = %s AND machine_id = %s AND status = 'active'
-            ORDER BY time_slot ASC
-        """, (user_email, machine_id))
-        
-        bookings = cur.fetchall()
+        summary = get_consecutive_run_summary(
+            user_email, machine_id, 'bookings', max_usages, cooldown_period_slots, cur
+        )
         
-        if not bookings:
+        if not summary['runs']:
             return {
                 'has_usage_limit': True,
                 'max_usages': max_usages,
@@ -3652,50 +6706,19 @@ def analyze_user_consecutive_bookings(user_email, machine_id, cur):
                 }
             }
         
-        # 轉換為時間段字符串列表
-        booking_slots = []
-        for booking in bookings:
-            time_slot_dt = booking['time_slot']
-            if time_slot_dt.tzinfo is None:
-                time_slot_dt = TAIPEI_TZ.localize(time_slot_dt)
-            else:
-                time_slot_dt = time_slot_dt.astimezone(TAIPEI_TZ)
-            
-            # 格式化為 "YYYY-MM-DD-HH:MM"
-            slot_str = time_slot_dt.strftime('%Y-%m-%d-%H:%M')
-            booking_slots.append(slot_str)
-        
-        # 分析連續預約群組
-        consecutive_groups = find_consecutive_booking_groups(booking_slots)
-        
-        logger.info(f"User {user_email} booking slots: {booking_slots}")
-        logger.info(f"Consecutive groups: {consecutive_groups}")
-        
-        # 檢查每個群組是否觸發冷卻期
-        all_cooldown_slots = []
-        current_consecutive_count = 0
-        in_cooldown = False
-        
-        for group in consecutive_groups:
-            if len(group) >= max_usages:
-                # 這個群組觸發冷卻期
-                group_end_slot = group[-1]
-                cooldown_slots = calculate_cooldown_slots_from_booking(
-                    group_end_slot, cooldown_period_slots
-                )
-                all_cooldown_slots.extend(cooldown_slots)
-                
-                # 檢查當前時間是否在這個冷卻期內
-                current_slot = get_current_time_slot()
-                if current_slot in cooldown_slots:
-                    in_cooldown = True
-            
-            # 計算當前連續次數（最新的群組）
-            if group == consecutive_groups[-1]:  # 最新的群組
-                current_consecutive_count = len(group)
+        consecutive_groups = [
+            [slot_index_to_str(i) for i in range(run_start, run_end + 1)]
+            for run_start, run_end in summary['runs']
+        ]
+        logger.info(f"Consecutive groups for user {user_email}: {consecutive_groups}")
         
-        # 去重冷卻期時間段
-        unique_cooldown_slots = sorted(list(set(all_cooldown_slots)))
+        # 冷卻期區間已合併且不重疊，直接展開即為去重後的結果
+        unique_cooldown_slots = [
+            slot_index_to_str(i)
+            for _, _, cooldown_start, cooldown_end in summary['cooldown_intervals']
+            for i in range(cooldown_start, cooldown_end + 1)
+        ]
+        in_cooldown = find_cooldown_interval(summary['cooldown_intervals'], get_current_slot_index()) is not None
         
         return {
             'has_usage_limit': True,
@@ -3704,7 +6727,7 @@ def analyze_user_consecutive_bookings(user_email, machine_id, cur):
             'cooldown_period_hours': cooldown_period_hours,  # 添加這個字段
             'cooldown_slots': unique_cooldown_slots,
             'usage_info': {
-                'consecutive_usage_count': current_consecutive_count,
+                'consecutive_usage_count': summary['current_streak'],
                 'in_cooldown': in_cooldown,
                 'consecutive_groups': consecutive_groups
             }
@@ -3722,111 +6745,400 @@ def analyze_user_consecutive_bookings(user_email, machine_id, cur):
             }
         }
 
-def find_consecutive_booking_groups(booking_slots):
+def find_consecutive_booking_groups(booking_slots):
+    """
+    找到連續的預約群組
+    例如：['2025-05-30-04:00', '2025-05-30-08:00', '2025-05-30-12:00', '2025-05-31-00:00']
+    會被識別為一個連續群組
+    """
+    slot_indices = sorted(set(
+        datetime_to_slot_index(datetime.strptime(slot, '%Y-%m-%d-%H:%M')) for slot in booking_slots
+    ))
+    return [
+        [slot_index_to_str(i) for i in range(run_start, run_end + 1)]
+        for run_start, run_end in build_consecutive_runs(slot_indices)
+    ]
+
+def calculate_cooldown_slots_from_booking(end_slot, cooldown_period_slots):
+    """
+    從預約結束時間段計算冷卻期時間段列表
+    """
+    try:
+        end_index = datetime_to_slot_index(datetime.strptime(end_slot, '%Y-%m-%d-%H:%M'))
+        
+        # 冷卻期從下一個時間段開始
+        return [slot_index_to_str(end_index + i) for i in range(1, cooldown_period_slots + 1)]
+        
+    except Exception as e:
+        logger.error(f"Error calculating cooldown slots: {e}")
+        return []
+
+def get_current_time_slot():
+    """
+    獲取當前時間對應的時間段
+    調整到下一個有效時間段（0,4,8,12,16,20）
+    """
+    try:
+        return slot_index_to_str(get_current_slot_index())
+        
+    except Exception as e:
+        logger.error(f"Error getting current time slot: {e}")
+        return ""
+
+# =========== 連續使用分析引擎 ===========
+# 時段以整數索引表示（自 SLOT_EPOCH 起第幾個 4 小時區塊），
+# 連續判斷與冷卻期查詢都只做整數運算，不再反覆解析字串
+
+SLOT_HOURS = 4
+SLOT_EPOCH = datetime(2000, 1, 1)
+CONSECUTIVE_RUN_CACHE_MAX_ENTRIES = 10000
+
+# (user_email, machine_id, source) -> 已排序的連續區段 [(start_index, end_index), ...]
+_consecutive_run_cache = {}
+_consecutive_run_cache_lock = threading.Lock()
+
+def datetime_to_slot_index(dt):
+    """將台北時間的 datetime 轉換為時段索引（向下取整）"""
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(TAIPEI_TZ).replace(tzinfo=None)
+    return int((dt - SLOT_EPOCH).total_seconds() // (SLOT_HOURS * 3600))
+
+def slot_index_to_datetime(slot_index):
+    """將時段索引轉換為無時區的台北時間 datetime"""
+    return SLOT_EPOCH + timedelta(hours=slot_index * SLOT_HOURS)
+
+def slot_index_to_str(slot_index):
+    """將時段索引格式化為 "YYYY-MM-DD-HH:MM" """
+    return slot_index_to_datetime(slot_index).strftime('%Y-%m-%d-%H:%M')
+
+def get_current_slot_index():
+    """當前時間對應的時段索引，非整點區塊時調整到下一個有效時段"""
+    current_dt = get_taipei_now().replace(tzinfo=None)
+    slot_index = datetime_to_slot_index(current_dt)
+    if current_dt.hour % SLOT_HOURS != 0:
+        slot_index += 1
+    return slot_index
+
+def build_consecutive_runs(slot_indices):
+    """
+    單次線性掃描已排序且去重的時段索引，返回連續區段列表
+    例如 [10, 11, 12, 20] -> [(10, 12), (20, 20)]
+    """
+    runs = []
+    for slot_index in slot_indices:
+        if runs and slot_index == runs[-1][1] + 1:
+            runs[-1][1] = slot_index
+        else:
+            runs.append([slot_index, slot_index])
+    return [tuple(run) for run in runs]
+
+def compute_cooldown_intervals(runs, max_usages, cooldown_period_slots):
+    """
+    計算觸發冷卻期的區段及其冷卻區間
+    返回按起點排序且互不重疊的 (run_start, run_end, cooldown_start, cooldown_end) 列表
+    """
+    intervals = []
+    for run_start, run_end in runs:
+        if run_end - run_start + 1 < max_usages or cooldown_period_slots <= 0:
+            continue
+        cooldown_start = run_end + 1
+        cooldown_end = run_end + cooldown_period_slots
+        if intervals and cooldown_start <= intervals[-1][3]:
+            # 與前一個冷卻期重疊時截斷，保持區間互不重疊以便二分查找
+            cooldown_start = intervals[-1][3] + 1
+            if cooldown_start > cooldown_end:
+                continue
+        intervals.append((run_start, run_end, cooldown_start, cooldown_end))
+    return intervals
+
+def find_cooldown_interval(cooldown_intervals, slot_index):
+    """以二分查找判斷時段是否落在任何冷卻區間內，返回該區間或 None"""
+    position = bisect.bisect_right([interval[2] for interval in cooldown_intervals], slot_index) - 1
+    if position >= 0 and cooldown_intervals[position][3] >= slot_index:
+        return cooldown_intervals[position]
+    return None
+
+def get_consecutive_run_summary(user_email, machine_id, source, max_usages, cooldown_period_slots, cur):
+    """
+    取得用戶在指定機器的連續使用摘要
+    source: 'usage' 讀取 user_machine_usage，'bookings' 讀取 active 預約
+    連續區段依 (用戶, 機器, 來源) 快取，直到下一次預約寫入時失效
+    
+    返回：{runs, cooldown_intervals, current_streak}
+    """
+    cache_key = (user_email, str(machine_id), source)
+    
+    with _consecutive_run_cache_lock:
+        runs = _consecutive_run_cache.get(cache_key)
+    
+    if runs is None:
+        if source == 'usage':
+            cur.execute("""
+                SELECT usage_time AS slot_time
+                FROM user_machine_usage
+                WHERE user_email = %s AND machine_id = %s
+                ORDER BY usage_time ASC
+            """, (user_email, machine_id))
+        else:
+            cur.execute("""
+                SELECT time_slot AS slot_time
+                FROM bookings
+                WHERE user_email = %s AND machine_id = %s AND status = 'active'
+                ORDER BY time_slot ASC
+            """, (user_email, machine_id))
+        
+        slot_indices = []
+        for record in cur.fetchall():
+            slot_index = datetime_to_slot_index(record['slot_time'])
+            # 查詢結果已排序，只需與前一個比較即可去重
+            if not slot_indices or slot_indices[-1] != slot_index:
+                slot_indices.append(slot_index)
+        
+        runs = build_consecutive_runs(slot_indices)
+        
+        with _consecutive_run_cache_lock:
+            if len(_consecutive_run_cache) >= CONSECUTIVE_RUN_CACHE_MAX_ENTRIES:
+                _consecutive_run_cache.pop(next(iter(_consecutive_run_cache)))
+            _consecutive_run_cache[cache_key] = runs
+    
+    return {
+        'runs': runs,
+        'cooldown_intervals': compute_cooldown_intervals(runs, max_usages, cooldown_period_slots),
+        'current_streak': runs[-1][1] - runs[-1][0] + 1 if runs else 0
+    }
+
+def invalidate_consecutive_run_cache(user_email=None, machine_id=None):
+    """清除連續使用快取；未指定用戶時清除整台機器的所有快取"""
+    with _consecutive_run_cache_lock:
+        for key in list(_consecutive_run_cache):
+            if (user_email is None or key[0] == user_email) and (machine_id is None or key[1] == str(machine_id)):
+                del _consecutive_run_cache[key]
+
+# 預約變更通知：SSE 連線在此等待，有寫入提交時立即喚醒回資料庫讀取變更
+_booking_change_condition = threading.Condition()
+_booking_change_counter = 0
+
+def get_booking_change_counter():
+    with _booking_change_condition:
+        return _booking_change_counter
+
+def notify_booking_change_listeners():
+    """喚醒所有等待中的預約變更串流"""
+    global _booking_change_counter
+    with _booking_change_condition:
+        _booking_change_counter += 1
+        _booking_change_condition.notify_all()
+
+def wait_for_booking_change(last_counter, timeout):
+    """等待下一次預約變更通知，返回最新計數；逾時未收到通知則返回原計數"""
+    with _booking_change_condition:
+        _booking_change_condition.wait_for(lambda: _booking_change_counter != last_counter, timeout=timeout)
+        return _booking_change_counter
+
+def publish_booking_changes(changes):
+    """
+    預約寫入（新增、取消、刪除）提交後的統一通知點
+    changes: [{'user_email': ..., 'machine_id': ...}, ...]，user_email 為 None 表示整台機器
+    """
+    for change in changes:
+        invalidate_consecutive_run_cache(change.get('user_email'), change.get('machine_id'))
+        invalidate_availability_cache(change.get('machine_id'))
+    if changes:
+        notify_booking_change_listeners()
+
+# =========== 月份可用性點陣圖 ===========
+
+# (machine_id, year, month) -> {'bitmap', 'version', 'booked_count', 'loaded_at'}
+# 同一程序內由 publish_booking_changes 失效；多程序部署時靠 TTL 收斂
+AVAILABILITY_CACHE_TTL_SECONDS = 60
+AVAILABILITY_CACHE_MAX_ENTRIES = 5000
+AVAILABILITY_MAX_MACHINES = 200
+
+_availability_cache = {}
+# 每台機器的失效世代，載入期間若有寫入則不寫回快取，避免存入舊資料
+_availability_generation = {}
+_availability_cache_lock = threading.Lock()
+
+def get_month_slot_range(year, month):
+    """返回該月第一個時段的索引與時段數（每日 24 / SLOT_HOURS 個時段）"""
+    month_start = datetime(year, month, 1)
+    next_month_start = datetime(year + 1, 1, 1) if month == 12 else datetime(year, month + 1, 1)
+    first_index = datetime_to_slot_index(month_start)
+    return first_index, datetime_to_slot_index(next_month_start) - first_index
+
+def build_availability_bitmap(slot_offsets, slot_count):
+    """將已佔用時段的月內偏移量轉為點陣圖，第 i 個時段對應 byte i // 8 的第 i % 8 位（低位在前）"""
+    bitmap = bytearray((slot_count + 7) // 8)
+    for offset in slot_offsets:
+        if 0 <= offset < slot_count:
+            bitmap[offset // 8] |= 1 << (offset % 8)
+    return bytes(bitmap)
+
+def get_machine_availability_bitmaps(machine_ids, year, month, cur):
     """
-    找到連續的預約群組
-    例如：['2025-05-30-04:00', '2025-05-30-08:00', '2025-05-30-12:00', '2025-05-31-00:00']
-    會被識別為一個連續群組
+    取得多台機器某月份的佔用點陣圖，優先使用記憶體快取
+    返回 {machine_id: {'bitmap', 'version', 'booked_count'}}，未命中的機器以單次查詢載入
     """
-    if not booking_slots:
-        return []
+    now = time.monotonic()
+    result = {}
+    missing = []
+    with _availability_cache_lock:
+        for machine_id in machine_ids:
+            entry = _availability_cache.get((machine_id, year, month))
+            if entry and now - entry['loaded_at'] < AVAILABILITY_CACHE_TTL_SECONDS:
+                result[machine_id] = entry
+            else:
+                missing.append(machine_id)
+        generations = {machine_id: _availability_generation.get(machine_id, 0) for machine_id in missing}
     
-    groups = []
-    current_group = [booking_slots[0]]
+    if not missing:
+        return result
     
-    for i in range(1, len(booking_slots)):
-        current_slot = booking_slots[i]
-        prev_slot = booking_slots[i-1]
-        
-        # 檢查是否連續（下一個4小時時段）
-        if is_consecutive_time_slot(prev_slot, current_slot):
-            current_group.append(current_slot)
-        else:
-            # 不連續，保存當前群組並開始新的群組
-            if current_group:
-                groups.append(current_group)
-            current_group = [current_slot]
+    first_index, slot_count = get_month_slot_range(year, month)
+    cur.execute("""
+        SELECT machine_id, time_slot
+        FROM bookings
+        WHERE status = 'active'
+          AND machine_id = ANY(%s)
+          AND time_slot >= %s AND time_slot < %s
+    """, (missing, slot_index_to_datetime(first_index), slot_index_to_datetime(first_index + slot_count)))
+    
+    offsets_by_machine = {machine_id: [] for machine_id in missing}
+    for row in cur.fetchall():
+        offsets_by_machine[row['machine_id']].append(datetime_to_slot_index(row['time_slot']) - first_index)
+    
+    # 維護窗口內的時段同樣標記為不可預約
+    cur.execute("""
+        SELECT id, maintenance_start, maintenance_end
+        FROM machines
+        WHERE id = ANY(%s)
+          AND maintenance_end > %s AND maintenance_start < %s
+    """, (missing, slot_index_to_datetime(first_index), slot_index_to_datetime(first_index + slot_count)))
+    maintenance_offsets_by_machine = {}
+    for row in cur.fetchall():
+        maintenance_start, maintenance_end = get_maintenance_slot_range(row)
+        maintenance_offsets_by_machine[row['id']] = range(
+            max(maintenance_start, first_index) - first_index,
+            min(maintenance_end, first_index + slot_count) - first_index
+        )
     
-    # 添加最後一個群組
-    if current_group:
-        groups.append(current_group)
+    with _availability_cache_lock:
+        if len(_availability_cache) + len(missing) > AVAILABILITY_CACHE_MAX_ENTRIES:
+            _availability_cache.clear()
+        for machine_id, offsets in offsets_by_machine.items():
+            bitmap = build_availability_bitmap(
+                offsets + list(maintenance_offsets_by_machine.get(machine_id, [])), slot_count
+            )
+            entry = {
+                'bitmap': bitmap,
+                'version': hashlib.sha1(bitmap).hexdigest()[:12],
+                'booked_count': len(set(offsets)),
+                'loaded_at': now
+            }
+            if _availability_generation.get(machine_id, 0) == generations[machine_id]:
+                _availability_cache[(machine_id, year, month)] = entry
+            result[machine_id] = entry
     
-    return groups
+    return result
 
-def is_consecutive_time_slot(slot1, slot2):
-    """
-    檢查兩個時間段是否連續
-    slot1 和 slot2 格式：'YYYY-MM-DD-HH:MM'
-    """
-    try:
-        # 解析時間段
-        dt1 = datetime.strptime(slot1, '%Y-%m-%d-%H:%M')
-        dt2 = datetime.strptime(slot2, '%Y-%m-%d-%H:%M')
-        
-        # 檢查是否相差4小時
-        time_diff = dt2 - dt1
-        return time_diff == timedelta(hours=4)
-        
-    except Exception as e:
-        logger.error(f"Error checking consecutive time slots: {e}")
-        return False
+def invalidate_availability_cache(machine_id=None):
+    """清除機器的月份點陣圖快取；未指定機器時全部清除"""
+    with _availability_cache_lock:
+        if machine_id is None:
+            for key in list(_availability_generation):
+                _availability_generation[key] += 1
+            _availability_cache.clear()
+            return
+        machine_id = int(machine_id)
+        _availability_generation[machine_id] = _availability_generation.get(machine_id, 0) + 1
+        for key in list(_availability_cache):
+            if key[0] == machine_id:
+                del _availability_cache[key]
 
-def calculate_cooldown_slots_from_booking(end_slot, cooldown_period_slots):
+@app.route('/machines/availability', methods=['GET'])
+def get_machines_availability():
     """
-    從預約結束時間段計算冷卻期時間段列表
+    月份可用性點陣圖
+    每台機器返回 base64 點陣圖（第 i 位代表該月第 i 個時段已被預約或在維護窗口內）與內容版本，
+    前端用幾百 bytes 即可繪出所有機器整月的佔用格子
+    
+    參數：year, month（預設本月），machine_ids（逗號分隔，預設全部機器）
+    支援 If-None-Match，內容未變時返回 304
     """
+    import base64
     try:
-        # 解析結束時間段
-        end_dt = datetime.strptime(end_slot, '%Y-%m-%d-%H:%M')
+        now = get_taipei_now()
+        try:
+            year = int(request.args.get('year', now.year))
+            month = int(request.args.get('month', now.month))
+        except ValueError:
+            return jsonify({'error': 'year and month must be integers'}), 400
+        if not 1 <= month <= 12 or not 2000 <= year <= 2100:
+            return jsonify({'error': 'Invalid year or month'}), 400
+        
+        machine_ids = None
+        machine_ids_param = request.args.get('machine_ids')
+        if machine_ids_param:
+            try:
+                machine_ids = list(dict.fromkeys(int(v) for v in machine_ids_param.split(',') if v.strip()))
+            except ValueError:
+                return jsonify({'error': 'machine_ids must be a comma-separated list of integers'}), 400
+            if len(machine_ids) > AVAILABILITY_MAX_MACHINES:
+                return jsonify({'error': f'Too many machine_ids (max {AVAILABILITY_MAX_MACHINES})'}), 400
         
-        # 冷卻期從下一個時間段開始
-        cooldown_start = end_dt + timedelta(hours=4)
+        conn = get_db_conn()
+        cur = conn.cursor(cursor_factory=RealDictCursor)
         
-        cooldown_slots = []
-        current_dt = cooldown_start
+        if machine_ids is None:
+            cur.execute("SELECT id FROM machines ORDER BY id LIMIT %s", (AVAILABILITY_MAX_MACHINES,))
+            machine_ids = [row['id'] for row in cur.fetchall()]
         
-        for i in range(cooldown_period_slots):
-            slot_str = current_dt.strftime('%Y-%m-%d-%H:%M')
-            cooldown_slots.append(slot_str)
-            current_dt += timedelta(hours=4)
+        bitmaps = get_machine_availability_bitmaps(machine_ids, year, month, cur)
+        first_index, slot_count = get_month_slot_range(year, month)
         
-        return cooldown_slots
+        machines = []
+        for machine_id in machine_ids:
+            entry = bitmaps[machine_id]
+            machines.append({
+                'machine_id': str(machine_id),
+                'bitmap': base64.b64encode(entry['bitmap']).decode('ascii'),
+                'version': entry['version'],
+                'booked_count': entry['booked_count']
+            })
         
-    except Exception as e:
-        logger.error(f"Error calculating cooldown slots: {e}")
-        return []
-
-def get_current_time_slot():
-    """
-    獲取當前時間對應的時間段
-    調整到下一個有效時間段（0,4,8,12,16,20）
-    """
-    try:
-        current_dt = get_taipei_now()
+        combined_version = hashlib.sha1(
+            f"{year}-{month}:".encode('ascii') + ','.join(f"{m['machine_id']}:{m['version']}" for m in machines).encode('ascii')
+        ).hexdigest()[:16]
+        etag = f'"{combined_version}"'
         
-        # 調整到下一個有效時間段
-        if current_dt.hour not in [0, 4, 8, 12, 16, 20]:
-            # 找到下一個有效小時
-            valid_hours = [0, 4, 8, 12, 16, 20]
-            next_valid_hour = None
-            for hour in valid_hours:
-                if hour > current_dt.hour:
-                    next_valid_hour = hour
-                    break
-            
-            if next_valid_hour is None:
-                # 今天沒有更晚的時段，移到明天的第一個時段
-                current_dt = current_dt.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
-            else:
-                current_dt = current_dt.replace(hour=next_valid_hour, minute=0, second=0, microsecond=0)
+        if request.headers.get('If-None-Match') == etag:
+            response = app.response_class(status=304)
         else:
-            current_dt = current_dt.replace(minute=0, second=0, microsecond=0)
-        
-        return current_dt.strftime('%Y-%m-%d-%H:%M')
-        
+            response = jsonify({
+                'year': year,
+                'month': month,
+                'start': TAIPEI_TZ.localize(slot_index_to_datetime(first_index)).isoformat(),
+                'slot_hours': SLOT_HOURS,
+                'slot_count': slot_count,
+                'bit_order': 'lsb',
+                'version': combined_version,
+                'machines': machines
+            })
+        response.headers['ETag'] = etag
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+
+    except psycopg2.Error as e:
+        logger.error(f"Database error: {e}")
+        return jsonify({'error': 'Database error', 'detail': str(e)}), 500
     except Exception as e:
-        logger.error(f"Error getting current time slot: {e}")
-        return ""
+        logger.error(f"Unexpected error: {e}")
+        return jsonify({'error': 'Internal server error', 'detail': str(e)}), 500
+    finally:
+        if 'cur' in locals():
+            cur.close()
+        if 'conn' in locals():
+            conn.close()
 
 # =========== Rolling Window Usage Limit Functions ===========
 
@@ -3838,7 +7150,7 @@ def check_rolling_window_limit(user_email, machine_id, target_time_slot, cur):
     參數:
     - user_email: 用戶郵箱
     - machine_id: 機器ID
-    - target_time_slot: 目標預約時段
+    - target_time_slot: 目標預約時段（批量預約時可傳入時段列表）
     - cur: 數據庫游標
     
     返回:
@@ -3954,16 +7266,20 @@ def check_rolling_window_limit(user_email, machine_id, target_time_slot, cur):
                 'limit_info': None
             }
         
-        # 確保目標時段是有效的4小時區塊
-        if isinstance(target_time_slot, str):
-            target_time_slot = datetime.fromisoformat(target_time_slot.replace('Z', '+00:00'))
-            if target_time_slot.tzinfo:
-                target_time_slot = target_time_slot.astimezone(TAIPEI_TZ).replace(tzinfo=None)
-        elif target_time_slot.tzinfo:
-            # 如果有時區信息，轉換為台北時間並移除時區信息
-            target_time_slot = target_time_slot.astimezone(TAIPEI_TZ).replace(tzinfo=None)
-        
-        logger.info(f"Target time slot (normalized): {target_time_slot}")
+        # 確保目標時段是有效的4小時區塊（批量預約時為時段列表，一次評估合併後的集合）
+        target_time_slots = target_time_slot if isinstance(target_time_slot, (list, tuple)) else [target_time_slot]
+        normalized_target_slots = []
+        for target_slot in target_time_slots:
+            if isinstance(target_slot, str):
+                target_slot = datetime.fromisoformat(target_slot.replace('Z', '+00:00'))
+                if target_slot.tzinfo:
+                    target_slot = target_slot.astimezone(TAIPEI_TZ).replace(tzinfo=None)
+            elif target_slot.tzinfo:
+                # 如果有時區信息，轉換為台北時間並移除時區信息
+                target_slot = target_slot.astimezone(TAIPEI_TZ).replace(tzinfo=None)
+            normalized_target_slots.append(target_slot)
+        
+        logger.info(f"Target time slots (normalized): {normalized_target_slots}")
         
         # 從當前時間開始，只獲取用戶未來的預約時段（用於檢查滾動窗口）
         current_taipei_time = get_taipei_now().replace(tzinfo=None)
@@ -3991,11 +7307,11 @@ def check_rolling_window_limit(user_email, machine_id, target_time_slot, cur):
             normalized_booking_slots.append(normalized_slot)
         
         # 將目標時段加入考慮（模擬新預約）
-        all_booking_slots_with_new = normalized_booking_slots + [target_time_slot]
+        all_booking_slots_with_new = normalized_booking_slots + normalized_target_slots
         all_booking_slots_with_new.sort()
         
         logger.info(f"Rolling window check for user {user_email}, machine {machine_id}")
-        logger.info(f"Target slot: {target_time_slot}")
+        logger.info(f"Target slots: {normalized_target_slots}")
         logger.info(f"Existing future bookings: {len(normalized_booking_slots)}")
         logger.info(f"All future bookings (with new): {len(all_booking_slots_with_new)}")
         logger.info(f"Window size: {window_size}, Max bookings: {max_bookings}")
@@ -4094,25 +7410,31 @@ def check_rolling_window_limit(user_email, machine_id, target_time_slot, cur):
             'error': str(e)
         }
 
-def get_user_rolling_window_status(user_email, machine_id, cur):
+def get_user_rolling_window_status(user_email, machine_id, cur, restrictions=None):
     """
     獲取用戶在指定機器的滾動窗口使用狀態
     用於前端顯示當前限制情況
+    restrictions 為已查好的生效中規則（fetch_machines_with_restrictions），提供時不再查詢規則表
     """
     try:
         # 獲取機器的滾動窗口限制規則
         current_time = get_taipei_now().replace(tzinfo=None)
         
-        cur.execute("""
-            SELECT restriction_rule
-            FROM machine_restrictions 
-            WHERE machine_id = %s AND restriction_type = 'usage_limit' AND is_active = true
-            AND (start_time IS NULL OR start_time <= %s)
-            AND (end_time IS NULL OR end_time >= %s)
-            LIMIT 1
-        """, (machine_id, current_time, current_time))
-        
-        restriction = cur.fetchone()
+        if restrictions is not None:
+            restriction = next(
+                (r for r in restrictions if r['restriction_type'] == 'usage_limit'), None
+            )
+        else:
+            cur.execute("""
+                SELECT restriction_rule
+                FROM machine_restrictions 
+                WHERE machine_id = %s AND restriction_type = 'usage_limit' AND is_active = true
+                AND (start_time IS NULL OR start_time <= %s)
+                AND (end_time IS NULL OR end_time >= %s)
+                LIMIT 1
+            """, (machine_id, current_time, current_time))
+            
+            restriction = cur.fetchone()
         
         if not restriction:
             return {
@@ -4215,6 +7537,141 @@ def get_user_rolling_window_status(user_email, machine_id, cur):
             'error': str(e)
         }
 
+# 限制規則試算的上限：最多評估的預約筆數與單次查詢時間（毫秒）
+RESTRICTION_SIMULATION_MAX_BOOKINGS = 50000
+RESTRICTION_SIMULATION_TIMEOUT_MS = 5000
+
+def simulate_restriction_impact(machine_id, restriction_type, rule, start_time, end_time, cur):
+    """
+    試算限制規則對現有未來預約的影響（dry-run，不寫入資料庫）
+    一次查詢取回機器上所有未來的 active 預約，在記憶體中逐用戶評估
+    
+    - rolling_window_limit：按時間順序重放每位用戶的預約，
+      以雙端佇列維護窗口內已保留的預約，超出上限的預約即視為會被規則擋下
+    - year_limit：入學年份符合限制的用戶，其所有未來預約都會受影響
+    
+    只評估 [max(現在, start_time), end_time] 範圍內的預約，
+    並以 RESTRICTION_SIMULATION_MAX_BOOKINGS 與 statement_timeout 限制最壞情況的耗時
+    """
+    from collections import deque
+    
+    if restriction_type == 'usage_limit':
+        if rule.get('restriction_type') != 'rolling_window_limit':
+            return {'error': 'Only rolling_window_limit rules can be simulated for usage_limit'}
+        try:
+            window_size = int(rule.get('window_size', 30))
+            max_bookings = int(rule.get('max_bookings', 18))
+        except (TypeError, ValueError):
+            return {'error': 'Invalid window_size or max_bookings'}
+        if window_size < 1 or max_bookings < 0:
+            return {'error': 'Invalid window_size or max_bookings'}
+        rule = standardize_restriction_description(dict(rule))
+    elif restriction_type == 'year_limit':
+        if not rule.get('target_year') or not rule.get('operator'):
+            return {'error': 'year_limit rule requires target_year and operator'}
+    else:
+        return {'error': 'Invalid restriction_type. Must be one of: year_limit, usage_limit'}
+    
+    current_time = get_taipei_now().replace(tzinfo=None)
+    evaluate_from = current_time
+    if start_time and start_time.replace(tzinfo=None) > evaluate_from:
+        evaluate_from = start_time.replace(tzinfo=None)
+    evaluate_until = end_time.replace(tzinfo=None) if end_time else None
+    
+    query = """
+        SELECT b.id, b.user_email, b.time_slot, u.name as user_name
+        FROM bookings b
+        LEFT JOIN users u ON b.user_email = u.email
+        WHERE b.machine_id = %s AND b.status = 'active' AND b.time_slot >= %s
+    """
+    params = [machine_id, evaluate_from]
+    if evaluate_until:
+        query += " AND b.time_slot <= %s"
+        params.append(evaluate_until)
+    query += " ORDER BY b.user_email, b.time_slot LIMIT %s"
+    params.append(RESTRICTION_SIMULATION_MAX_BOOKINGS + 1)
+    
+    cur.execute("SET LOCAL statement_timeout = %s", (RESTRICTION_SIMULATION_TIMEOUT_MS,))
+    cur.execute(query, params)
+    bookings = cur.fetchall()
+    
+    truncated = len(bookings) > RESTRICTION_SIMULATION_MAX_BOOKINGS
+    if truncated:
+        bookings = bookings[:RESTRICTION_SIMULATION_MAX_BOOKINGS]
+    
+    affected_bookings = []
+    affected_users = {}
+    evaluated_users = set()
+    window_span = timedelta(hours=(window_size - 1) * 4) if restriction_type == 'usage_limit' else None
+    
+    current_email = None
+    kept_slots = deque()
+    user_is_restricted = False
+    
+    for booking in bookings:
+        user_email = booking['user_email']
+        
+        if user_email != current_email:
+            # 切換到下一位用戶，重置窗口狀態
+            current_email = user_email
+            kept_slots.clear()
+            evaluated_users.add(user_email)
+            if restriction_type == 'year_limit':
+                user_is_restricted, _ = evaluate_year_limit_rule(parse_email_year(user_email), rule)
+        
+        time_slot = booking['time_slot']
+        is_affected = False
+        
+        if restriction_type == 'year_limit':
+            is_affected = user_is_restricted
+        else:
+            # 移除已滑出窗口的預約
+            while kept_slots and kept_slots[0] < time_slot - window_span:
+                kept_slots.popleft()
+            
+            if len(kept_slots) >= max_bookings:
+                is_affected = True
+            else:
+                kept_slots.append(time_slot)
+        
+        if not is_affected:
+            continue
+        
+        time_slot_iso = to_taipei_time(time_slot).isoformat()
+        affected_bookings.append({
+            'id': str(booking['id']),
+            'user_email': user_email,
+            'time_slot': time_slot_iso
+        })
+        
+        if user_email not in affected_users:
+            affected_users[user_email] = {
+                'user_email': user_email,
+                'user_name': booking['user_name'],
+                'affected_bookings': 0,
+                'booking_ids': []
+            }
+        affected_users[user_email]['affected_bookings'] += 1
+        affected_users[user_email]['booking_ids'].append(str(booking['id']))
+    
+    return {
+        'dry_run': True,
+        'machine_id': str(machine_id),
+        'restriction_type': restriction_type,
+        'rule': rule,
+        'evaluation_window': {
+            'start': to_taipei_time(evaluate_from).isoformat(),
+            'end': to_taipei_time(evaluate_until).isoformat() if evaluate_until else None
+        },
+        'evaluated_bookings': len(bookings),
+        'evaluated_users': len(evaluated_users),
+        'affected_users': sorted(affected_users.values(), key=lambda u: -u['affected_bookings']),
+        'affected_bookings': affected_bookings,
+        'total_affected_users': len(affected_users),
+        'total_affected_bookings': len(affected_bookings),
+        'truncated': truncated
+    }
+
 @app.route('/machines/<int:machine_id>/restriction-check', methods=['GET'])
 def check_machine_restriction_rules(machine_id):
     """
@@ -4448,7 +7905,10 @@ def after_request(response):
         'get_all_machines_admin',
         'get_machine_restrictions_simple',
         'create_machine_restriction_simple',
-        'get_all_machine_restrictions'  # 新增：批量獲取限制端點
+        'get_all_machine_restrictions',  # 新增：批量獲取限制端點
+        'get_machine_bootstrap',  # 機器頁面啟動資料
+        'get_booking_changes',  # 預約變更差異同步
+        'search_available_slots'
     ]
     
     if request.endpoint in cache_control_endpoints:
@@ -4459,6 +7919,97 @@ def after_request(response):
     
     return response
 
+# =========== 回應壓縮 ===========
+
+# 小於此大小的回應不壓縮，壓縮後的收益抵不過 CPU 成本
+COMPRESSION_MIN_SIZE = 1024
+COMPRESSION_GZIP_LEVEL = 6
+COMPRESSION_BROTLI_QUALITY = 5
+COMPRESSIBLE_MIMETYPES = ['application/json', 'text/html', 'text/plain', 'text/csv', 'application/x-ndjson']
+# 壓縮結果快取：相同內容的熱門回應（如月曆、機器列表）不必每次重新壓縮
+COMPRESSION_CACHE_MAX_ENTRIES = 256
+COMPRESSION_CACHE_MAX_BODY_SIZE = 2 * 1024 * 1024
+
+_compression_cache = OrderedDict()
+_compression_cache_lock = threading.Lock()
+
+def negotiate_content_encoding(accept_encoding):
+    """依 Accept-Encoding（含 q 值）選擇壓縮方式，優先使用 brotli，不支援時返回 None"""
+    accepted = {}
+    for part in accept_encoding.split(','):
+        token, _, params = part.strip().partition(';')
+        token = token.strip().lower()
+        if not token:
+            continue
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[token] = quality
+    
+    def is_accepted(encoding):
+        return accepted.get(encoding, accepted.get('*', 0.0)) > 0
+    
+    if brotli is not None and is_accepted('br'):
+        return 'br'
+    if is_accepted('gzip'):
+        return 'gzip'
+    return None
+
+def compress_body(body, encoding):
+    """壓縮回應內容，相同內容重複出現時直接取用快取的壓縮結果"""
+    cacheable = len(body) <= COMPRESSION_CACHE_MAX_BODY_SIZE
+    if cacheable:
+        cache_key = (hashlib.sha1(body).digest(), encoding)
+        with _compression_cache_lock:
+            compressed = _compression_cache.get(cache_key)
+            if compressed is not None:
+                _compression_cache.move_to_end(cache_key)
+                return compressed
+    
+    if encoding == 'br':
+        compressed = brotli.compress(body, quality=COMPRESSION_BROTLI_QUALITY)
+    else:
+        compressed = gzip.compress(body, compresslevel=COMPRESSION_GZIP_LEVEL, mtime=0)
+    
+    if cacheable:
+        with _compression_cache_lock:
+            _compression_cache[cache_key] = compressed
+            while len(_compression_cache) > COMPRESSION_CACHE_MAX_ENTRIES:
+                _compression_cache.popitem(last=False)
+    return compressed
+
+@app.after_request
+def compress_response(response):
+    """依 Accept-Encoding 壓縮較大的回應，串流回應（如匯出）不處理"""
+    if (response.direct_passthrough or response.is_streamed
+            or response.status_code < 200 or response.status_code in (204, 304)
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+    
+    response.vary.add('Accept-Encoding')
+    
+    encoding = negotiate_content_encoding(request.headers.get('Accept-Encoding', ''))
+    if encoding is None:
+        return response
+    
+    body = response.get_data()
+    if len(body) < COMPRESSION_MIN_SIZE:
+        return response
+    
+    compressed = compress_body(body, encoding)
+    if len(compressed) >= len(body):
+        return response
+    
+    response.set_data(compressed)
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
 def format_user_name_for_display(full_name):
     """
     將用戶姓名格式化為隱私保護格式
@@ -4479,5 +8030,623 @@ def format_user_name_for_display(full_name):
         # 對於超過3個字的姓名，保留第一個和最後一個字
         return full_name[0] + "O" + full_name[-1]
 
+# =========== 請求頻率限制 ===========
+
+# 令牌桶：每個桶最多存 capacity 個令牌並以固定速率補充，每次請求消耗一個
+# 來源 IP 桶是實際的限制；用戶桶只是額外的細分，任一不足即返回 429
+# 限制：後端沒有用戶登入驗證，郵箱由請求自行宣稱，只確認它是已啟用的用戶才扣用戶桶。
+# 偽造不存在的郵箱無法繞過 IP 桶，但冒用他人郵箱仍會消耗該用戶的令牌
+RATE_LIMIT_ENABLED = os.getenv('RATE_LIMIT_ENABLED', 'true').lower() in ['1', 'true', 'yes']
+# 部署在反向代理之後時才信任 X-Forwarded-For，否則任何人都能偽造來源 IP
+RATE_LIMIT_TRUST_PROXY = os.getenv('RATE_LIMIT_TRUST_PROXY', 'false').lower() in ['1', 'true', 'yes']
+RATE_LIMIT_REDIS_URL = os.getenv('RATE_LIMIT_REDIS_URL', '')
+# Redis 無法連線後暫停使用的秒數，期間改用本程序計數，避免每個請求都等連線逾時
+RATE_LIMIT_REDIS_RETRY_SECONDS = 30
+RATE_LIMIT_MAX_LOCAL_BUCKETS = 20000
+# 用戶郵箱是否為已啟用用戶的快取秒數與上限，用戶角色或啟用狀態變更時由變更通知清除
+RATE_LIMIT_USER_CACHE_TTL_SECONDS = 300
+RATE_LIMIT_USER_CACHE_MAX_ENTRIES = 20000
+
+def parse_rate_limit(env_name, default):
+    """
+    讀取「次數/秒數」格式的頻率設定，例如 '10/60' 代表每 60 秒 10 次（可一次用完）
+    返回：(capacity, 每秒補充的令牌數)
+    """
+    value = os.getenv(env_name, default)
+    try:
+        capacity, period = value.split('/')
+        capacity, period = int(capacity), float(period)
+        if capacity > 0 and period > 0:
+            return capacity, capacity / period
+    except ValueError:
+        pass
+    logger.warning(f"Invalid rate limit {env_name}={value}, falling back to {default}")
+    capacity, period = default.split('/')
+    return int(capacity), int(capacity) / float(period)
+
+# 端點分組與各組的用戶、IP 限制；校園網路常共用出口 IP，IP 限制需明顯寬於用戶限制
+RATE_LIMIT_GROUPS = {
+    'booking_write': {
+        'endpoints': [
+            'create_booking',
+            'create_batch_booking',
+            'create_slot_hold',
+            'cancel_booking',
+            'bulk_cancel_user_bookings'
+        ],
+        'user': parse_rate_limit('RATE_LIMIT_BOOKING_WRITE_USER', '20/60'),
+        'ip': parse_rate_limit('RATE_LIMIT_BOOKING_WRITE_IP', '300/60')
+    },
+    'booking_poll': {
+        'endpoints': [
+            'get_machine_bookings',
+            'get_machine_bootstrap',
+            'get_booking_changes',
+            'stream_booking_changes',
+            'get_calendar_view_bookings',
+            'get_machines_availability',
+            'search_available_slots',
+            'check_machine_access',
+            'get_machine_usage_status'
+        ],
+        'user': parse_rate_limit('RATE_LIMIT_BOOKING_POLL_USER', '120/60'),
+        'ip': parse_rate_limit('RATE_LIMIT_BOOKING_POLL_IP', '1800/60')
+    }
+}
+
+_rate_limit_endpoint_groups = {
+    endpoint: group for group, config in RATE_LIMIT_GROUPS.items() for endpoint in config['endpoints']
+}
+
+# key -> (tokens, 上次更新的 monotonic 時間)，超過上限時淘汰最久未使用的桶（等同重新裝滿）
+_rate_limit_buckets = OrderedDict()
+_rate_limit_lock = threading.Lock()
+
+# 共用後端：以 Lua 腳本在 Redis 內一次完成所有桶的檢查與扣除
+RATE_LIMIT_REDIS_SCRIPT = """
+local now = tonumber(ARGV[1])
+local tokens = {}
+local retry_after = 0
+for i = 1, #KEYS do
+    local capacity = tonumber(ARGV[i * 2])
+    local rate = tonumber(ARGV[i * 2 + 1])
+    local bucket = redis.call('HMGET', KEYS[i], 'tokens', 'ts')
+    local current = tonumber(bucket[1]) or capacity
+    local updated = tonumber(bucket[2]) or now
+    current = math.min(capacity, current + math.max(0, now - updated) * rate)
+    tokens[i] = current
+    if current < 1 then
+        retry_after = math.max(retry_after, (1 - current) / rate)
+    end
+end
+if retry_after > 0 then
+    return {0, tostring(retry_after)}
+end
+for i = 1, #KEYS do
+    local capacity = tonumber(ARGV[i * 2])
+    local rate = tonumber(ARGV[i * 2 + 1])
+    redis.call('HSET', KEYS[i], 'tokens', tostring(tokens[i] - 1), 'ts', tostring(now))
+    redis.call('EXPIRE', KEYS[i], math.ceil(capacity / rate) + 1)
+end
+return {1, '0'}
+"""
+_rate_limit_redis_script = None
+_rate_limit_redis_retry_at = 0.0
+
+# email -> (是否為已啟用用戶, 到期的 monotonic 時間)
+_rate_limit_user_cache = OrderedDict()
+_rate_limit_user_cache_lock = threading.Lock()
+
+def get_rate_limit_redis_script():
+    """建立共用後端的腳本物件；未設定、未安裝 redis 或暫停使用中時返回 None"""
+    global _rate_limit_redis_script
+    if not RATE_LIMIT_REDIS_URL or redis is None or time.monotonic() < _rate_limit_redis_retry_at:
+        return None
+    if _rate_limit_redis_script is None:
+        client = redis.Redis.from_url(RATE_LIMIT_REDIS_URL, socket_timeout=0.2, socket_connect_timeout=0.2)
+        _rate_limit_redis_script = client.register_script(RATE_LIMIT_REDIS_SCRIPT)
+    return _rate_limit_redis_script
+
+def take_local_rate_limit_tokens(buckets):
+    """
+    在本程序內扣除令牌，buckets: [(key, capacity, rate), ...]
+    全部桶都有令牌才一起扣除；返回：(allowed, retry_after_seconds)
+    """
+    now = time.monotonic()
+    with _rate_limit_lock:
+        states = []
+        retry_after = 0.0
+        for key, capacity, rate in buckets:
+            tokens, updated = _rate_limit_buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            states.append(tokens)
+            if tokens < 1:
+                retry_after = max(retry_after, (1 - tokens) / rate)
+        
+        if retry_after > 0:
+            return False, retry_after
+        
+        for (key, capacity, rate), tokens in zip(buckets, states):
+            _rate_limit_buckets[key] = (tokens - 1, now)
+            _rate_limit_buckets.move_to_end(key)
+        while len(_rate_limit_buckets) > RATE_LIMIT_MAX_LOCAL_BUCKETS:
+            _rate_limit_buckets.popitem(last=False)
+        return True, 0.0
+
+def take_rate_limit_tokens(buckets):
+    """優先使用共用後端，Redis 無法連線時退回本程序計數"""
+    global _rate_limit_redis_retry_at
+    script = get_rate_limit_redis_script()
+    if script is not None:
+        args = [time.time()]
+        for key, capacity, rate in buckets:
+            args.extend([capacity, rate])
+        try:
+            allowed, retry_after = script(keys=[key for key, _, _ in buckets], args=args)
+            return bool(int(allowed)), float(retry_after)
+        except redis.RedisError as e:
+            logger.warning(f"Rate limit backend unavailable, using local buckets for {RATE_LIMIT_REDIS_RETRY_SECONDS}s: {e}")
+            _rate_limit_redis_retry_at = time.monotonic() + RATE_LIMIT_REDIS_RETRY_SECONDS
+    return take_local_rate_limit_tokens(buckets)
+
+def get_client_ip():
+    """取得來源 IP；只有信任反向代理時才採用 X-Forwarded-For 的第一個位址"""
+    if RATE_LIMIT_TRUST_PROXY:
+        forwarded_for = request.headers.get('X-Forwarded-For', '')
+        if forwarded_for:
+            return forwarded_for.split(',')[0].strip()
+    return request.remote_addr or 'unknown'
+
+def get_rate_limit_user():
+    """取得計數用的用戶郵箱：優先 X-User-Email，SSE 與寫入端點分別退回查詢參數與請求內容"""
+    user_email = request.headers.get('X-User-Email') or request.args.get('user_email')
+    if not user_email and request.is_json:
+        data = request.get_json(silent=True)
+        if isinstance(data, dict):
+            user_email = data.get('user_email')
+    return str(user_email or '').strip().lower()
+
+def is_rate_limit_user_active(user_email):
+    """確認郵箱屬於已啟用的用戶；結果短暫快取，查詢失敗時視為未確認"""
+    now = time.monotonic()
+    with _rate_limit_user_cache_lock:
+        entry = _rate_limit_user_cache.get(user_email)
+        if entry is not None and entry[1] > now:
+            return entry[0]
+    
+    try:
+        conn = get_db_conn()
+        try:
+            cur = conn.cursor()
+            cur.execute(
+                "SELECT 1 FROM users WHERE lower(email) = %s AND is_active = true LIMIT 1",
+                (user_email,)
+            )
+            is_active = cur.fetchone() is not None
+        finally:
+            conn.close()
+    except psycopg2.Error as e:
+        logger.error(f"Failed to verify rate limit user {user_email}: {e}")
+        return False
+    
+    with _rate_limit_user_cache_lock:
+        _rate_limit_user_cache[user_email] = (is_active, now + RATE_LIMIT_USER_CACHE_TTL_SECONDS)
+        _rate_limit_user_cache.move_to_end(user_email)
+        while len(_rate_limit_user_cache) > RATE_LIMIT_USER_CACHE_MAX_ENTRIES:
+            _rate_limit_user_cache.popitem(last=False)
+    return is_active
+
+def invalidate_rate_limit_user_cache(email=None):
+    """清除用戶郵箱的驗證快取，email 為 None 時全部清除"""
+    with _rate_limit_user_cache_lock:
+        if email is None:
+            _rate_limit_user_cache.clear()
+        else:
+            _rate_limit_user_cache.pop(str(email).strip().lower(), None)
+
+@app.before_request
+def enforce_rate_limit():
+    """依端點分組檢查用戶與來源 IP 的請求頻率，超過時返回 429 與 Retry-After"""
+    if not RATE_LIMIT_ENABLED or request.method == 'OPTIONS':
+        return None
+    
+    group = _rate_limit_endpoint_groups.get(request.endpoint)
+    if group is None:
+        return None
+    
+    config = RATE_LIMIT_GROUPS[group]
+    user_email = get_rate_limit_user()
+    # 先扣 IP 桶，超過限制的來源不會再觸發用戶查詢
+    allowed, retry_after = take_rate_limit_tokens([(f"ratelimit:{group}:ip:{get_client_ip()}",) + config['ip']])
+    if allowed and user_email and is_rate_limit_user_active(user_email):
+        allowed, retry_after = take_rate_limit_tokens([(f"ratelimit:{group}:user:{user_email}",) + config['user']])
+    if allowed:
+        return None
+    
+    retry_after_seconds = max(1, math.ceil(retry_after))
+    logger.warning(f"Rate limited {request.endpoint} for {user_email or '-'} from {get_client_ip()}, retry after {retry_after_seconds}s")
+    response = jsonify({
+        'success': False,
+        'error': '請求過於頻繁',
+        'error_type': 'rate_limited',
+        'message': f'請求過於頻繁，請於 {retry_after_seconds} 秒後再試',
+        'retry_after': retry_after_seconds
+    })
+    response.status_code = 429
+    response.headers['Retry-After'] = str(retry_after_seconds)
+    return response
+
+# =========== 資料變更通知（LISTEN/NOTIFY） ===========
+
+# 資料表觸發器以 pg_notify 發出 {table, op, ids, machine_ids, emails}，
+# 每個程序一條監聽執行緒，轉發給程序內的訂閱者（快取失效、SSE 串流等）
+CHANGE_NOTIFY_CHANNEL = 'booking_system_changes'
+CHANGE_LISTENER_ENABLED = os.getenv('CHANGE_LISTENER_ENABLED', 'true').lower() in ['1', 'true', 'yes']
+CHANGE_LISTENER_POLL_SECONDS = 5
+CHANGE_LISTENER_RECONNECT_SECONDS = 5
+
+# table -> [callback(payload)]
+_change_subscribers = {}
+_change_subscribers_lock = threading.Lock()
+_change_listener_thread = None
+_change_listener_lock = threading.Lock()
+
+def subscribe_table_changes(table, callback):
+    """
+    訂閱資料表變更，callback(payload) 在監聽執行緒中執行，應盡快返回
+    payload 帶 'truncated' 或 'reset' 時代表無法得知具體資料列，訂閱者應全部失效
+    """
+    with _change_subscribers_lock:
+        _change_subscribers.setdefault(table, []).append(callback)
+
+def dispatch_table_change(payload):
+    """將一則變更通知轉發給該資料表的所有訂閱者"""
+    with _change_subscribers_lock:
+        callbacks = list(_change_subscribers.get(payload.get('table'), []))
+    for callback in callbacks:
+        try:
+            callback(payload)
+        except Exception as e:
+            logger.error(f"Change subscriber for {payload.get('table')} failed: {e}")
+
+def dispatch_change_reset():
+    """監聽連線中斷期間可能漏掉通知，重新連上後通知所有訂閱者全部失效"""
+    with _change_subscribers_lock:
+        tables = list(_change_subscribers)
+    for table in tables:
+        dispatch_table_change({'table': table, 'op': 'RESET', 'reset': True})
+
+def run_change_listener():
+    """監聽執行緒主迴圈：LISTEN 通知頻道並轉發，斷線後自動重連"""
+    import json
+    import select
+    first_connect = True
+    while True:
+        conn = None
+        try:
+            conn = get_db_conn()
+            conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            cur = conn.cursor()
+            cur.execute(f"LISTEN {CHANGE_NOTIFY_CHANNEL}")
+            logger.info(f"Change listener connected to channel {CHANGE_NOTIFY_CHANNEL}")
+            if not first_connect:
+                dispatch_change_reset()
+            first_connect = False
+            
+            while True:
+                if select.select([conn], [], [], CHANGE_LISTENER_POLL_SECONDS) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    notify = conn.notifies.pop(0)
+                    try:
+                        payload = json.loads(notify.payload)
+                    except ValueError:
+                        logger.warning(f"Ignoring malformed change notification: {notify.payload[:200]}")
+                        continue
+                    dispatch_table_change(payload)
+        except Exception as e:
+            logger.error(f"Change listener error: {e}, reconnecting in {CHANGE_LISTENER_RECONNECT_SECONDS}s")
+            first_connect = False
+        finally:
+            if conn is not None:
+                try:
+                    conn.close()
+                except psycopg2.Error:
+                    pass
+        time.sleep(CHANGE_LISTENER_RECONNECT_SECONDS)
+
+def start_change_listener():
+    """啟動本程序的監聽執行緒（只啟動一次）"""
+    global _change_listener_thread
+    if not CHANGE_LISTENER_ENABLED or _change_listener_thread is not None:
+        return
+    with _change_listener_lock:
+        if _change_listener_thread is None:
+            _change_listener_thread = threading.Thread(
+                target=run_change_listener, name='change-listener', daemon=True
+            )
+            _change_listener_thread.start()
+
+@app.before_request
+def ensure_change_listener():
+    # 在實際處理請求的程序中才啟動，避免開發模式的重載監視程序也建立連線
+    start_change_listener()
+
+def handle_bookings_table_change(payload):
+    """其他程序寫入預約：清除相關機器的快取並喚醒 SSE 串流"""
+    if payload.get('truncated') or payload.get('reset'):
+        invalidate_consecutive_run_cache()
+        invalidate_availability_cache()
+        clear_booking_occupancy()
+    else:
+        for machine_id in payload.get('machine_ids', []):
+            invalidate_consecutive_run_cache(machine_id=machine_id)
+            invalidate_availability_cache(machine_id)
+            # 新增預約不會釋出時段，准入控制的佔用記憶只在取消或刪除時清除
+            if payload.get('op') != 'INSERT':
+                clear_booking_occupancy(machine_id)
+    notify_booking_change_listeners()
+
+def handle_machines_table_change(payload):
+    """機器刪除或重建時清除其點陣圖快取"""
+    if payload.get('truncated') or payload.get('reset'):
+        invalidate_availability_cache()
+        return
+    for machine_id in payload.get('ids', []):
+        invalidate_availability_cache(machine_id)
+
+def handle_machine_restrictions_table_change(payload):
+    """限制規則變更會影響連續使用判斷"""
+    if payload.get('truncated') or payload.get('reset'):
+        invalidate_consecutive_run_cache()
+        return
+    for machine_id in payload.get('machine_ids', []):
+        invalidate_consecutive_run_cache(machine_id=machine_id)
+
+def handle_users_table_change(payload):
+    """角色或啟用狀態變更時清除登入快取與頻率限制的用戶驗證快取"""
+    if payload.get('truncated') or payload.get('reset'):
+        invalidate_user_login_cache()
+        invalidate_rate_limit_user_cache()
+        return
+    for email in payload.get('emails', []):
+        invalidate_user_login_cache(email)
+        invalidate_rate_limit_user_cache(email)
+
+subscribe_table_changes('bookings', handle_bookings_table_change)
+subscribe_table_changes('machines', handle_machines_table_change)
+subscribe_table_changes('machine_restrictions', handle_machine_restrictions_table_change)
+subscribe_table_changes('users', handle_users_table_change)
+
+# =========== 管理員即時推送（WebSocket） ===========
+
+# 需要安裝 flask-sock；未安裝時前端會退回操作後重新載入整張表
+ADMIN_CHANNEL_HEARTBEAT_SECONDS = 25
+ADMIN_CHANNEL_QUEUE_SIZE = 1000
+ADMIN_CHANNEL_TABLES = ['bookings', 'machines', 'machine_restrictions', 'notifications', 'users']
+# 連線票證：管理員先以一般管理 API 的驗證方式換取短效票證，再用票證開啟 WebSocket，
+# 避免管理員郵箱出現在網址與存取日誌，也讓知道郵箱的人無法直接連線
+ADMIN_CHANNEL_TICKET_TTL_SECONDS = 60
+# 多程序部署必須設定相同的密鑰，否則票證只能在簽發的程序內使用
+ADMIN_CHANNEL_SECRET = os.getenv('ADMIN_CHANNEL_SECRET') or secrets.token_hex(32)
+if not os.getenv('ADMIN_CHANNEL_SECRET'):
+    logger.warning("ADMIN_CHANNEL_SECRET not set, admin live channel tickets are only valid in this process")
+
+# 每條連線一個佇列，由 LISTEN/NOTIFY 監聽執行緒放入變更
+_admin_channel_queues = set()
+_admin_channel_queues_lock = threading.Lock()
+
+def broadcast_admin_change(payload):
+    """將資料表變更轉送給所有管理員連線；佇列滿時改送重新同步，避免阻塞監聽執行緒"""
+    import queue
+    with _admin_channel_queues_lock:
+        queues = list(_admin_channel_queues)
+    for channel_queue in queues:
+        try:
+            channel_queue.put_nowait(payload)
+        except queue.Full:
+            # 連線處理不及：清空佇列，改為要求前端重新載入各表
+            logger.warning("Admin channel queue full, requesting resync")
+            try:
+                while True:
+                    channel_queue.get_nowait()
+            except queue.Empty:
+                pass
+            for table in ['bookings', 'machines', 'notifications']:
+                channel_queue.put_nowait({'table': table, 'op': 'RESET', 'reset': True})
+
+for _table in ADMIN_CHANNEL_TABLES:
+    subscribe_table_changes(_table, broadcast_admin_change)
+
+def fetch_admin_counters(cur):
+    """管理介面的彙總計數"""
+    now = get_taipei_now().replace(tzinfo=None)
+    cur.execute("""
+        SELECT
+            (SELECT COUNT(*) FROM bookings WHERE status = 'active') AS active_bookings,
+            (SELECT COUNT(*) FROM bookings WHERE status = 'active' AND time_slot >= %s) AS upcoming_bookings,
+            (SELECT COUNT(*) FROM users) AS total_users,
+            (SELECT COUNT(*) FROM machines) AS total_machines,
+            (SELECT COUNT(*) FROM machines WHERE status = 'active') AS active_machines,
+            (SELECT COUNT(*) FROM machines WHERE status = 'maintenance') AS maintenance_machines,
+            (SELECT COUNT(*) FROM notifications
+             WHERE is_active = true
+               AND (start_time IS NULL OR start_time <= %s)
+               AND (end_time IS NULL OR end_time >= %s)) AS active_notifications
+    """, (now - timedelta(hours=SLOT_HOURS), now, now))
+    return dict(cur.fetchone())
+
+def build_admin_channel_messages(payloads, cur):
+    """
+    將一批資料表變更整理為推送訊息：
+      {type: bookings|machines|notifications, upserted: [...], removed: [id, ...]}
+      {type: resync, table}  無法得知具體資料列時，前端重新載入該表
+      {type: counters, counters}
+    """
+    changed = {'bookings': set(), 'machines': set(), 'notifications': set()}
+    removed = {'bookings': set(), 'machines': set(), 'notifications': set()}
+    resync = set()
+    
+    for payload in payloads:
+        table = payload.get('table')
+        if table == 'users':
+            continue
+        if table == 'machine_restrictions':
+            # 限制規則只影響機器列表的限制數量
+            table = 'machines'
+            ids = payload.get('machine_ids', [])
+            op = 'UPDATE'
+        else:
+            ids = payload.get('ids', [])
+            op = payload.get('op')
+        if table not in changed:
+            continue
+        if payload.get('truncated') or payload.get('reset'):
+            resync.add(table)
+        elif op == 'DELETE':
+            removed[table].update(ids)
+            changed[table].difference_update(ids)
+        else:
+            changed[table].update(ids)
+            removed[table].difference_update(ids)
+    
+    messages = [{'type': 'resync', 'table': table} for table in sorted(resync)]
+    
+    fetchers = {
+        'bookings': lambda ids: [format_admin_booking(row) for row in fetch_admin_booking_rows(cur, ids)],
+        'machines': lambda ids: fetch_admin_machines(cur, ids),
+        'notifications': lambda ids: fetch_admin_notifications(cur, ids)
+    }
+    for table, fetch in fetchers.items():
+        if table in resync or not (changed[table] or removed[table]):
+            continue
+        upserted = fetch(sorted(changed[table])) if changed[table] else []
+        # 變更後又被刪除（或查詢不到）的資料列視為移除
+        found_ids = {item['id'] for item in upserted}
+        removed_ids = {str(i) for i in removed[table]} | {str(i) for i in changed[table] if str(i) not in found_ids}
+        messages.append({'type': table, 'upserted': upserted, 'removed': sorted(removed_ids)})
+    
+    messages.append({'type': 'counters', 'counters': fetch_admin_counters(cur)})
+    return messages
+
+def fetch_admin_booking_rows(cur, booking_ids):
+    """依預約 ID 查詢管理員預約列表所需的欄位"""
+    cur.execute("""
+        SELECT 
+            b.id,
+            b.user_email,
+            u.name as user_name,
+            b.machine_id,
+            m.name as machine_name,
+            m.description as machine_description,
+            b.time_slot,
+            b.status,
+            b.created_at,
+            b.updated_at
+        FROM bookings b
+        JOIN users u ON b.user_email = u.email
+        JOIN machines m ON b.machine_id = m.id
+        WHERE b.id = ANY(%s)
+    """, (list(booking_ids),))
+    return cur.fetchall()
+
+def issue_admin_channel_ticket(admin_email):
+    """簽發管理員即時通道票證（HMAC 簽章，內含郵箱與簽發時間）"""
+    from itsdangerous import URLSafeTimedSerializer
+    serializer = URLSafeTimedSerializer(ADMIN_CHANNEL_SECRET, salt='admin-live-channel')
+    return serializer.dumps({'email': admin_email})
+
+def verify_admin_channel_ticket(ticket):
+    """驗證票證，返回管理員郵箱；簽章錯誤或已過期返回 None"""
+    from itsdangerous import BadSignature, URLSafeTimedSerializer
+    serializer = URLSafeTimedSerializer(ADMIN_CHANNEL_SECRET, salt='admin-live-channel')
+    try:
+        data = serializer.loads(ticket, max_age=ADMIN_CHANNEL_TICKET_TTL_SECONDS)
+    except BadSignature:
+        return None
+    return data.get('email') if isinstance(data, dict) else None
+
+@app.route('/admin/ws/ticket', methods=['POST'])
+def create_admin_channel_ticket():
+    """
+    換取管理員即時通道的連線票證
+    驗證方式與其他管理 API 相同（X-Admin-Email），票證 ADMIN_CHANNEL_TICKET_TTL_SECONDS 秒內有效
+    """
+    admin_email = request.headers.get('X-Admin-Email', '')
+    is_authorized, admin_role = verify_admin_permission(admin_email)
+    
+    if not is_authorized:
+        return jsonify({'error': 'Access denied. Manager or admin role required.'}), 403
+    
+    return jsonify({
+        'ticket': issue_admin_channel_ticket(unquote(admin_email)),
+        'expires_in': ADMIN_CHANNEL_TICKET_TTL_SECONDS
+    }), 200
+
+if sock is not None:
+    # 注意：票證的可信度不高於簽發它的 /admin/ws/ticket，該端點與其他管理 API 一樣只依 X-Admin-Email 判斷身分；
+    # 票證只減少郵箱外洩（網址、日誌）與直接連線的風險，有效期內仍可被重複使用，連線建立後也會重新確認角色
+    @sock.route('/admin/ws')
+    def admin_live_channel(ws):
+        """
+        管理員即時推送通道
+        連線後先送出彙總計數，之後推送預約、機器、通知的增量更新
+        瀏覽器 WebSocket 無法帶自訂 header，以查詢參數 ticket 傳遞 /admin/ws/ticket 簽發的票證
+        """
+        import queue
+        admin_email = verify_admin_channel_ticket(request.args.get('ticket', '')) or ''
+        is_authorized, admin_role = verify_admin_permission(admin_email)
+        if not is_authorized:
+            ws.send(app.json.dumps({'type': 'error', 'error': 'Access denied. Manager or admin role required.'}))
+            ws.close()
+            return
+        
+        start_change_listener()
+        channel_queue = queue.Queue(maxsize=ADMIN_CHANNEL_QUEUE_SIZE)
+        with _admin_channel_queues_lock:
+            _admin_channel_queues.add(channel_queue)
+        logger.info(f"Admin {admin_email} connected to live channel")
+        
+        try:
+            conn = get_db_conn()
+            try:
+                cur = conn.cursor(cursor_factory=RealDictCursor)
+                ws.send(app.json.dumps({
+                    'type': 'counters', 'counters': fetch_admin_counters(cur), 'admin_role': admin_role
+                }))
+            finally:
+                conn.close()
+            
+            while True:
+                try:
+                    payloads = [channel_queue.get(timeout=ADMIN_CHANNEL_HEARTBEAT_SECONDS)]
+                except queue.Empty:
+                    ws.send(app.json.dumps({'type': 'ping'}))
+                    continue
+                # 合併同一時間累積的變更，一次查詢
+                while True:
+                    try:
+                        payloads.append(channel_queue.get_nowait())
+                    except queue.Empty:
+                        break
+                
+                conn = get_db_conn()
+                try:
+                    cur = conn.cursor(cursor_factory=RealDictCursor)
+                    messages = build_admin_channel_messages(payloads, cur)
+                finally:
+                    conn.close()
+                for message in messages:
+                    ws.send(app.json.dumps(message))
+        except psycopg2.Error as e:
+            logger.error(f"Database error in admin live channel: {e}")
+        except Exception as e:
+            # 連線被關閉時 send 會拋出例外
+            logger.info(f"Admin live channel for {admin_email} closed: {e}")
+        finally:
+            with _admin_channel_queues_lock:
+                _admin_channel_queues.discard(channel_queue)
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=True)
@@ -0,0 +1,132 @@
+"""
+批量取消預約效能測試
+
+比較逐筆取消（模擬 N 次 DELETE /bookings/<id>）與單次批量取消（bulk_cancel_bookings）
+在 1000 筆預約下的耗時。逐筆取消時每筆都建立新的資料庫連線，與實際每個請求各自連線相同；
+批量取消同樣計入一次連線。會建立一台暫時機器、測試用戶與預約，結束後全部刪除。
+
+使用方式：python bench_bulk_cancel.py [預約數量]
+"""
+import sys
+import time
+import uuid
+from datetime import timedelta
+
+from psycopg2.extras import RealDictCursor, execute_values
+
+from app import get_db_conn, get_taipei_now, bulk_cancel_bookings, SLOT_HOURS
+
+BENCH_USER_EMAIL = 'bench-bulk-cancel@example.com'
+
+
+def seed_bookings(cur, machine_id, count):
+    """建立 count 筆未來的 active 預約與對應的使用記錄，返回預約 ID 列表"""
+    now = get_taipei_now().replace(tzinfo=None, minute=0, second=0, microsecond=0)
+    first_slot = now.replace(hour=(now.hour // SLOT_HOURS) * SLOT_HOURS) + timedelta(days=1)
+    slots = [first_slot + timedelta(hours=SLOT_HOURS * i) for i in range(count)]
+
+    rows = execute_values(cur, """
+        INSERT INTO bookings (user_email, machine_id, time_slot, status)
+        VALUES %s
+        RETURNING id, time_slot
+    """, [(BENCH_USER_EMAIL, machine_id, slot, 'active') for slot in slots], fetch=True)
+
+    execute_values(cur, """
+        INSERT INTO user_machine_usage (user_email, machine_id, booking_id, usage_time)
+        VALUES %s
+    """, [(BENCH_USER_EMAIL, machine_id, row['id'], row['time_slot']) for row in rows])
+
+    return [row['id'] for row in rows]
+
+
+def cancel_one_by_one(booking_ids):
+    """模擬現有單筆取消流程：每筆一個請求，各自連線、查詢、更新狀態、刪除使用記錄並提交"""
+    for booking_id in booking_ids:
+        conn = get_db_conn()
+        try:
+            cur = conn.cursor(cursor_factory=RealDictCursor)
+            cur.execute("""
+                SELECT b.id, b.user_email, b.time_slot, b.status, m.name as machine_name
+                FROM bookings b
+                JOIN machines m ON b.machine_id = m.id
+                WHERE b.id = %s
+            """, (booking_id,))
+            cur.fetchone()
+            cur.execute("""
+                UPDATE bookings SET status = 'cancelled', updated_at = %s WHERE id = %s
+            """, (get_taipei_now().replace(tzinfo=None), booking_id))
+            cur.execute("DELETE FROM user_machine_usage WHERE booking_id = %s", (booking_id,))
+            conn.commit()
+        finally:
+            conn.close()
+
+
+def cancel_in_bulk(booking_ids):
+    """單一請求批量取消：一次連線、一個語句"""
+    conn = get_db_conn()
+    try:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        results, deleted_usage_records, _ = bulk_cancel_bookings(
+            cur, booking_ids=booking_ids, owner_email=BENCH_USER_EMAIL, future_only=True
+        )
+        conn.commit()
+        return results, deleted_usage_records
+    finally:
+        conn.close()
+
+
+def run_benchmark(count):
+    conn = get_db_conn()
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    machine_id = None
+    created_user = False
+    try:
+        cur.execute("""
+            INSERT INTO users (email, name, role) VALUES (%s, %s, 'user')
+            ON CONFLICT (email) DO NOTHING
+            RETURNING id
+        """, (BENCH_USER_EMAIL, 'Bench User'))
+        created_user = cur.fetchone() is not None
+        cur.execute("""
+            INSERT INTO machines (name, description, status)
+            VALUES (%s, %s, 'active') RETURNING id
+        """, (f'bench-{uuid.uuid4().hex[:8]}', '批量取消效能測試用機器'))
+        machine_id = cur.fetchone()['id']
+        conn.commit()
+
+        booking_ids = seed_bookings(cur, machine_id, count)
+        conn.commit()
+        start = time.perf_counter()
+        cancel_one_by_one(booking_ids)
+        single_elapsed = time.perf_counter() - start
+
+        cur.execute("DELETE FROM bookings WHERE machine_id = %s", (machine_id,))
+        conn.commit()
+
+        booking_ids = seed_bookings(cur, machine_id, count)
+        conn.commit()
+        start = time.perf_counter()
+        results, deleted_usage_records = cancel_in_bulk(booking_ids)
+        bulk_elapsed = time.perf_counter() - start
+
+        cancelled = sum(1 for result in results if result['outcome'] == 'cancelled')
+        print(f"預約數量：{count}")
+        print(f"逐筆取消：{single_elapsed * 1000:.1f} ms（{single_elapsed * 1000 / count:.2f} ms/筆）")
+        print(f"批量取消：{bulk_elapsed * 1000:.1f} ms（已取消 {cancelled} 筆，刪除使用記錄 {deleted_usage_records} 筆）")
+        if bulk_elapsed > 0:
+            print(f"加速倍數：{single_elapsed / bulk_elapsed:.1f}x")
+    finally:
+        conn.rollback()
+        if machine_id is not None:
+            # machines 刪除時會連帶刪除預約與使用記錄
+            cur.execute("DELETE FROM machines WHERE id = %s", (machine_id,))
+        if created_user:
+            # 只刪除本次建立的測試用戶，不影響事先存在的同名帳號
+            cur.execute("DELETE FROM users WHERE email = %s", (BENCH_USER_EMAIL,))
+        conn.commit()
+        cur.close()
+        conn.close()
+
+
+if __name__ == '__main__':
+    run_benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 1000)
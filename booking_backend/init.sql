@@ -29,6 +29,13 @@ SET timezone = 'Asia/Taipei';
 -- CREATE USER booking_app WITH PASSWORD 'your_secure_password';
 -- CREATE USER booking_readonly WITH PASSWORD 'your_readonly_password';
 
+-- ===============================================
+-- 啟用擴充功能
+-- ===============================================
+
+-- 用戶搜尋的子字串比對（trigram 索引）
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
 -- ===============================================
 -- 創建資料表
 -- ===============================================
@@ -55,6 +62,13 @@ CREATE TABLE IF NOT EXISTS machines (
   restriction_status TEXT NOT NULL DEFAULT 'none' CHECK (restriction_status IN ('none', 'limited', 'blocked')),
   is_active BOOLEAN DEFAULT true,
   maintenance_notes TEXT,
+  -- 排定的維護窗口：窗口開始時切換為 maintenance_status，結束後還原為 status_before_maintenance
+  maintenance_status TEXT CHECK (maintenance_status IN ('active', 'maintenance', 'limited')),
+  maintenance_start TIMESTAMP,
+  maintenance_end TIMESTAMP,
+  status_before_maintenance TEXT CHECK (status_before_maintenance IN ('active', 'maintenance', 'limited')),
+  -- 維護窗口的說明，與 maintenance_notes 分開，窗口結束時只清除此欄
+  maintenance_window_note TEXT,
   created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
   updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
@@ -134,6 +148,53 @@ CREATE TABLE IF NOT EXISTS system_logs (
   created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
+-- 8. 冪等鍵表（重送請求時回放第一次的回應）
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+  idempotency_key TEXT NOT NULL,
+  endpoint TEXT NOT NULL,
+  request_hash TEXT NOT NULL,
+  status_code INTEGER,
+  response_body TEXT,
+  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+  expires_at TIMESTAMP NOT NULL,
+  PRIMARY KEY (idempotency_key, endpoint)
+);
+
+-- 9. 預約變更記錄表（差異同步用，由 bookings 觸發器寫入）
+-- txid 為寫入交易的 ID，讀取端只返回已確定提交的交易，游標依 (txid, seq) 單調前進
+CREATE TABLE IF NOT EXISTS booking_changes (
+  seq BIGSERIAL PRIMARY KEY,
+  txid XID8 NOT NULL DEFAULT pg_current_xact_id(),
+  booking_id INTEGER NOT NULL,
+  machine_id INTEGER NOT NULL,
+  user_email TEXT NOT NULL,
+  time_slot TIMESTAMP NOT NULL,
+  change_type TEXT NOT NULL CHECK (change_type IN ('created', 'cancelled', 'deleted', 'updated')),
+  status TEXT,
+  changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- 預約變更記錄的保留水位：已清除的最大 (txid, seq)，游標低於此值代表中間的變更已被刪除，需要重新同步
+CREATE TABLE IF NOT EXISTS booking_changes_retention (
+  id BOOLEAN PRIMARY KEY DEFAULT true CHECK (id),
+  pruned_txid XID8 NOT NULL DEFAULT '0',
+  pruned_seq BIGINT NOT NULL DEFAULT 0,
+  pruned_at TIMESTAMP
+);
+INSERT INTO booking_changes_retention (id) VALUES (true) ON CONFLICT (id) DO NOTHING;
+
+-- 10. 預約時段暫留表（確認預約期間短暫佔住時段，過期即失效）
+CREATE TABLE IF NOT EXISTS slot_holds (
+  id SERIAL PRIMARY KEY,
+  machine_id INTEGER NOT NULL REFERENCES machines(id) ON DELETE CASCADE,
+  time_slot TIMESTAMP NOT NULL,
+  user_email TEXT NOT NULL,
+  hold_token TEXT NOT NULL,
+  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+  expires_at TIMESTAMP NOT NULL,
+  UNIQUE (machine_id, time_slot)
+);
+
 -- ===============================================
 -- 創建觸發器函數
 -- ===============================================
@@ -164,6 +225,105 @@ BEGIN
 END;
 $$ LANGUAGE plpgsql;
 
+-- 預約變更記錄函數（差異同步用）
+CREATE OR REPLACE FUNCTION record_booking_change()
+RETURNS TRIGGER AS $$
+DECLARE
+    v_change_type TEXT;
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO booking_changes (booking_id, machine_id, user_email, time_slot, change_type, status)
+        VALUES (NEW.id, NEW.machine_id, NEW.user_email, NEW.time_slot, 'created', NEW.status);
+        RETURN NEW;
+    ELSIF TG_OP = 'DELETE' THEN
+        INSERT INTO booking_changes (booking_id, machine_id, user_email, time_slot, change_type, status)
+        VALUES (OLD.id, OLD.machine_id, OLD.user_email, OLD.time_slot, 'deleted', OLD.status);
+        RETURN OLD;
+    END IF;
+
+    -- UPDATE：只記錄影響時段佔用的變更（狀態、時段、機器、預約者）
+    IF NEW.status IS DISTINCT FROM OLD.status THEN
+        IF NEW.status = 'active' THEN
+            v_change_type := 'created';
+        ELSIF OLD.status = 'active' AND NEW.status = 'cancelled' THEN
+            v_change_type := 'cancelled';
+        ELSE
+            v_change_type := 'updated';
+        END IF;
+    ELSIF NEW.time_slot IS DISTINCT FROM OLD.time_slot
+        OR NEW.machine_id IS DISTINCT FROM OLD.machine_id
+        OR NEW.user_email IS DISTINCT FROM OLD.user_email THEN
+        v_change_type := 'updated';
+    ELSE
+        RETURN NEW;
+    END IF;
+
+    -- 時段或機器改變時，先記錄舊時段被釋放
+    IF v_change_type = 'updated' AND OLD.status = 'active'
+        AND (NEW.time_slot IS DISTINCT FROM OLD.time_slot OR NEW.machine_id IS DISTINCT FROM OLD.machine_id) THEN
+        INSERT INTO booking_changes (booking_id, machine_id, user_email, time_slot, change_type, status)
+        VALUES (OLD.id, OLD.machine_id, OLD.user_email, OLD.time_slot, 'deleted', OLD.status);
+    END IF;
+
+    INSERT INTO booking_changes (booking_id, machine_id, user_email, time_slot, change_type, status)
+    VALUES (NEW.id, NEW.machine_id, NEW.user_email, NEW.time_slot, v_change_type, NEW.status);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+-- 資料變更通知函數（LISTEN/NOTIFY，供各後端程序同步快取與推送）
+-- 語句級觸發器每個語句只發一則通知，批次寫入不會產生大量訊息
+CREATE OR REPLACE FUNCTION notify_table_change()
+RETURNS TRIGGER AS $$
+DECLARE
+    changed_rows JSONB;
+    payload JSONB;
+BEGIN
+    IF TG_LEVEL = 'ROW' THEN
+        IF TG_OP = 'DELETE' THEN
+            changed_rows := jsonb_build_array(to_jsonb(OLD));
+        ELSE
+            changed_rows := jsonb_build_array(to_jsonb(NEW));
+        END IF;
+    ELSIF TG_OP = 'INSERT' THEN
+        SELECT jsonb_agg(to_jsonb(r)) INTO changed_rows FROM new_rows r;
+    ELSIF TG_OP = 'DELETE' THEN
+        SELECT jsonb_agg(to_jsonb(r)) INTO changed_rows FROM old_rows r;
+    ELSE
+        -- UPDATE 同時帶入舊值，例如預約改到其他機器時兩台機器都需要更新
+        SELECT jsonb_agg(u.row_data) INTO changed_rows FROM (
+            SELECT to_jsonb(o) AS row_data FROM old_rows o
+            UNION ALL
+            SELECT to_jsonb(n) AS row_data FROM new_rows n
+        ) u;
+    END IF;
+
+    -- 語句沒有影響任何資料列
+    IF changed_rows IS NULL THEN
+        RETURN NULL;
+    END IF;
+
+    SELECT jsonb_build_object(
+        'table', TG_TABLE_NAME,
+        'op', TG_OP,
+        'ids', COALESCE(jsonb_agg(DISTINCT r->'id') FILTER (WHERE r ? 'id'), '[]'::jsonb),
+        'machine_ids', COALESCE(jsonb_agg(DISTINCT r->'machine_id')
+            FILTER (WHERE jsonb_typeof(r->'machine_id') = 'number'), '[]'::jsonb),
+        'emails', COALESCE(jsonb_agg(DISTINCT COALESCE(r->'user_email', r->'email'))
+            FILTER (WHERE jsonb_typeof(COALESCE(r->'user_email', r->'email')) = 'string'), '[]'::jsonb)
+    ) INTO payload
+    FROM jsonb_array_elements(changed_rows) AS r;
+
+    -- NOTIFY 內容上限約 8000 bytes，超過時只通知資料表，由接收端全部失效
+    IF octet_length(payload::text) > 7900 THEN
+        payload := jsonb_build_object('table', TG_TABLE_NAME, 'op', TG_OP, 'truncated', true);
+    END IF;
+
+    PERFORM pg_notify('booking_system_changes', payload::text);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
 -- 系統日誌記錄函數（可選）
 CREATE OR REPLACE FUNCTION log_data_changes()
 RETURNS TRIGGER AS $$
@@ -226,6 +386,98 @@ CREATE TRIGGER check_booking_conflict_trigger
     FOR EACH ROW
     EXECUTE FUNCTION check_booking_conflict();
 
+-- 預約變更記錄觸發器（差異同步用）
+CREATE TRIGGER record_booking_change_trigger
+    AFTER INSERT OR UPDATE OR DELETE ON bookings
+    FOR EACH ROW
+    EXECUTE FUNCTION record_booking_change();
+
+-- 資料變更通知觸發器（LISTEN/NOTIFY）
+CREATE TRIGGER notify_bookings_insert_trigger
+    AFTER INSERT ON bookings
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION notify_table_change();
+
+CREATE TRIGGER notify_bookings_update_trigger
+    AFTER UPDATE ON bookings
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION notify_table_change();
+
+CREATE TRIGGER notify_bookings_delete_trigger
+    AFTER DELETE ON bookings
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION notify_table_change();
+
+CREATE TRIGGER notify_machines_insert_trigger
+    AFTER INSERT ON machines
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION notify_table_change();
+
+CREATE TRIGGER notify_machines_update_trigger
+    AFTER UPDATE ON machines
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION notify_table_change();
+
+CREATE TRIGGER notify_machines_delete_trigger
+    AFTER DELETE ON machines
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION notify_table_change();
+
+CREATE TRIGGER notify_machine_restrictions_insert_trigger
+    AFTER INSERT ON machine_restrictions
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION notify_table_change();
+
+CREATE TRIGGER notify_machine_restrictions_update_trigger
+    AFTER UPDATE ON machine_restrictions
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION notify_table_change();
+
+CREATE TRIGGER notify_machine_restrictions_delete_trigger
+    AFTER DELETE ON machine_restrictions
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION notify_table_change();
+
+CREATE TRIGGER notify_notifications_insert_trigger
+    AFTER INSERT ON notifications
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION notify_table_change();
+
+CREATE TRIGGER notify_notifications_update_trigger
+    AFTER UPDATE ON notifications
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION notify_table_change();
+
+CREATE TRIGGER notify_notifications_delete_trigger
+    AFTER DELETE ON notifications
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION notify_table_change();
+
+-- users 只在角色或啟用狀態改變時通知，登入時更新 last_login 不觸發
+CREATE TRIGGER notify_users_update_trigger
+    AFTER UPDATE OF role, is_active ON users
+    FOR EACH ROW
+    WHEN (OLD.role IS DISTINCT FROM NEW.role OR OLD.is_active IS DISTINCT FROM NEW.is_active)
+    EXECUTE FUNCTION notify_table_change();
+
+CREATE TRIGGER notify_users_delete_trigger
+    AFTER DELETE ON users
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION notify_table_change();
+
 -- 系統日誌觸發器（預設關閉，需要時可啟用）
 -- CREATE TRIGGER log_users_changes
 --     AFTER INSERT OR UPDATE OR DELETE ON users
@@ -258,6 +510,14 @@ CREATE INDEX IF NOT EXISTS idx_bookings_status ON bookings(status);
 CREATE INDEX IF NOT EXISTS idx_bookings_user_email_status ON bookings(user_email, status);
 CREATE INDEX IF NOT EXISTS idx_bookings_created_at ON bookings(created_at);
 CREATE INDEX IF NOT EXISTS idx_bookings_time_range ON bookings(time_slot, status) WHERE status = 'active';
+CREATE INDEX IF NOT EXISTS idx_bookings_machine_user_slot_active ON bookings(machine_id, user_email, time_slot) WHERE status = 'active';
+-- 管理員預約列表游標分頁（created_at, id 由新到舊），並支援依狀態、機器、用戶篩選
+CREATE INDEX IF NOT EXISTS idx_bookings_created_at_id ON bookings(created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_bookings_status_created_at_id ON bookings(status, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_bookings_machine_created_at_id ON bookings(machine_id, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_bookings_user_created_at_id ON bookings(user_email, created_at DESC, id DESC);
+-- 用戶預約記錄依時段由新到舊分頁；INCLUDE status 讓統計模式只需掃描索引
+CREATE INDEX IF NOT EXISTS idx_bookings_user_time_slot_id ON bookings(user_email, time_slot DESC, id DESC) INCLUDE (status);
 
 -- 用戶使用記錄索引
 CREATE INDEX IF NOT EXISTS idx_user_machine_usage_user_machine 
@@ -293,9 +553,16 @@ ON notifications(category);
 CREATE INDEX IF NOT EXISTS idx_users_email ON users(email);
 CREATE INDEX IF NOT EXISTS idx_users_role ON users(role);
 CREATE INDEX IF NOT EXISTS idx_users_active ON users(is_active) WHERE is_active = true;
+-- 用戶列表游標分頁與搜尋（前綴比對用 text_pattern_ops，子字串比對用 trigram）
+CREATE INDEX IF NOT EXISTS idx_users_created_at_id ON users(created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_users_email_lower_prefix ON users(lower(email) text_pattern_ops);
+CREATE INDEX IF NOT EXISTS idx_users_name_lower_prefix ON users(lower(name) text_pattern_ops);
+CREATE INDEX IF NOT EXISTS idx_users_email_trgm ON users USING GIN (email gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_users_name_trgm ON users USING GIN (name gin_trgm_ops);
 
 -- 機器索引
 CREATE INDEX IF NOT EXISTS idx_machines_status ON machines(status);
+CREATE INDEX IF NOT EXISTS idx_machines_maintenance_window ON machines(maintenance_start, maintenance_end) WHERE maintenance_end IS NOT NULL;
 CREATE INDEX IF NOT EXISTS idx_machines_restriction_status ON machines(restriction_status);
 CREATE INDEX IF NOT EXISTS idx_machines_active ON machines(is_active) WHERE is_active = true;
 
@@ -305,6 +572,18 @@ CREATE INDEX IF NOT EXISTS idx_system_logs_user_email ON system_logs(user_email)
 CREATE INDEX IF NOT EXISTS idx_system_logs_action ON system_logs(action);
 CREATE INDEX IF NOT EXISTS idx_system_logs_table_record ON system_logs(table_name, record_id);
 
+-- 預約變更記錄索引（依游標順序讀取）
+CREATE INDEX IF NOT EXISTS idx_booking_changes_txid_seq ON booking_changes(txid, seq);
+CREATE INDEX IF NOT EXISTS idx_booking_changes_changed_at ON booking_changes(changed_at);
+
+-- 冪等鍵索引（清理過期資料）
+CREATE INDEX IF NOT EXISTS idx_idempotency_keys_expires_at ON idempotency_keys(expires_at);
+
+-- 時段暫留索引（依令牌釋放、清理過期資料、查詢用戶暫留）
+CREATE INDEX IF NOT EXISTS idx_slot_holds_hold_token ON slot_holds(hold_token);
+CREATE INDEX IF NOT EXISTS idx_slot_holds_expires_at ON slot_holds(expires_at);
+CREATE INDEX IF NOT EXISTS idx_slot_holds_user_email_lower ON slot_holds(lower(user_email));
+
 -- ===============================================
 -- 創建視圖（便於查詢）
 -- ===============================================
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# 測試直接匯入 app.py，不需要資料庫連線
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
@@ -0,0 +1,88 @@
+import threading
+import time
+
+from flask import jsonify
+
+import app as app_module
+
+
+class FakeCursor:
+    def __init__(self, connection):
+        self.connection = connection
+
+    def execute(self, query, params=None):
+        pass
+
+    def fetchone(self):
+        # 冪等鍵佔用成功
+        return {'idempotency_key': 'key'}
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    open_count = 0
+    lock = threading.Lock()
+
+    def __init__(self):
+        with FakeConnection.lock:
+            FakeConnection.open_count += 1
+
+    def cursor(self, cursor_factory=None):
+        return FakeCursor(self)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        with FakeConnection.lock:
+            FakeConnection.open_count -= 1
+
+
+def test_queued_booking_request_holds_no_db_connection(monkeypatch):
+    monkeypatch.setattr(app_module, 'get_db_conn', FakeConnection)
+    monkeypatch.setattr(app_module, '_admission_states', {})
+    monkeypatch.setattr(app_module, '_booking_occupancy', {})
+    monkeypatch.setattr(app_module, 'BOOKING_ADMISSION_CONCURRENCY', 1)
+    monkeypatch.setattr(app_module, 'BOOKING_ADMISSION_WAIT_SECONDS', 5)
+    FakeConnection.open_count = 0
+
+    @app_module.idempotent
+    @app_module.booking_admission
+    def fake_create_booking():
+        return jsonify({'success': True}), 201
+
+    # 先佔住唯一的寫入名額，讓下一個請求進入佇列
+    admitted, _ = app_module.acquire_booking_admission('1', 'holder@example.com')
+    assert admitted
+
+    results = []
+
+    def send_request():
+        with app_module.app.test_request_context(
+            '/bookings',
+            method='POST',
+            json={'user_email': 'student@example.com', 'machine_id': '1', 'time_slot': '2099-01-01 08:00:00'},
+            headers={'Idempotency-Key': 'key'}
+        ):
+            results.append(fake_create_booking())
+
+    worker = threading.Thread(target=send_request)
+    worker.start()
+
+    deadline = time.monotonic() + 5
+    while app_module.get_booking_admission_metrics()['total_queued'] == 0:
+        assert time.monotonic() < deadline, 'request never reached the admission queue'
+        time.sleep(0.01)
+
+    assert FakeConnection.open_count == 0
+
+    app_module.release_booking_admission('1')
+    worker.join(5)
+
+    assert results and results[0].status_code == 201
+    assert FakeConnection.open_count == 0
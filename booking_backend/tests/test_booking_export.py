@@ -0,0 +1,66 @@
+import json
+
+import psycopg2
+import pytest
+
+import app as app_module
+
+
+class FailingExportCursor:
+    """第一批資料正常返回，第二批模擬資料庫連線中斷"""
+
+    def __init__(self):
+        self.batches = 0
+
+    def execute(self, query, params=None):
+        pass
+
+    def fetchmany(self, size):
+        self.batches += 1
+        if self.batches > 1:
+            raise psycopg2.OperationalError('server closed the connection unexpectedly')
+        return [{
+            'id': 1,
+            'user_email': 'student@example.com',
+            'user_name': '王小明',
+            'machine_id': 2,
+            'machine_name': 'A1',
+            'time_slot': app_module.datetime(2025, 3, 2, 8, 0),
+            'status': 'active',
+            'created_at': None,
+            'updated_at': None
+        }]
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def cursor(self, name=None, cursor_factory=None):
+        return FailingExportCursor()
+
+    def close(self):
+        pass
+
+
+@pytest.mark.parametrize('export_format', ['ndjson', 'csv'])
+def test_export_marks_and_aborts_stream_on_database_error(monkeypatch, export_format):
+    monkeypatch.setattr(app_module, 'get_db_conn', FakeConnection)
+    monkeypatch.setattr(app_module, 'verify_admin_permission', lambda email: (True, 'admin'))
+
+    with app_module.app.test_request_context(f'/admin/bookings/export?format={export_format}'):
+        response = app_module.export_bookings()
+        assert response.status_code == 200
+
+        chunks = []
+        with pytest.raises(psycopg2.OperationalError):
+            for chunk in response.response:
+                chunks.append(chunk if isinstance(chunk, str) else chunk.decode('utf-8'))
+
+    lines = ''.join(chunks).strip().splitlines()
+    if export_format == 'ndjson':
+        assert json.loads(lines[0])['id'] == 1
+        assert json.loads(lines[-1])['error_type'] == 'export_failed'
+    else:
+        assert lines[1].startswith('1,student@example.com')
+        assert lines[-1].startswith('ERROR,')
@@ -0,0 +1,52 @@
+import time
+
+import app as app_module
+
+
+class FakeCursor:
+    def __init__(self, pending):
+        self.pending = pending
+
+    def execute(self, query, params=None):
+        pass
+
+    def fetchone(self):
+        return {'pending': self.pending.pop(0)}
+
+
+class FakeConnection:
+    # 第一次讀取時較新的變更被未結束的交易擋住，之後該交易回滾、不會再有通知
+    pending = []
+
+    def cursor(self, cursor_factory=None):
+        return FakeCursor(FakeConnection.pending)
+
+    def close(self):
+        pass
+
+
+def test_stream_repolls_soon_when_read_was_cut_off_by_xmin(monkeypatch):
+    reads = [
+        ([], [100, 0], False),
+        ([{'booking_id': 7}], [101, 0], False)
+    ]
+    FakeConnection.pending = [True, False]
+    monkeypatch.setattr(app_module, 'get_db_conn', FakeConnection)
+    monkeypatch.setattr(app_module, 'prune_booking_changes', lambda: None)
+    monkeypatch.setattr(app_module, 'is_booking_changes_cursor_expired', lambda cur, values: False)
+    monkeypatch.setattr(app_module, 'fetch_booking_changes', lambda *args, **kwargs: reads.pop(0))
+    monkeypatch.setattr(app_module, 'format_booking_change', lambda row, user_email: row)
+    monkeypatch.setattr(app_module, 'BOOKING_STREAM_PENDING_RETRY_SECONDS', 0.05)
+
+    cursor = app_module.encode_keyset_cursor(99, 0)
+    with app_module.app.test_request_context(f'/bookings/stream?cursor={cursor}'):
+        response = app_module.stream_booking_changes()
+        started = time.monotonic()
+        for chunk in response.response:
+            chunk = chunk if isinstance(chunk, str) else chunk.decode('utf-8')
+            if 'event: bookings' in chunk:
+                break
+            assert time.monotonic() - started < 2, 'stream waited for the fallback poll'
+
+    assert '"booking_id":7' in chunk.replace(' ', '')
+    assert reads == []
@@ -0,0 +1,43 @@
+import json
+from datetime import date, datetime
+from decimal import Decimal
+
+import app as app_module
+
+
+ROW = {
+    'id': 7,
+    'name': '王小明',
+    'created_at': datetime(2025, 3, 1, 8, 30, 15, 123456),
+    'time_slot': app_module.TAIPEI_TZ.localize(datetime(2025, 3, 2, 12, 0)),
+    'usage_date': date(2025, 3, 2),
+    'usage_hours': Decimal('12.50'),
+    'notes': None
+}
+
+
+def render(payload):
+    with app_module.app.test_request_context():
+        return json.loads(app_module.app.json.response(payload).get_data(as_text=True))
+
+
+def test_orjson_and_stdlib_providers_produce_same_payload(monkeypatch):
+    assert app_module.orjson is not None, 'orjson is listed in requirements.txt'
+    fast = render({'rows': [ROW]})
+
+    monkeypatch.setattr(app_module, 'orjson', None)
+    standard = render({'rows': [ROW]})
+
+    assert fast == standard
+    assert standard['rows'][0]['created_at'] == '2025-03-01T08:30:15.123456'
+    assert standard['rows'][0]['time_slot'] == '2025-03-02T12:00:00+08:00'
+    assert standard['rows'][0]['usage_date'] == '2025-03-02'
+    # 與 Flask 預設 provider 一致，Decimal 以字串輸出避免精度改變
+    assert standard['rows'][0]['usage_hours'] == '12.50'
+
+
+def test_fast_path_is_used_in_debug_mode(monkeypatch):
+    monkeypatch.setattr(app_module.app, 'debug', True)
+    with app_module.app.test_request_context():
+        body = app_module.app.json.response({'value': 1}).get_data(as_text=True)
+    assert body == '{"value":1}'
@@ -0,0 +1,35 @@
+from datetime import datetime
+
+import app as app_module
+
+
+MACHINE = {
+    'name': 'A1',
+    'maintenance_start': datetime(2099, 1, 1, 10, 0),
+    'maintenance_end': datetime(2099, 1, 1, 17, 0)
+}
+
+
+def test_slots_overlapping_window_are_blocked():
+    slots = [datetime(2099, 1, 1, hour) for hour in [4, 8, 12, 16, 20]]
+
+    # 08:00 的時段涵蓋 10:00 開始的維護，16:00 的時段與 17:00 結束前重疊
+    assert app_module.find_maintenance_slots(MACHINE, slots) == [
+        datetime(2099, 1, 1, 8), datetime(2099, 1, 1, 12), datetime(2099, 1, 1, 16)
+    ]
+
+
+def test_machine_without_window_blocks_nothing():
+    machine = {'name': 'A1', 'maintenance_start': None, 'maintenance_end': None}
+
+    assert app_module.find_maintenance_slots(machine, [datetime(2099, 1, 1, 8)]) == []
+
+
+def test_booking_in_window_is_rejected():
+    with app_module.app.test_request_context():
+        response, status_code = app_module.build_maintenance_conflict_response(
+            MACHINE, [datetime(2099, 1, 1, 12)]
+        )
+
+    assert status_code == 409
+    assert response.get_json()['error_type'] == 'machine_maintenance'
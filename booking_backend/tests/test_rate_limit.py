@@ -0,0 +1,66 @@
+from collections import OrderedDict
+
+import app as app_module
+
+
+class FakeCursor:
+    def __init__(self, active_emails):
+        self.active_emails = active_emails
+        self.row = None
+
+    def execute(self, query, params=None):
+        self.row = (1,) if params[0] in self.active_emails else None
+
+    def fetchone(self):
+        return self.row
+
+
+class FakeConnection:
+    active_emails = set()
+    queries = 0
+
+    def cursor(self, cursor_factory=None):
+        FakeConnection.queries += 1
+        return FakeCursor(FakeConnection.active_emails)
+
+    def close(self):
+        pass
+
+
+def setup_rate_limit(monkeypatch, active_emails):
+    monkeypatch.setattr(app_module, 'get_db_conn', FakeConnection)
+    monkeypatch.setattr(app_module, 'RATE_LIMIT_ENABLED', True)
+    monkeypatch.setattr(app_module, 'RATE_LIMIT_REDIS_URL', '')
+    monkeypatch.setattr(app_module, '_rate_limit_buckets', OrderedDict())
+    monkeypatch.setattr(app_module, '_rate_limit_user_cache', OrderedDict())
+    monkeypatch.setitem(app_module.RATE_LIMIT_GROUPS, 'booking_poll', dict(
+        app_module.RATE_LIMIT_GROUPS['booking_poll'], user=(1, 0.001), ip=(3, 0.001)
+    ))
+    FakeConnection.active_emails = set(active_emails)
+    FakeConnection.queries = 0
+
+
+def poll(user_email):
+    with app_module.app.test_request_context(
+        '/machines/availability', headers={'X-User-Email': user_email}
+    ):
+        assert app_module.request.endpoint == 'get_machines_availability'
+        response = app_module.enforce_rate_limit()
+        return 200 if response is None else response.status_code
+
+
+def test_unknown_email_only_uses_ip_bucket(monkeypatch):
+    setup_rate_limit(monkeypatch, active_emails=[])
+
+    # 未註冊的郵箱不扣用戶桶，但仍受 IP 桶限制
+    assert [poll('nobody@example.com') for _ in range(4)] == [200, 200, 200, 429]
+    assert FakeConnection.queries == 1
+
+
+def test_active_user_bucket_applies_after_ip_bucket(monkeypatch):
+    setup_rate_limit(monkeypatch, active_emails=['student@example.com'])
+
+    assert poll('Student@example.com') == 200
+    assert poll('student@example.com') == 429
+    # 其他郵箱不受該用戶桶影響
+    assert poll('other@example.com') == 200
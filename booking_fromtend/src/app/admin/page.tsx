@@ -1,6 +1,6 @@
 'use client';
 
-import { useEffect, useState } from 'react';
+import { useEffect, useRef, useState } from 'react';
 import { useSession } from 'next-auth/react';
 import { useRouter } from 'next/navigation';
 import {
@@ -90,6 +90,38 @@ interface MachineRestriction {
   updated_at: string | null;
 }
 
+// 預約列表每頁筆數
+const ADMIN_BOOKINGS_PAGE_SIZE = 200;
+// 用戶列表每頁筆數與搜尋延遲
+const ADMIN_USERS_PAGE_SIZE = 100;
+const USER_SEARCH_DEBOUNCE_MS = 300;
+// 即時推送斷線後的重連間隔與月統計的合併刷新延遲
+const LIVE_CHANNEL_RECONNECT_MS = 5000;
+const LIVE_STATS_REFRESH_DELAY_MS = 1000;
+
+// 依 id 套用增量更新：更新既有項目、移除已刪除項目，新項目交由 insertNew 決定是否加入
+const applyLivePatch = <T extends { id: string }>(
+  items: T[],
+  upserted: T[],
+  removed: string[],
+  insertNew?: (item: T) => boolean
+): T[] => {
+  const removedIds = new Set(removed);
+  const upsertedById = new Map(upserted.map((item) => [item.id, item]));
+  const next = items
+    .filter((item) => !removedIds.has(item.id))
+    .map((item) => {
+      const updated = upsertedById.get(item.id);
+      if (updated) {
+        upsertedById.delete(item.id);
+        return { ...item, ...updated };
+      }
+      return item;
+    });
+  const added = Array.from(upsertedById.values()).filter((item) => (insertNew ? insertNew(item) : false));
+  return [...added, ...next];
+};
+
 export default function AdminPage() {
   const { data: session, status } = useSession();
   const router = useRouter();
@@ -101,6 +133,8 @@ export default function AdminPage() {
   const [userSearchTerm, setUserSearchTerm] = useState('');
   const [roleFilter, setRoleFilter] = useState<string>('');
   const [loadingUsers, setLoadingUsers] = useState(false);
+  const [usersNextCursor, setUsersNextCursor] = useState<string | null>(null); // 用戶列表下一頁游標
+  const [usersTotalEstimate, setUsersTotalEstimate] = useState<number | null>(null); // 用戶總數估計
   
   // 預約管理相關狀態
   const [bookings, setBookings] = useState<BookingDetail[]>([]);
@@ -117,6 +151,8 @@ export default function AdminPage() {
   const [tempYear, setTempYear] = useState(currentYear);
   const [tempMonth, setTempMonth] = useState(currentMonth);
   const [loadingBookings, setLoadingBookings] = useState(false);
+  const [bookingsNextCursor, setBookingsNextCursor] = useState<string | null>(null); // 下一頁游標
+  const [bookingsTotalEstimate, setBookingsTotalEstimate] = useState<number | null>(null); // 預約總數估計
   const [bookingMessage, setBookingMessage] = useState<{type: 'success' | 'error' | null, text: string}>({type: null, text: ''});
 
   // 通知管理相關狀態
@@ -150,6 +186,20 @@ export default function AdminPage() {
     ...getDefaultTimes()
   });
 
+  // 即時推送（WebSocket）狀態與彙總計數
+  const [liveCounters, setLiveCounters] = useState<Record<string, number> | null>(null);
+  const liveConnectedRef = useRef(false);
+  // 推送訊息處理時需要最新的篩選條件與載入函數，避免閉包取到舊值
+  const liveHandlersRef = useRef<{
+    statusFilter: string;
+    activeTab: string;
+    refreshMonthlyStats: () => void;
+    resync: (table: string) => void;
+  } | null>(null);
+  const liveStatsTimerRef = useRef<ReturnType<typeof setTimeout> | null>(null);
+  // 進行中的用戶列表請求；新的搜尋會中止舊請求，避免較慢的舊回應覆蓋最新結果
+  const usersRequestRef = useRef<AbortController | null>(null);
+
   const [isLoading, setIsLoading] = useState(true);
   const { notifications: useNotificationsNotifications, removeNotification, showSuccess, showError } = useNotifications();
 
@@ -166,6 +216,17 @@ export default function AdminPage() {
     }
   }, [session, status, router]);
 
+  // 搜尋條件變更時重新向伺服器查詢用戶（延遲送出，避免每次按鍵都發請求）
+  useEffect(() => {
+    if (activeTab !== 'users' || !currentUserRole || !['manager', 'admin'].includes(currentUserRole)) {
+      return;
+    }
+    const timer = setTimeout(() => {
+      fetchUsers();
+    }, USER_SEARCH_DEBOUNCE_MS);
+    return () => clearTimeout(timer);
+  }, [userSearchTerm, roleFilter]);
+
   // 監聽標籤切換時加載對應數據
   useEffect(() => {
     if (currentUserRole && ['manager', 'admin'].includes(currentUserRole)) {
@@ -193,6 +254,96 @@ export default function AdminPage() {
     }
   }, [currentYear, currentMonth]);
 
+  // 管理員即時推送：接收預約、機器、通知的增量更新與彙總計數，直接修改本地資料
+  useEffect(() => {
+    if (!session?.user?.email || !['manager', 'admin'].includes(currentUserRole)) return;
+    if (typeof window === 'undefined' || !('WebSocket' in window)) return;
+
+    let socket: WebSocket | null = null;
+    let reconnectTimer: ReturnType<typeof setTimeout> | null = null;
+    let closedByEffect = false;
+
+    const handleMessage = (event: MessageEvent) => {
+      const message = JSON.parse(event.data);
+      const handlers = liveHandlersRef.current;
+      switch (message.type) {
+        case 'counters':
+          setLiveCounters(message.counters);
+          break;
+        case 'bookings': {
+          const matchesFilter = (booking: BookingDetail) =>
+            !handlers?.statusFilter || handlers.statusFilter.split(',').includes(booking.status);
+          setBookings((prev) => applyLivePatch(prev, message.upserted, message.removed, matchesFilter));
+          setSelectedDateBookings((prev) => applyLivePatch(prev, message.upserted, message.removed));
+          handlers?.refreshMonthlyStats();
+          break;
+        }
+        case 'machines':
+          setMachines((prev) =>
+            applyLivePatch(prev, message.upserted, message.removed, () => true)
+              .sort((a, b) => Number(a.id) - Number(b.id))
+          );
+          break;
+        case 'notifications':
+          setNotifications((prev) => applyLivePatch(prev, message.upserted, message.removed, () => true));
+          break;
+        case 'resync':
+          handlers?.resync(message.table);
+          break;
+        case 'error':
+          console.error('Live channel error:', message.error);
+          break;
+      }
+    };
+
+    const connect = async () => {
+      // 先以管理員身分換取短效票證，網址中不帶管理員郵箱
+      let ticket = '';
+      try {
+        const response = await fetch(API_ENDPOINTS.ADMIN_LIVE_CHANNEL_TICKET, {
+          method: 'POST',
+          headers: {
+            'X-Admin-Email': session?.user?.email || '',
+          },
+        });
+        if (response.ok) {
+          ticket = (await response.json()).ticket || '';
+        }
+      } catch (error) {
+        console.error('Failed to get live channel ticket:', error);
+      }
+      if (closedByEffect) return;
+      if (!ticket) {
+        reconnectTimer = setTimeout(connect, LIVE_CHANNEL_RECONNECT_MS);
+        return;
+      }
+
+      const url = `${API_ENDPOINTS.ADMIN_LIVE_CHANNEL}?ticket=${encodeURIComponent(ticket)}`;
+      socket = new WebSocket(url);
+      socket.onopen = () => {
+        liveConnectedRef.current = true;
+      };
+      socket.onmessage = handleMessage;
+      socket.onclose = () => {
+        liveConnectedRef.current = false;
+        if (!closedByEffect) {
+          // 後端未安裝 flask-sock 時會持續失敗，頁面仍會在操作後重新載入資料
+          reconnectTimer = setTimeout(connect, LIVE_CHANNEL_RECONNECT_MS);
+        }
+      };
+    };
+
+    connect();
+
+    return () => {
+      closedByEffect = true;
+      liveConnectedRef.current = false;
+      if (reconnectTimer) clearTimeout(reconnectTimer);
+      if (liveStatsTimerRef.current) clearTimeout(liveStatsTimerRef.current);
+      socket?.close();
+    };
+  }, [session?.user?.email, currentUserRole]);
+
   // 獲取當前用戶角色
   const fetchCurrentUserRole = async () => {
     try {
@@ -222,17 +373,32 @@ export default function AdminPage() {
     }
   };
 
-  // 獲取所有用戶
-  const fetchUsers = async () => {
-    if (loadingUsers) return; // 防止重複請求
+  // 獲取用戶列表（伺服器端搜尋與游標分頁；傳入 cursor 時接續載入下一頁）
+  const fetchUsers = async (cursor?: string) => {
+    // 載入下一頁時若已有請求進行中則略過；新的搜尋則中止進行中的請求
+    if (cursor && usersRequestRef.current) return;
+    usersRequestRef.current?.abort();
+    const controller = new AbortController();
+    usersRequestRef.current = controller;
     
     setLoadingUsers(true);
     try {
-      // 這裡需要新的API端點來獲取所有用戶
-      const response = await fetch(`${process.env.NEXT_PUBLIC_API_URL || 'http://127.0.0.1:5000'}/admin/users`, {
+      const params = new URLSearchParams({ limit: String(ADMIN_USERS_PAGE_SIZE) });
+      if (userSearchTerm.trim()) {
+        params.append('q', userSearchTerm.trim());
+      }
+      if (roleFilter) {
+        params.append('role', roleFilter);
+      }
+      if (cursor) {
+        params.append('cursor', cursor);
+      }
+      
+      const response = await fetch(`${process.env.NEXT_PUBLIC_API_URL || 'http://127.0.0.1:5000'}/admin/users?${params.toString()}`, {
         headers: {
           'X-Admin-Email': session?.user?.email || '',
         },
+        signal: controller.signal,
       });
       
       if (!response.ok) {
@@ -240,24 +406,43 @@ export default function AdminPage() {
       }
       
       const data = await response.json();
-      setUsers(data.users || []);
+      if (controller.signal.aborted) return;
+      setUsers(prev => cursor ? [...prev, ...(data.users || [])] : (data.users || []));
+      setUsersNextCursor(data.next_cursor || null);
+      if (!cursor) {
+        setUsersTotalEstimate(data.total_estimate ?? null);
+      }
     } catch (error) {
+      // 被較新的搜尋中止的請求不是錯誤
+      if (controller.signal.aborted) return;
       console.error('獲取用戶列表失敗:', error);
       showError('獲取用戶列表失敗');
     } finally {
-      setLoadingUsers(false);
+      // 只有最新的請求結束時才解除載入狀態
+      if (usersRequestRef.current === controller) {
+        usersRequestRef.current = null;
+        setLoadingUsers(false);
+      }
     }
   };
 
-  // 獲取所有預約
-  const fetchBookings = async () => {
+  // 獲取預約（游標分頁，由新到舊；傳入 cursor 時接續載入下一頁）
+  const fetchBookings = async (cursor?: string) => {
     if (loadingBookings) return; // 防止重複請求
     
     setLoadingBookings(true);
     setBookingMessage({type: null, text: '正在獲取預約資料...'});
     
     try {
-      const response = await fetch(`${process.env.NEXT_PUBLIC_API_URL || 'http://127.0.0.1:5000'}/admin/bookings`, {
+      const params = new URLSearchParams({ limit: String(ADMIN_BOOKINGS_PAGE_SIZE) });
+      if (statusFilter) {
+        params.append('status', statusFilter);
+      }
+      if (cursor) {
+        params.append('cursor', cursor);
+      }
+      
+      const response = await fetch(`${process.env.NEXT_PUBLIC_API_URL || 'http://127.0.0.1:5000'}/admin/bookings?${params.toString()}`, {
         headers: {
           'X-Admin-Email': session?.user?.email || '',
         },
@@ -268,7 +453,11 @@ export default function AdminPage() {
       }
       
       const data = await response.json();
-      setBookings(data.bookings || []);
+      setBookings(prev => cursor ? [...prev, ...(data.bookings || [])] : (data.bookings || []));
+      setBookingsNextCursor(data.next_cursor || null);
+      if (!cursor) {
+        setBookingsTotalEstimate(data.total_estimate ?? null);
+      }
       setBookingMessage({type: 'success', text: `成功載入 ${data.bookings?.length || 0} 筆預約資料`});
       
       // 3秒後清除成功訊息
@@ -290,6 +479,49 @@ export default function AdminPage() {
     }
   };
 
+  // 匯出當月預約為 CSV（後端串流輸出）
+  const handleExportBookings = async () => {
+    setBookingMessage({type: null, text: `正在匯出${currentYear}年${currentMonth}月預約資料...`});
+    
+    try {
+      const monthStart = `${currentYear}-${String(currentMonth).padStart(2, '0')}-01T00:00`;
+      const nextMonthYear = currentMonth === 12 ? currentYear + 1 : currentYear;
+      const nextMonth = currentMonth === 12 ? 1 : currentMonth + 1;
+      const monthEnd = `${nextMonthYear}-${String(nextMonth).padStart(2, '0')}-01T00:00`;
+      const params = new URLSearchParams({ format: 'csv', start_time: monthStart, end_time: monthEnd });
+      
+      const response = await fetch(`${process.env.NEXT_PUBLIC_API_URL || 'http://127.0.0.1:5000'}/admin/bookings/export?${params.toString()}`, {
+        headers: {
+          'X-Admin-Email': session?.user?.email || '',
+        },
+      });
+      
+      if (!response.ok) {
+        throw new Error('匯出預約資料失敗');
+      }
+      
+      const blob = await response.blob();
+      const url = URL.createObjectURL(blob);
+      const link = document.createElement('a');
+      link.href = url;
+      link.download = `bookings-${currentYear}-${String(currentMonth).padStart(2, '0')}.csv`;
+      link.click();
+      URL.revokeObjectURL(url);
+      
+      setBookingMessage({type: 'success', text: '預約資料匯出完成'});
+      setTimeout(() => {
+        setBookingMessage({type: null, text: ''});
+      }, 3000);
+    } catch (error) {
+      console.error('匯出預約資料失敗:', error);
+      setBookingMessage({type: 'error', text: '匯出預約資料失敗，請稍後再試'});
+      showError('匯出預約資料失敗');
+      setTimeout(() => {
+        setBookingMessage({type: null, text: ''});
+      }, 5000);
+    }
+  };
+
   // 獲取月度統計
   const fetchMonthlyStats = async (year: number, month: number) => {
     setBookingMessage({type: null, text: `正在載入${year}年${month}月統計資料...`});
@@ -467,7 +699,10 @@ export default function AdminPage() {
       setShowNotificationForm(false);
       setEditingNotification(null);
       resetNotificationForm();
-      await fetchNotifications();
+      // 即時推送連線中會直接收到變更，不需重新載入整張表
+      if (!liveConnectedRef.current) {
+        await fetchNotifications();
+      }
     } catch (error) {
       console.error('保存通知失敗:', error);
       showError(error instanceof Error ? error.message : '保存通知失敗');
@@ -492,7 +727,9 @@ export default function AdminPage() {
       }
 
       showSuccess('通知已成功刪除');
-      await fetchNotifications();
+      if (!liveConnectedRef.current) {
+        await fetchNotifications();
+      }
     } catch (error) {
       console.error('刪除通知失敗:', error);
       showError(error instanceof Error ? error.message : '刪除通知失敗');
@@ -555,7 +792,8 @@ export default function AdminPage() {
       }
 
       showSuccess('用戶角色已成功更新');
-      fetchUsers(); // 重新獲取用戶列表
+      // 只更新該用戶的角色，不重新載入整個列表
+      setUsers(prev => prev.map(user => user.email === userEmail ? { ...user, role: newRole as User['role'] } : user));
     } catch (error) {
       console.error('更新用戶角色失敗:', error);
       showError(error instanceof Error ? error.message : '更新角色失敗');
@@ -808,7 +1046,9 @@ export default function AdminPage() {
       }
 
       await fetchMachineRestrictions(machineId);
-      await fetchMachines(); // 更新限制計數
+      if (!liveConnectedRef.current) {
+        await fetchMachines(); // 更新限制計數
+      }
     } catch (error) {
       console.error('刪除機器限制失敗:', error);
       showError('刪除機器限制失敗');
@@ -861,7 +1101,9 @@ export default function AdminPage() {
 
       setEditingMachine(null);
       setIsCreateMachineModalOpen(false);
-      await fetchMachines();
+      if (!liveConnectedRef.current) {
+        await fetchMachines();
+      }
     } catch (error) {
       console.error('機器操作失敗:', error);
       showError(error instanceof Error ? error.message : '機器操作失敗');
@@ -897,7 +1139,9 @@ export default function AdminPage() {
         showSuccess(`已取消 ${result.cancelled_bookings} 個相關預約`);
       }
       
-      await fetchMachines();
+      if (!liveConnectedRef.current) {
+        await fetchMachines();
+      }
     } catch (error) {
       console.error('刪除機器失敗:', error);
       showError(error instanceof Error ? error.message : '刪除機器失敗');
@@ -938,8 +1182,10 @@ export default function AdminPage() {
       
       showSuccess(`預約已成功刪除！\n${result.details.machine_name} - ${result.details.user_name}`);
       
-      // 重新獲取月度統計資料
-      await fetchMonthlyStats(currentYear, currentMonth);
+      // 重新獲取月度統計資料（即時推送連線中會自動合併刷新）
+      if (!liveConnectedRef.current) {
+        await fetchMonthlyStats(currentYear, currentMonth);
+      }
       
       // 如果當前有選中日期和打開的詳情弹窗，立即更新該日期的預約詳情
       if (selectedDate && showDateDetails) {
@@ -953,6 +1199,30 @@ export default function AdminPage() {
     }
   };
 
+  // 每次渲染更新推送處理需要的最新狀態
+  liveHandlersRef.current = {
+    statusFilter,
+    activeTab,
+    refreshMonthlyStats: () => {
+      if (activeTab !== 'bookings') return;
+      // 合併短時間內的多次變更，只重新計算一次月統計
+      if (liveStatsTimerRef.current) clearTimeout(liveStatsTimerRef.current);
+      liveStatsTimerRef.current = setTimeout(() => {
+        fetchMonthlyStats(currentYear, currentMonth);
+      }, LIVE_STATS_REFRESH_DELAY_MS);
+    },
+    resync: (table: string) => {
+      if (table === 'bookings') {
+        if (bookings.length > 0) fetchBookings();
+        if (activeTab === 'bookings') fetchMonthlyStats(currentYear, currentMonth);
+      } else if (table === 'machines') {
+        fetchMachines();
+      } else if (table === 'notifications') {
+        fetchNotifications();
+      }
+    },
+  };
+
   if (status === 'loading' || isLoading) {
   return (
       <div className="min-h-screen pt-10 pb-10 bg-transparent flex items-center justify-center">
@@ -976,6 +1246,16 @@ export default function AdminPage() {
           <div className="p-6 border-b border-gray-200 dark:border-dark-border">
             <h1 className="text-2xl font-bold text-gray-900 dark:text-dark-text-primary">管理介面</h1>
             <p className="text-gray-600 dark:text-dark-text-secondary mt-1">當前角色：{currentUserRole === 'admin' ? '管理員' : '經理'}</p>
+            {liveCounters && (
+              <div className="flex flex-wrap gap-4 mt-3 text-sm text-gray-600 dark:text-dark-text-secondary">
+                <span>有效預約：{liveCounters.active_bookings}</span>
+                <span>即將使用：{liveCounters.upcoming_bookings}</span>
+                <span>用戶：{liveCounters.total_users}</span>
+                <span>可用機器：{liveCounters.active_machines} / {liveCounters.total_machines}</span>
+                <span>維護中：{liveCounters.maintenance_machines}</span>
+                <span>有效公告：{liveCounters.active_notifications}</span>
+              </div>
+            )}
           </div>
 
           {/* 導航標籤 */}
@@ -1132,6 +1412,24 @@ export default function AdminPage() {
                           <p className="text-gray-500 dark:text-dark-text-secondary">沒有找到符合條件的用戶</p>
                         </div>
                       )}
+                      
+                      {/* 分頁：顯示已載入筆數並載入更多 */}
+                      {filteredUsers.length > 0 && (
+                        <div className="flex items-center justify-between px-6 py-3 border-t border-gray-200 dark:border-dark-border text-sm text-gray-500 dark:text-dark-text-secondary">
+                          <span>
+                            已載入 {users.length} 位用戶{usersTotalEstimate !== null ? `（約 ${usersTotalEstimate} 位）` : ''}
+                          </span>
+                          {usersNextCursor && (
+                            <button
+                              onClick={() => fetchUsers(usersNextCursor)}
+                              className="px-3 py-1 border-2 border-gray-300 dark:border-dark-border rounded-md hover:bg-gray-50 dark:hover:bg-dark-bg-primary text-gray-900 dark:text-dark-text-primary transition-all duration-200"
+                              disabled={loadingUsers}
+                            >
+                              載入更多
+                            </button>
+                          )}
+                        </div>
+                      )}
                     </>
                   )}
                 </div>
@@ -1226,6 +1524,15 @@ export default function AdminPage() {
                       )}
                       <span>{loadingBookings ? '載入中' : '重新載入'}</span>
                     </button>
+                    
+                    {/* 匯出按鈕 */}
+                    <button 
+                      onClick={handleExportBookings}
+                      className="px-3 py-2 bg-white dark:bg-dark-bg-secondary border-2 border-gray-300 dark:border-dark-border text-sm font-medium text-gray-900 dark:text-dark-text-primary rounded-md hover:bg-gray-50 dark:hover:bg-dark-bg-primary disabled:opacity-50 disabled:cursor-not-allowed hover:border-dark-accent/40 transition-all duration-200"
+                      disabled={loadingBookings}
+                    >
+                      匯出 CSV
+                    </button>
                   </div>
                 </div>
 
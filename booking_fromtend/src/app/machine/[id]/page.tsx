@@ -6,7 +6,7 @@ import NotificationManager from '@/components/NotificationManager';
 import TimeSlotSelector from '@/components/TimeSlotSelector';
 import { TimeSlot, Machine } from '@/types';
 import { useRouter } from 'next/navigation';
-import { useState, useMemo, useEffect } from 'react';
+import { useState, useMemo, useEffect, useRef } from 'react';
 import { format, addDays, startOfDay, endOfDay, isWithinInterval, addWeeks, subWeeks, startOfWeek, isSameDay, endOfWeek, isBefore, isAfter } from 'date-fns';
 import { zhTW } from 'date-fns/locale';
 import DatePicker from 'react-datepicker';
@@ -64,6 +64,7 @@ export default function MachinePage({ params }: { params: { id: string } }) {
   const setMachines = useMachineStore((state) => state.setMachines);
   const [isLoading, setIsLoading] = useState(true);
   const [bookedSlots, setBookedSlots] = useState<string[]>([]);
+  const [pendingSlots, setPendingSlots] = useState<string[]>([]); // 其他用戶確認預約中的時段
   const [isRefreshing, setIsRefreshing] = useState(false);
   const [bookingDetails, setBookingDetails] = useState<any[]>([]);
   const [currentUserEmail, setCurrentUserEmail] = useState<string>('');
@@ -75,6 +76,7 @@ export default function MachinePage({ params }: { params: { id: string } }) {
   const [cooldownSlots, setCooldownSlots] = useState<string[]>([]); // 新增：冷卻期時間段
   const [usageInfo, setUsageInfo] = useState<any>(null); // 修改：使用情況信息
   const [machineRestrictions, setMachineRestrictions] = useState<any[]>([]); // 新增：機器限制規則
+  const bootstrappedMachineIdRef = useRef<string | null>(null); // 啟動資料已載入的機器，避免重複請求預約數據
   
   // 使用新的通知管理系統
   const { notifications, removeNotification, showSuccess, showError } = useNotifications();
@@ -99,6 +101,50 @@ export default function MachinePage({ params }: { params: { id: string } }) {
   console.log('Available machines:', machines.map(m => ({ id: m.id, idType: typeof m.id, name: m.name })));
   console.log('Found machine:', finalMachine);
 
+  // 套用預約時段 API 的回應內容
+  const applyBookingsResponse = (response: any, userEmail: string) => {
+    // 處理新的API響應格式
+    if (response && typeof response === 'object' && !Array.isArray(response) && 
+        'bookedSlots' in response && 'bookingDetails' in response) {
+      // 新格式：包含詳細預約信息和冷卻期數據
+      const typedResponse = response as any;
+      setBookedSlots(typedResponse.bookedSlots || []);
+      setPendingSlots(typedResponse.pendingSlots || []);
+      setBookingDetails(typedResponse.bookingDetails || []);
+      setCurrentUserEmail(typedResponse.currentUserEmail || userEmail);
+      setCooldownSlots(typedResponse.cooldownSlots || []); // 新增：設置冷卻期時間段
+      setUsageInfo(typedResponse.usageInfo || null); // 新增：設置使用情況信息
+      console.log('Using new format with booking details and cooldown data');
+      console.log('Current user email from API:', typedResponse.currentUserEmail);
+      console.log('Cooldown slots:', typedResponse.cooldownSlots);
+      console.log('Usage info:', typedResponse.usageInfo);
+    } else if (Array.isArray(response)) {
+      // 舊格式：只有時間段數組
+      const slots = response.map((booking: any) => {
+        if (typeof booking === 'object' && booking.time_slot) {
+          return booking.time_slot;
+        }
+        return booking;
+      });
+      console.log('Final processed slots:', slots);
+      setBookedSlots(slots);
+      setPendingSlots([]);
+      setBookingDetails([]);
+      setCooldownSlots([]);
+      setUsageInfo(null);
+      setCurrentUserEmail(userEmail);
+      console.log('Using legacy format - slots only');
+    } else {
+      console.log('Unknown response format:', response);
+      setBookedSlots([]);
+      setPendingSlots([]);
+      setBookingDetails([]);
+      setCooldownSlots([]);
+      setUsageInfo(null);
+      setCurrentUserEmail(userEmail);
+    }
+  };
+
   // 獲取機器的預約時段
   const fetchBookedSlots = async (showRefreshIndicator = false) => {
     if (finalMachine) {
@@ -115,43 +161,7 @@ export default function MachinePage({ params }: { params: { id: string } }) {
         const response = await api.bookings.getMachineBookings(finalMachine.id, userEmail);
         console.log('Raw bookings response:', response);
         
-        // 處理新的API響應格式
-        if (response && typeof response === 'object' && !Array.isArray(response) && 
-            'bookedSlots' in response && 'bookingDetails' in response) {
-          // 新格式：包含詳細預約信息和冷卻期數據
-          const typedResponse = response as any;
-          setBookedSlots(typedResponse.bookedSlots || []);
-          setBookingDetails(typedResponse.bookingDetails || []);
-          setCurrentUserEmail(typedResponse.currentUserEmail || userEmail);
-          setCooldownSlots(typedResponse.cooldownSlots || []); // 新增：設置冷卻期時間段
-          setUsageInfo(typedResponse.usageInfo || null); // 新增：設置使用情況信息
-          console.log('Using new format with booking details and cooldown data');
-          console.log('Current user email from API:', typedResponse.currentUserEmail);
-          console.log('Cooldown slots:', typedResponse.cooldownSlots);
-          console.log('Usage info:', typedResponse.usageInfo);
-        } else if (Array.isArray(response)) {
-          // 舊格式：只有時間段數組
-          const slots = response.map((booking: any) => {
-            if (typeof booking === 'object' && booking.time_slot) {
-              return booking.time_slot;
-            }
-            return booking;
-          });
-          console.log('Final processed slots:', slots);
-          setBookedSlots(slots);
-          setBookingDetails([]);
-          setCooldownSlots([]);
-          setUsageInfo(null);
-          setCurrentUserEmail(userEmail);
-          console.log('Using legacy format - slots only');
-        } else {
-          console.log('Unknown response format:', response);
-          setBookedSlots([]);
-          setBookingDetails([]);
-          setCooldownSlots([]);
-          setUsageInfo(null);
-          setCurrentUserEmail(userEmail);
-        }
+        applyBookingsResponse(response, userEmail);
         
         // 更新最後刷新時間
         setLastRefreshTime(getTaipeiNow());
@@ -169,6 +179,58 @@ export default function MachinePage({ params }: { params: { id: string } }) {
     }
   };
 
+  // 套用預約變更（差異同步），只更新受影響的時段
+  const applyBookingChanges = (changes: Awaited<ReturnType<typeof api.bookings.getChanges>>['changes']) => {
+    if (changes.length === 0) return;
+
+    const removedIds = new Set<string>();
+    const releasedSlots = new Set<string>();
+    const activeChanges = new Map<string, (typeof changes)[number]>();
+
+    changes.forEach((change) => {
+      if (change.status === 'active' && change.change_type !== 'deleted') {
+        removedIds.delete(change.booking_id);
+        releasedSlots.delete(change.time_slot);
+        activeChanges.set(change.booking_id, change);
+      } else {
+        activeChanges.delete(change.booking_id);
+        removedIds.add(change.booking_id);
+        releasedSlots.add(change.time_slot);
+      }
+    });
+
+    setBookingDetails((prev) => {
+      const next = prev.filter((detail) => !removedIds.has(String(detail.id)) && !activeChanges.has(String(detail.id)));
+      activeChanges.forEach((change) => {
+        next.push({
+          id: change.booking_id,
+          user_email: change.user_email,
+          user_display_name: '',
+          time_slot: change.time_slot,
+          status: change.status,
+          machine_id: change.machine_id,
+          created_at: change.changed_at,
+        });
+      });
+      return next;
+    });
+
+    setBookedSlots((prev) => {
+      const slots = new Set(prev.filter((slot) => !releasedSlots.has(slot)));
+      activeChanges.forEach((change) => slots.add(change.time_slot));
+      return Array.from(slots).sort();
+    });
+
+    // 保留中的時段已成為預約，改以預約狀態顯示
+    const bookedChangeSlots = new Set(Array.from(activeChanges.values()).map((change) => change.time_slot));
+    setPendingSlots((prev) => prev.filter((slot) => !bookedChangeSlots.has(slot)));
+
+    // 自己的預約有變動時，使用次數等資訊需要重新計算
+    if (changes.some((change) => change.is_mine)) {
+      fetchBookedSlots(false);
+    }
+  };
+
   // 處理預約成功後的刷新
   const handleBookingSuccess = () => {
     console.log('Booking successful, refreshing data...');
@@ -309,66 +371,6 @@ export default function MachinePage({ params }: { params: { id: string } }) {
     }
   };
 
-  // 獲取機器限制規則
-  const fetchMachineRestrictions = async () => {
-    if (finalMachine) {
-      try {
-        const userEmail = session?.user?.email || '';
-        console.log('Fetching machine restrictions for machine:', finalMachine.id);
-        
-        const response = await fetch(`${process.env.NEXT_PUBLIC_API_URL}/machines/${finalMachine.id}/restrictions`, {
-          method: 'GET',
-          headers: {
-            'Content-Type': 'application/json',
-            'X-Admin-Email': userEmail, // 以管理員身份請求
-          },
-        });
-        
-        if (response.ok) {
-          const result = await response.json();
-          const restrictions = result.restrictions || [];
-          setMachineRestrictions(restrictions);
-          console.log('Machine restrictions loaded:', restrictions);
-        } else {
-          // 非管理員或無權限，嘗試從使用狀態API獲取基本限制信息
-          console.log('No admin access, trying usage status API...');
-          const statusResponse = await fetch(`${process.env.NEXT_PUBLIC_API_URL}/machines/${finalMachine.id}/usage-status`, {
-            method: 'GET',
-            headers: {
-              'Content-Type': 'application/json',
-              'X-User-Email': userEmail,
-            },
-          });
-          
-          if (statusResponse.ok) {
-            const statusResult = await statusResponse.json();
-            if (statusResult.has_usage_limit) {
-              // 從使用狀態API構建限制信息
-              const usageLimitInfo = {
-                restriction_type: 'usage_limit',
-                restriction_rule: JSON.stringify({
-                  max_usages: statusResult.max_usages,
-                  cooldown_period_hours: statusResult.cooldown_period_hours,
-                  description: `連續使用${statusResult.max_usages}次後冷卻${statusResult.cooldown_period_slots}個時間段（${statusResult.cooldown_period_hours}小時），期間完全無法使用`
-                }),
-                is_active: true
-              };
-              setMachineRestrictions([usageLimitInfo]);
-              console.log('Usage limit info from status API:', usageLimitInfo);
-            } else {
-              setMachineRestrictions([]);
-            }
-          } else {
-            setMachineRestrictions([]);
-          }
-        }
-      } catch (error) {
-        console.error('Failed to fetch machine restrictions:', error);
-        setMachineRestrictions([]);
-      }
-    }
-  };
-
   const isWeekWithinRange = (date: Date) => {
     const weekStart = startOfWeek(date, { weekStartsOn: 1 });
     const weekEnd = endOfWeek(date, { weekStartsOn: 1 });
@@ -457,8 +459,9 @@ export default function MachinePage({ params }: { params: { id: string } }) {
         setAccessCheckCompleted(false); // 開始檢查權限
         console.log('Checking access for machine:', params.id, 'user:', userEmail);
         
-        // 第一層檢查：API權限檢查
-        const accessResult = await api.machines.checkAccess(params.id, userEmail);
+        // 第一層檢查：API權限檢查（啟動資料一次取回權限、機器、預約與限制規則）
+        const bootstrap = await api.machines.getBootstrap(params.id, userEmail);
+        const accessResult = bootstrap.access;
         console.log('API access check result:', accessResult);
         
         if (!accessResult.allowed) {
@@ -478,12 +481,11 @@ export default function MachinePage({ params }: { params: { id: string } }) {
         console.log('API check passed, performing client-side restrictions check...');
         
         try {
-          // 獲取機器及其restrictions資訊
-          const machinesWithRestrictions = await api.machines.getAllWithRestrictions(userEmail);
-          const targetMachine = machinesWithRestrictions.find(m => 
-            String(m.id) === String(params.id) || 
-            Number(m.id) === Number(params.id)
-          );
+          // 機器及其restrictions資訊來自啟動資料
+          const targetMachine = bootstrap.machine && {
+            ...bootstrap.machine,
+            restrictions: (bootstrap.restrictions?.restrictions || []).filter(r => r.is_active)
+          };
           
           if (!targetMachine) {
             console.log('Machine not found in restrictions check');
@@ -541,7 +543,16 @@ export default function MachinePage({ params }: { params: { id: string } }) {
           showError('權限驗證警告：無法完全驗證機器限制，請注意使用');
         }
         
-        // 權限檢查通過
+        // 權限檢查通過，直接套用啟動資料
+        if (bootstrap.machines && bootstrap.machines.length > 0) {
+          setMachines(bootstrap.machines);
+        }
+        applyBookingsResponse(bootstrap.bookings, userEmail);
+        setMachineRestrictions(bootstrap.restrictions?.restrictions || []);
+        setLastRefreshTime(getTaipeiNow());
+        setNextRefreshCountdown(10 * 60);
+        bootstrappedMachineIdRef.current = String(params.id);
+        
         setAccessDenied(null);
         setAccessCheckCompleted(true);
         console.log('Access granted for machine:', params.id);
@@ -563,7 +574,7 @@ export default function MachinePage({ params }: { params: { id: string } }) {
 
     // 只要session状态有变化就重新检查权限
     checkAccess();
-  }, [session, params.id, router, showError]);
+  }, [session, params.id, router, showError, setMachines]);
 
   // 如果權限檢查完成但沒有找到機器，且機器列表為空，重新觸發載入
   useEffect(() => {
@@ -621,6 +632,45 @@ export default function MachinePage({ params }: { params: { id: string } }) {
     };
   }, [finalMachine?.id]);
 
+  // 即時同步 - 訂閱此機器的預約變更串流，只套用有變動的時段
+  useEffect(() => {
+    if (!finalMachine?.id || !accessCheckCompleted || accessDenied) return;
+    if (typeof window === 'undefined' || !('EventSource' in window)) return;
+
+    const source = api.bookings.openChangeStream({
+      user_email: session?.user?.email || '',
+      machine_ids: [String(finalMachine.id)],
+    });
+
+    const handleBookings = (event: MessageEvent) => {
+      try {
+        const payload = JSON.parse(event.data);
+        applyBookingChanges(payload.changes || []);
+        setLastRefreshTime(getTaipeiNow());
+      } catch (error) {
+        console.error('Failed to apply booking changes:', error);
+      }
+    };
+
+    // 斷線過久、變更記錄已超過保留期限時，改為重新載入完整資料
+    const handleResync = () => {
+      fetchBookedSlots(false);
+    };
+
+    source.addEventListener('bookings', handleBookings as EventListener);
+    source.addEventListener('resync', handleResync);
+    source.onerror = () => {
+      // 瀏覽器會依伺服器指定的間隔自動重連，並帶上 Last-Event-ID 補送變更
+      console.warn('Booking stream disconnected, reconnecting...');
+    };
+
+    return () => {
+      source.removeEventListener('bookings', handleBookings as EventListener);
+      source.removeEventListener('resync', handleResync);
+      source.close();
+    };
+  }, [finalMachine?.id, accessCheckCompleted, accessDenied, session?.user?.email]);
+
   // 倒計時更新 - 每秒更新一次
   useEffect(() => {
     const countdownInterval = setInterval(() => {
@@ -655,22 +705,18 @@ export default function MachinePage({ params }: { params: { id: string } }) {
     };
   }, [finalMachine?.id, lastRefreshTime]);
 
-  useEffect(() => {
-    fetchBookedSlots();
-  }, [finalMachine?.id]);
-
   // 當選中日期改變時，重新獲取預約數據
   useEffect(() => {
-    if (finalMachine?.id) {
+    if (finalMachine?.id && accessCheckCompleted && !accessDenied) {
+      // 啟動資料剛載入過此機器的預約，不需要再請求一次
+      if (bootstrappedMachineIdRef.current === String(finalMachine.id)) {
+        bootstrappedMachineIdRef.current = null;
+        return;
+      }
       console.log('Selected date changed, refreshing booking data...');
       fetchBookedSlots(false); // 不顯示刷新指示器，避免過於頻繁的視覺變化
     }
-  }, [selectedDate, finalMachine?.id]);
-
-  // 獲取機器限制規則
-  useEffect(() => {
-    fetchMachineRestrictions();
-  }, [finalMachine?.id]);
+  }, [selectedDate, finalMachine?.id, accessCheckCompleted, accessDenied]);
 
   // 如果權限檢查未完成，顯示載入狀態
   if (!accessCheckCompleted) {
@@ -1046,6 +1092,7 @@ export default function MachinePage({ params }: { params: { id: string } }) {
                   selectedDate={selectedDate}
                   onSelect={setSelectedSlot}
                   bookedSlots={bookedSlots}
+                  pendingSlots={pendingSlots}
                   bookingDetails={bookingDetails}
                   currentUserEmail={currentUserEmail}
                   onShowCancelConfirm={handleShowCancelConfirm}
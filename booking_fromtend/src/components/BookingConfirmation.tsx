@@ -1,7 +1,7 @@
 'use client';
 
 import { Dialog, Transition } from '@headlessui/react';
-import { Fragment, useState } from 'react';
+import { Fragment, useEffect, useRef, useState } from 'react';
 import { Machine, TimeSlot } from '@/types';
 import { format, parse } from 'date-fns';
 import { zhTW } from 'date-fns/locale';
@@ -26,8 +26,55 @@ export default function BookingConfirmation({
   onShowNotification,
 }: BookingConfirmationProps) {
   const [isSubmitting, setIsSubmitting] = useState(false);
+  const [holdSeconds, setHoldSeconds] = useState<number | null>(null); // 時段暫留的有效秒數
+  const holdTokenRef = useRef<string | null>(null);
+  const bookedRef = useRef(false);
   const { data: session } = useSession();
 
+  // 開啟確認視窗時先暫留時段，避免確認期間被其他用戶搶先；關閉而未預約時釋放
+  useEffect(() => {
+    const userEmail = session?.user?.email;
+    if (!userEmail) return;
+
+    let cancelled = false;
+    const parts = selectedSlot.id.split('-');
+    const slotDate = parse(`${parts[0]}-${parts[1]}-${parts[2]} ${parts[3]}`, 'yyyy-MM-dd HH:mm', new Date());
+
+    api.bookings.createHold({
+      user_email: userEmail,
+      machine_id: machine.id,
+      time_slots: [slotDate],
+    }).then((hold) => {
+      if (cancelled) {
+        api.bookings.releaseHold(hold.hold_token).catch(() => {});
+        return;
+      }
+      holdTokenRef.current = hold.hold_token;
+      setHoldSeconds(hold.ttl_seconds);
+    }).catch((error) => {
+      if (cancelled) return;
+      // 時段已被佔用或在維護窗口內時直接結束確認；其他錯誤不影響預約流程，正式預約時後端仍會檢查
+      if (error instanceof ApiError && (error.error_type === 'slot_held' || error.error_type === 'time_slot_occupied')) {
+        onShowNotification?.('error', error.error_type === 'slot_held' ? '此時段正由其他用戶確認預約中' : '此時段已被預約');
+        onClose();
+        onBookingSuccess?.();
+      } else if (error instanceof ApiError && error.error_type === 'machine_maintenance') {
+        onShowNotification?.('error', error.message);
+        onClose();
+      } else {
+        console.error('Failed to hold time slot:', error);
+      }
+    });
+
+    return () => {
+      cancelled = true;
+      if (holdTokenRef.current && !bookedRef.current) {
+        api.bookings.releaseHold(holdTokenRef.current).catch(() => {});
+      }
+      holdTokenRef.current = null;
+    };
+  }, [machine.id, selectedSlot.id, session?.user?.email]);
+
   const handleConfirm = async () => {
     if (!session?.user?.email) {
       onShowNotification?.('error', '請先登入');
@@ -70,6 +117,7 @@ export default function BookingConfirmation({
       };
 
       const result = await api.bookings.create(requestData);
+      bookedRef.current = true; // 預約成功時後端已消耗暫留，不需再釋放
 
       // 使用回調函數顯示成功通知
       onShowNotification?.('success', '預約成功');
@@ -94,12 +142,18 @@ export default function BookingConfirmation({
           case 'time_slot_occupied':
             errorMessage = '此時段已被預約';
             break;
+          case 'slot_held':
+            errorMessage = '此時段正由其他用戶確認預約中';
+            break;
           case 'usage_limit_exceeded':
             errorMessage = error.message;
             break;
           case 'machine_unavailable':
             errorMessage = error.message;
             break;
+          case 'machine_maintenance':
+            errorMessage = error.message;
+            break;
           case 'machine_restricted':
             errorMessage = error.message;
             break;
@@ -217,6 +271,11 @@ export default function BookingConfirmation({
                   <p className="text-sm text-gray-500 dark:text-gray-400">
                     您即將預約以下時段，請確認預約資訊無誤。
                   </p>
+                  {holdSeconds !== null && (
+                    <p className="mt-1 text-xs text-green-600 dark:text-green-400">
+                      已為您保留此時段 {holdSeconds} 秒，請盡快確認。
+                    </p>
+                  )}
                 </div>
 
                 {/* 預約詳情表格 */}
@@ -18,6 +18,7 @@ interface TimeSlotSelectorProps {
   selectedDate: Date;
   onSelect: (slot: TimeSlot | any) => void;
   bookedSlots?: string[];
+  pendingSlots?: string[]; // 其他用戶確認預約中的時段
   bookingDetails?: any[];
   currentUserEmail?: string;
   onShowCancelConfirm?: (bookingDetail: any) => void;
@@ -42,6 +43,7 @@ export default function TimeSlotSelector({
   selectedDate,
   onSelect,
   bookedSlots = [],
+  pendingSlots = [],
   bookingDetails = [],
   currentUserEmail,
   onShowCancelConfirm,
@@ -99,6 +101,8 @@ export default function TimeSlotSelector({
       return;
     }
 
+    if (pendingSlots.includes(slotId)) return;
+
     setSelectedSlotId(slotId);
     onSelect({
       id: slotId,
@@ -155,6 +159,10 @@ export default function TimeSlotSelector({
       };
     }
 
+    if (pendingSlots.includes(slotId)) {
+      return { status: '保留中', disabled: true, isOwnBooking: false, isOthersBooking: false };
+    }
+
     return { status: '可預約', disabled: false, isOwnBooking: false, isOthersBooking: false };
   };
 
@@ -201,6 +209,8 @@ export default function TimeSlotSelector({
                       disabled
                         ? status === '冷卻中'
                           ? 'cursor-not-allowed border-2 border-orange-300 bg-orange-100 text-orange-600 dark:border-orange-500 dark:bg-orange-900/30 dark:text-orange-300'
+                          : status === '保留中'
+                          ? 'cursor-not-allowed border-2 border-yellow-300 bg-yellow-50 text-yellow-700 dark:border-yellow-500 dark:bg-yellow-900/30 dark:text-yellow-300'
                           : isOwnBooking
                           ? 'cursor-pointer border-2 border-blue-300 bg-blue-100 text-blue-700 dark:border-blue-400 dark:bg-blue-900/30 dark:text-blue-200'
                           : isOthersBooking
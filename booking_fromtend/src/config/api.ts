@@ -10,9 +10,18 @@ export const API_ENDPOINTS = {
   // Machines
   MACHINES: `${API_URL}/machines`,
   MACHINE_RESTRICTIONS_ALL: `${API_URL}/machines/restrictions/all`,
+  MACHINE_AVAILABILITY: `${API_URL}/machines/availability`,
+  MACHINE_BOOTSTRAP: (machineId: string, startDate: string, endDate: string) =>
+    `${API_URL}/machines/${machineId}/bootstrap?start_date=${startDate}&end_date=${endDate}`,
   
   // Bookings
   BOOKINGS: `${API_URL}/bookings`,
+  BOOKINGS_BATCH: `${API_URL}/bookings/batch`,
+  BOOKINGS_AVAILABLE_SEARCH: `${API_URL}/bookings/available-search`,
+  BOOKING_CHANGES: `${API_URL}/bookings/changes`,
+  BOOKING_STREAM: `${API_URL}/bookings/stream`,
+  BOOKING_HOLDS: `${API_URL}/bookings/holds`,
+  BOOKING_HOLD_BY_TOKEN: (token: string) => `${API_URL}/bookings/holds/${encodeURIComponent(token)}`,
   BOOKING_BY_ID: (id: string) => `${API_URL}/bookings/${id}`,
   MACHINE_BOOKINGS: (machineId: string, startDate: string, endDate: string) => 
     `${API_URL}/bookings/machine/${machineId}?start_date=${startDate}&end_date=${endDate}`,
@@ -23,4 +32,7 @@ export const API_ENDPOINTS = {
   
   // Admin
   ADMIN_DELETE_BOOKING: (id: string) => `${API_URL}/admin/bookings/${id}`,
+  // 管理員即時推送（WebSocket，需後端安裝 flask-sock）
+  ADMIN_LIVE_CHANNEL: `${API_URL.replace(/^http/, 'ws')}/admin/ws`,
+  ADMIN_LIVE_CHANNEL_TICKET: `${API_URL}/admin/ws/ticket`,
 }; 
\ No newline at end of file
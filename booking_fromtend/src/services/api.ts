@@ -3,6 +3,7 @@ import { API_ENDPOINTS } from '@/config/api';
 import { addDays, subDays, format } from 'date-fns';
 import { 
   getTaipeiNow, 
+  formatTaipeiTime,
   formatTimeSlotForBackend, 
   formatDateTimeForBackend 
 } from '@/lib/timezone';
@@ -71,6 +72,72 @@ const fetchWithAuth = async (url: string, options: RequestInit = {}) => {
   return response.json();
 };
 
+// 產生冪等鍵：同一次預約操作的重試使用相同鍵值，後端會回放第一次的結果
+const createIdempotencyKey = (): string => {
+  if (typeof crypto !== 'undefined' && typeof crypto.randomUUID === 'function') {
+    return crypto.randomUUID();
+  }
+  return `${Date.now()}-${Math.random().toString(36).slice(2)}`;
+};
+
+// 網路錯誤或伺服器暫時無法處理時，帶相同冪等鍵重送的次數
+const IDEMPOTENT_RETRY_COUNT = 2;
+const IDEMPOTENT_RETRY_DELAY_MS = 1000;
+
+// 帶冪等鍵送出寫入請求，連線失敗或 409 處理中時以相同鍵值重試
+const fetchIdempotent = async (url: string, options: RequestInit, idempotencyKey: string) => {
+  for (let attempt = 0; ; attempt++) {
+    try {
+      return await fetchWithAuth(url, {
+        ...options,
+        headers: {
+          ...options.headers,
+          'Idempotency-Key': idempotencyKey,
+        },
+      });
+    } catch (error) {
+      const retryable =
+        !(error instanceof ApiError) ||
+        error.error_type === 'network_error' ||
+        error.error_type === 'idempotency_in_progress';
+      if (!retryable || attempt >= IDEMPOTENT_RETRY_COUNT) {
+        throw error;
+      }
+      await new Promise((resolve) => setTimeout(resolve, IDEMPOTENT_RETRY_DELAY_MS * (attempt + 1)));
+    }
+  }
+};
+
+// 將欄式回應（format=columnar，{欄位: [值...]}）還原為物件陣列
+const expandColumnar = <T extends Record<string, any>>(columns: Record<string, any[]>): T[] => {
+  const keys = Object.keys(columns || {});
+  const length = keys.length > 0 ? columns[keys[0]].length : 0;
+  const records: T[] = [];
+  for (let i = 0; i < length; i++) {
+    const record: Record<string, any> = {};
+    keys.forEach((key) => {
+      record[key] = columns[key][i];
+    });
+    records.push(record as T);
+  }
+  return records;
+};
+
+// 月份可用性點陣圖：第 index 個時段是否已被預約（低位在前）
+export const isSlotBooked = (bitmap: Uint8Array, index: number): boolean => {
+  return (bitmap[index >> 3] & (1 << (index & 7))) !== 0;
+};
+
+// 將 base64 點陣圖解碼為位元組陣列
+export const decodeAvailabilityBitmap = (encoded: string): Uint8Array => {
+  const binary = atob(encoded);
+  const bytes = new Uint8Array(binary.length);
+  for (let i = 0; i < binary.length; i++) {
+    bytes[i] = binary.charCodeAt(i);
+  }
+  return bytes;
+};
+
 // 格式化日期時間為 "YYYY-MM-DD HH:mm:ss" (已棄用，使用台北時區版本)
 const formatDateTime = (date: Date): string => {
   return formatDateTimeForBackend(date);
@@ -113,6 +180,50 @@ export const api = {
       });
     },
 
+    // 機器頁面啟動資料：一次取得預約時段、限制規則、使用狀態、訪問權限與機器列表
+    getBootstrap: async (machineId: string, userEmail: string): Promise<{
+      machine: Machine;
+      access: { allowed: boolean; reason?: string; machine_name?: string };
+      bookings: any;
+      restrictions: { restrictions: MachineRestriction[]; total: number; machine_id: string };
+      usageStatus: any;
+      machines: Machine[];
+    }> => {
+      const today = getTaipeiNow(); // 使用台北時間
+      const startDate = format(subDays(today, 1), 'yyyy-MM-dd');
+      const endDate = format(addDays(today, 60), 'yyyy-MM-dd');
+
+      return fetchWithAuth(API_ENDPOINTS.MACHINE_BOOTSTRAP(machineId, startDate, endDate), {
+        headers: {
+          'X-User-Email': userEmail,
+        },
+      });
+    },
+
+    // 獲取多台機器整月的佔用點陣圖（每個時段 1 bit）
+    getAvailability: async (params: {
+      year: number;
+      month: number;
+      machineIds?: string[];
+    }): Promise<{
+      year: number;
+      month: number;
+      start: string;
+      slot_hours: number;
+      slot_count: number;
+      bit_order: 'lsb';
+      version: string;
+      machines: { machine_id: string; bitmap: string; version: string; booked_count: number }[];
+    }> => {
+      const url = new URL(API_ENDPOINTS.MACHINE_AVAILABILITY);
+      url.searchParams.append('year', String(params.year));
+      url.searchParams.append('month', String(params.month));
+      if (params.machineIds && params.machineIds.length > 0) {
+        url.searchParams.append('machine_ids', params.machineIds.join(','));
+      }
+      return fetchWithAuth(url.toString());
+    },
+
     // 獲取單個機器限制規則
     getRestrictions: async (machineId: string, userEmail?: string): Promise<MachineRestriction[]> => {
       const { API_URL } = await import('@/config/api');
@@ -228,8 +339,14 @@ export const api = {
           url.searchParams.append('machine_ids', id);
         });
       }
-      
-      return fetchWithAuth(url.toString());
+
+      // 以欄式格式傳輸，減少月視圖的資料量
+      url.searchParams.append('format', 'columnar');
+      const response = await fetchWithAuth(url.toString());
+      return {
+        ...response,
+        bookings: expandColumnar(response.bookings),
+      };
     },
 
     // 創建預約
@@ -237,6 +354,7 @@ export const api = {
       user_email: string;
       machine_id: string;
       time_slot: Date;
+      idempotency_key?: string;
     }): Promise<{ booking_id: number; status: string }> => {
       // 驗證時段是否為有效的 4 小時區塊
       const hour = params.time_slot.getHours();
@@ -253,12 +371,175 @@ export const api = {
         status: 'active',
       };
       
-      return fetchWithAuth(API_ENDPOINTS.BOOKINGS, {
+      return fetchIdempotent(API_ENDPOINTS.BOOKINGS, {
+        method: 'POST',
+        body: JSON.stringify(requestBody),
+      }, params.idempotency_key || createIdempotencyKey());
+    },
+
+    // 批量預約同一台機器的多個時段（全部成功或全部失敗）
+    createBatch: async (params: {
+      user_email: string;
+      machine_id: string;
+      time_slots: Date[];
+      idempotency_key?: string;
+    }): Promise<{ booking_ids: number[]; status: string }> => {
+      const invalidSlot = params.time_slots.find(
+        (slot) => ![0, 4, 8, 12, 16, 20].includes(slot.getHours())
+      );
+      if (invalidSlot) {
+        throw new Error('時段必須為 4 小時區塊：00:00, 04:00, 08:00, 12:00, 16:00, 20:00');
+      }
+
+      const now = getTaipeiNow(); // 使用台北時間
+      const requestBody = {
+        user_email: params.user_email,
+        machine_id: params.machine_id,
+        time_slots: params.time_slots.map((slot) => formatTimeSlotForBackend(slot)),
+        created_at: formatDateTimeForBackend(now),
+      };
+
+      return fetchIdempotent(API_ENDPOINTS.BOOKINGS_BATCH, {
         method: 'POST',
         body: JSON.stringify(requestBody),
+      }, params.idempotency_key || createIdempotencyKey());
+    },
+
+    // 暫留時段：開啟預約確認時呼叫，其他用戶會看到「保留中」，正式預約時自動消耗
+    createHold: async (params: {
+      user_email: string;
+      machine_id: string;
+      time_slots: Date[];
+    }): Promise<{
+      hold_token: string;
+      machine_id: string;
+      time_slots: string[];
+      expires_at: string;
+      ttl_seconds: number;
+    }> => {
+      return fetchWithAuth(API_ENDPOINTS.BOOKING_HOLDS, {
+        method: 'POST',
+        body: JSON.stringify({
+          user_email: params.user_email,
+          machine_id: params.machine_id,
+          time_slots: params.time_slots.map((slot) => formatTimeSlotForBackend(slot)),
+        }),
       });
     },
 
+    // 釋放時段暫留（關閉確認視窗而未預約時）
+    releaseHold: async (holdToken: string): Promise<void> => {
+      return fetchWithAuth(API_ENDPOINTS.BOOKING_HOLD_BY_TOKEN(holdToken), {
+        method: 'DELETE',
+      });
+    },
+
+    // 跨機器搜尋最早可預約的連續時段
+    searchAvailable: async (params: {
+      user_email: string;
+      duration?: number;
+      start_time?: Date;
+      machine_ids?: string[];
+      horizon_days?: number;
+      limit?: number;
+    }): Promise<{
+      results: {
+        machine_id: string;
+        machine_name: string;
+        machine_status: string;
+        start_time: string;
+        end_time: string;
+        time_slots: string[];
+        rolling_window: { window_size: number; max_bookings: number } | null;
+      }[];
+      total: number;
+      excluded_machines: { machine_id: string; reason: string }[];
+    }> => {
+      const url = new URL(API_ENDPOINTS.BOOKINGS_AVAILABLE_SEARCH);
+      url.searchParams.append('duration', String(params.duration || 1));
+      if (params.start_time) {
+        // 使用 datetime-local 格式，後端會視為台北時間
+        url.searchParams.append('start_time', formatTaipeiTime(params.start_time, "yyyy-MM-dd'T'HH:mm"));
+      }
+      if (params.machine_ids && params.machine_ids.length > 0) {
+        url.searchParams.append('machine_ids', params.machine_ids.join(','));
+      }
+      if (params.horizon_days) {
+        url.searchParams.append('horizon_days', String(params.horizon_days));
+      }
+      if (params.limit) {
+        url.searchParams.append('limit', String(params.limit));
+      }
+
+      return fetchWithAuth(url.toString(), {
+        headers: {
+          'X-User-Email': params.user_email,
+        },
+      });
+    },
+
+    // 取得游標之後的預約變更（差異同步）
+    // 未帶 cursor 時只返回目前游標，應先完整載入資料後再以游標輪詢
+    getChanges: async (params: {
+      user_email: string;
+      cursor?: string | null;
+      machine_id?: string;
+      start_date?: string;
+      end_date?: string;
+      limit?: number;
+    }): Promise<{
+      changes: {
+        seq: number;
+        booking_id: string;
+        machine_id: string;
+        user_email: string;
+        is_mine: boolean;
+        time_slot: string;
+        change_type: 'created' | 'cancelled' | 'deleted' | 'updated';
+        status: string | null;
+        changed_at: string | null;
+      }[];
+      cursor: string;
+      has_more: boolean;
+    }> => {
+      const url = new URL(API_ENDPOINTS.BOOKING_CHANGES);
+      if (params.cursor) {
+        url.searchParams.append('cursor', params.cursor);
+      }
+      if (params.machine_id) {
+        url.searchParams.append('machine_id', params.machine_id);
+      }
+      if (params.start_date) {
+        url.searchParams.append('start_date', params.start_date);
+      }
+      if (params.end_date) {
+        url.searchParams.append('end_date', params.end_date);
+      }
+      if (params.limit) {
+        url.searchParams.append('limit', String(params.limit));
+      }
+
+      return fetchWithAuth(url.toString(), {
+        headers: {
+          'X-User-Email': params.user_email,
+        },
+      });
+    },
+
+    // 訂閱機器的預約變更（SSE），斷線時瀏覽器會帶 Last-Event-ID 自動重連並補送變更
+    openChangeStream: (params: {
+      user_email: string;
+      machine_ids?: string[];
+    }): EventSource => {
+      const url = new URL(API_ENDPOINTS.BOOKING_STREAM);
+      // EventSource 無法帶自訂 header，以查詢參數傳遞用戶郵箱
+      url.searchParams.append('user_email', params.user_email);
+      if (params.machine_ids && params.machine_ids.length > 0) {
+        url.searchParams.append('machine_ids', params.machine_ids.join(','));
+      }
+      return new EventSource(url.toString());
+    },
+
     // 取消預約
     cancel: async (bookingId: string, userEmail: string): Promise<void> => {
       return fetchWithAuth(API_ENDPOINTS.BOOKING_BY_ID(bookingId), {
@@ -275,9 +556,21 @@ export const api = {
     },
 
     // 獲取特定用戶的所有預約
-    getUserBookingsByEmail: async (userEmail: string): Promise<any> => {
+    // 可選：時間範圍、狀態
+    getUserBookingsByEmail: async (userEmail: string, options: {
+      start_time?: string;
+      end_time?: string;
+      status?: string;
+    } = {}): Promise<any> => {
       const { API_URL } = await import('@/config/api');
-      return fetchWithAuth(`${API_URL}/users/${encodeURIComponent(userEmail)}/bookings`);
+      const params = new URLSearchParams();
+      Object.entries(options).forEach(([key, value]) => {
+        if (value !== undefined && value !== null && value !== '') {
+          params.append(key, String(value));
+        }
+      });
+      const query = params.toString();
+      return fetchWithAuth(`${API_URL}/users/${encodeURIComponent(userEmail)}/bookings${query ? `?${query}` : ''}`);
     },
 
     // 獲取特定用戶的月度預約
@@ -297,12 +590,22 @@ export const api = {
         headers['X-User-Email'] = userEmail;
       }
 
-      return fetchWithAuth(
-        API_ENDPOINTS.MACHINE_BOOKINGS(machineId, startDate, endDate),
+      // 以欄式格式傳輸，bookedSlots 由 bookingDetails 的時段還原
+      const response = await fetchWithAuth(
+        `${API_ENDPOINTS.MACHINE_BOOKINGS(machineId, startDate, endDate)}&format=columnar`,
         {
           headers
         }
       );
+      if (response && response.format === 'columnar') {
+        const bookingDetails = expandColumnar(response.bookingDetails || {});
+        return {
+          ...response,
+          bookedSlots: response.bookingDetails?.time_slot || [],
+          bookingDetails,
+        };
+      }
+      return response;
     },
   },
 